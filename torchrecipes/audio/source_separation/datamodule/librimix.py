@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from typing import (
+    Any,
     Optional,
+    Union,
 )
 
 import pytorch_lightning as pl
@@ -13,6 +15,7 @@ from torchrecipes.utils.config_utils import (
     config_entry,
     get_class_config_method,
 )
+from torchrecipes.utils.loader_autotune import resolve_num_workers
 
 from .test_dataset import TestDataset
 from .utils import CollateFn
@@ -27,8 +30,9 @@ class LibriMixDataModule(pl.LightningDataModule):
         num_speakers: int = 2,
         sample_rate: int = 8000,
         task: str = "sep_clean",
-        num_workers: int = 4,
+        num_workers: Union[int, str] = 4,
         testing: bool = False,
+        autotune_memory_budget: Optional[int] = None,
     ) -> None:
         """The LightningDataModule for LibriMix Dataset.
         Args:
@@ -43,9 +47,13 @@ class LibriMixDataModule(pl.LightningDataModule):
             task (str, optional): the task of LibriMix.
                 Options: [``enh_single``, ``enh_both``, ``sep_clean``, ``sep_noisy``]
                 (Default: ``sep_clean``)
-            num_workers (int, optional): the number of workers for each dataloader. (Default: 4)
+            num_workers (int or str, optional): the number of workers for each dataloader, or
+                ``"auto"`` to pick it in ``setup`` by timing a short probe of the dataloader.
+                (Default: 4)
             testing (bool, optional): To test the training recipe. If set to ``True``, the dataset will
                 output random Tensors without need of the real dataset. (Default: ``False``)
+            autotune_memory_budget (int, optional): the maximum peak RSS in bytes of the
+                ``"auto"`` num_workers. (Default: ``None``, half of the available memory)
         """
         super().__init__()
         self.root_dir = root_dir
@@ -56,6 +64,7 @@ class LibriMixDataModule(pl.LightningDataModule):
         self.task = task
         self.num_workers = num_workers
         self.testing = testing
+        self.autotune_memory_budget = autotune_memory_budget
 
     @config_entry
     @staticmethod
@@ -66,8 +75,9 @@ class LibriMixDataModule(pl.LightningDataModule):
         num_speakers: int = 2,
         sample_rate: int = 8000,
         task: str = "sep_clean",
-        num_workers: int = 8,
+        num_workers: Union[int, str] = 8,
         testing: bool = False,
+        autotune_memory_budget: Optional[int] = None,
     ) -> "LibriMixDataModule":
         return LibriMixDataModule(
             root_dir,
@@ -78,6 +88,7 @@ class LibriMixDataModule(pl.LightningDataModule):
             task,
             num_workers,
             testing,
+            autotune_memory_budget,
         )
 
     def setup(self, stage: Optional[str] = None):
@@ -111,12 +122,35 @@ class LibriMixDataModule(pl.LightningDataModule):
                     self.task,
                 )
 
-    def train_dataloader(self):
+        if stage == "test":
+            make_loader = self.test_dataloader
+        elif stage == "fit" or stage is None:
+            make_loader = self.train_dataloader
+        else:
+            return
+        self.num_workers = resolve_num_workers(
+            self.num_workers,
+            make_loader,
+            {
+                "datamodule": type(self).__name__,
+                "stage": stage,
+                "root_dir": self.root_dir,
+                "batch_size": self.batch_size,
+                "tr_split": self.tr_split,
+                "num_speakers": self.num_speakers,
+                "sample_rate": self.sample_rate,
+                "task": self.task,
+                "testing": self.testing,
+            },
+            self.autotune_memory_budget,
+        )
+
+    def train_dataloader(self, num_workers: Optional[int] = None):
         return DataLoader(
             self.train,
             batch_size=self.batch_size,
             collate_fn=CollateFn(sample_rate=self.sample_rate, duration=3),
-            num_workers=self.num_workers,
+            num_workers=self.num_workers if num_workers is None else num_workers,
             drop_last=True,
         )
 
@@ -129,12 +163,12 @@ class LibriMixDataModule(pl.LightningDataModule):
             drop_last=True,
         )
 
-    def test_dataloader(self):
+    def test_dataloader(self, num_workers: Optional[int] = None):
         return DataLoader(
             self.test,
             batch_size=self.batch_size,
             collate_fn=CollateFn(sample_rate=self.sample_rate, duration=-1),
-            num_workers=self.num_workers,
+            num_workers=self.num_workers if num_workers is None else num_workers,
         )
 
 
@@ -148,8 +182,9 @@ class LibriMixDataModuleConf(DataModuleConf):
     num_speakers: int = 2
     sample_rate: int = 8000
     task: str = "sep_clean"
-    num_workers: int = 4
+    num_workers: Any = 4  # pyre-ignore[4]: Union[int, str]
     testing: bool = False
+    autotune_memory_budget: Optional[int] = None
 
 
 cs = ConfigStore().instance()
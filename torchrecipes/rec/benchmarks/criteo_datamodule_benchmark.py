@@ -0,0 +1,283 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Throughput and latency benchmark of the CriteoDataModule train dataloader.
+
+Writes a synthetic Criteo TSV day file (unless ``--dataset_path`` points to an
+existing dataset), then iterates the train dataloader for every combination of
+the swept settings and reports rows/s, batches/s, p50/p99 batch latency and peak
+RSS as JSON. Every combination runs in a fresh process, so that peak RSS is
+measured per combination.
+
+Example:
+    python -m torchrecipes.rec.benchmarks.criteo_datamodule_benchmark \
+        --num_rows 1000000 --batch_sizes 2048,8192 --num_workers 0,4 \
+        --undersampling_rates none,0.5 --output /tmp/criteo_loader.json
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from torchrec.datasets.criteo import DEFAULT_CAT_NAMES, DEFAULT_INT_NAMES
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+
+# seconds between checks that the process of an isolated run is alive
+_POLL_SECONDS = 1.0
+
+
+def write_synthetic_tsv(
+    path: str,
+    num_rows: int,
+    empty_fraction: float = 0.05,
+    seed: int = 0,
+    chunk_size: int = 100_000,
+) -> None:
+    """Writes ``num_rows`` random labeled rows in the Criteo TSV format."""
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        for start in range(0, num_rows, chunk_size):
+            size = min(chunk_size, num_rows - start)
+            labels = rng.integers(0, 2, size)
+            dense = rng.integers(0, 1000, (size, len(DEFAULT_INT_NAMES)))
+            sparse = rng.integers(0, 1 << 32, (size, len(DEFAULT_CAT_NAMES)))
+            empty = rng.random((size, len(DEFAULT_CAT_NAMES))) < empty_fraction
+            lines = []
+            for label, ints, ids, missing in zip(labels, dense, sparse, empty):
+                cats = ("" if m else "%08x" % i for i, m in zip(ids, missing))
+                lines.append("\t".join([str(label), *map(str, ints), *cats]) + "\n")
+            f.writelines(lines)
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_config(
+    dataset_path: str,
+    config: Dict[str, Any],  # pyre-ignore[2]
+    max_batches: Optional[int] = None,
+    warmup_batches: int = 1,
+) -> Dict[str, Any]:  # pyre-ignore[3]
+    """Iterates the train dataloader of a ``CriteoDataModule`` built with
+    ``config`` and measures it. The first ``warmup_batches`` batches, which
+    include starting the dataloader workers, are not measured."""
+    dm = CriteoDataModule(num_days=1, dataset_path=dataset_path, seed=0, **config)
+    dm.setup(stage="fit")
+    latencies = []
+    rows = 0
+    it = iter(dm.train_dataloader())
+    last = time.perf_counter()
+    # without warmup, the measurement includes the first batch
+    start = last if warmup_batches == 0 else None
+    while max_batches is None or len(latencies) < max_batches:
+        try:
+            batch = next(it)
+        except StopIteration:
+            break
+        now = time.perf_counter()
+        if warmup_batches > 0:
+            warmup_batches -= 1
+            start = now
+        else:
+            latencies.append(now - last)
+            rows += len(batch.labels)
+        last = now
+    del it
+    measured = start is not None and len(latencies) > 0
+    elapsed = last - start if measured else 0.0
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        **config,
+        "batches": len(latencies),
+        "rows": rows,
+        "rows_per_sec": rows / elapsed if measured else None,
+        "batches_per_sec": len(latencies) / elapsed if measured else None,
+        "p50_ms": float(np.percentile(latencies_ms, 50)) if measured else None,
+        "p99_ms": float(np.percentile(latencies_ms, 99)) if measured else None,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_worker_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _run_config_in_queue(
+    queue: "multiprocessing.Queue[Any]",  # pyre-ignore[2]
+    *args: Any,  # pyre-ignore[2]
+) -> None:
+    try:
+        queue.put((run_config(*args), None))
+    except BaseException:
+        # exceptions may not pickle, their traceback does
+        queue.put((None, traceback.format_exc()))
+
+
+def _run_isolated(*args: Any) -> Dict[str, Any]:  # pyre-ignore[2, 3]
+    # a plain process rather than a pool, pool processes are daemonic and cannot
+    # start dataloader workers
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_run_config_in_queue, args=(result_queue, *args))
+    process.start()
+    try:
+        while True:
+            alive = process.is_alive()
+            try:
+                result, error = result_queue.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                # checked before the get, so that a result put right before
+                # exiting is not missed
+                if not alive:
+                    raise RuntimeError(
+                        f"Benchmark process of {args[1]} exited with code"
+                        f" {process.exitcode} without a result"
+                    )
+    finally:
+        if process.is_alive() and sys.exc_info()[0] is not None:
+            process.terminate()
+        process.join()
+    if error is not None:
+        raise RuntimeError(f"Benchmark process of {args[1]} failed:\n{error}")
+    return result
+
+
+def _sweep(argv_value: str, cast: Any) -> List[Any]:  # pyre-ignore[2, 3]
+    return [None if v == "none" else cast(v) for v in argv_value.split(",")]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CriteoDataModule benchmark")
+    parser.add_argument(
+        "--dataset_path",
+        type=str,
+        default=None,
+        help="criteo_1t dataset with a day_0.tsv to read. A synthetic day of"
+        " num_rows rows is written to a temporary directory if not set.",
+    )
+    parser.add_argument(
+        "--num_rows",
+        type=int,
+        default=200_000,
+        help="number of rows of the synthetic day",
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        type=str,
+        default="2048,8192",
+        help="Comma separated batch sizes to sweep.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=str,
+        default="0,2",
+        help="Comma separated numbers of dataloader workers to sweep.",
+    )
+    parser.add_argument(
+        "--read_chunk_sizes",
+        type=str,
+        default="100000",
+        help="Comma separated read buffer sizes in bytes to sweep.",
+    )
+    parser.add_argument(
+        "--pin_memory",
+        type=str,
+        default="0",
+        help="Comma separated pin_memory settings (0 or 1) to sweep.",
+    )
+    parser.add_argument(
+        "--undersampling_rates",
+        type=str,
+        default="none",
+        help="Comma separated undersampling rates to sweep, none disables"
+        " undersampling.",
+    )
+    parser.add_argument(
+        "--max_batches",
+        type=int,
+        default=None,
+        help="number of measured batches per setting, all batches if not set",
+    )
+    parser.add_argument(
+        "--warmup_batches",
+        type=int,
+        default=1,
+        help="number of batches read before measuring",
+    )
+    parser.add_argument(
+        "--no_isolation",
+        dest="isolate",
+        action="store_false",
+        help="Run every setting in this process. Faster, but peak RSS is then the"
+        " peak over all settings so far.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="path of the JSON report, printed if not set",
+    )
+    return parser.parse_args(argv)
+
+
+def _run_sweep(
+    args: argparse.Namespace, dataset_path: str
+) -> List[Dict[str, Any]]:  # pyre-ignore[3]
+    sweep = itertools.product(
+        _sweep(args.batch_sizes, int),
+        _sweep(args.num_workers, int),
+        _sweep(args.read_chunk_sizes, int),
+        _sweep(args.pin_memory, lambda v: bool(int(v))),
+        _sweep(args.undersampling_rates, float),
+    )
+    results = []
+    for batch_size, num_workers, read_chunk_size, pin_memory, rate in sweep:
+        config = {
+            "batch_size": batch_size,
+            "num_workers": num_workers,
+            "read_chunk_size": read_chunk_size,
+            "pin_memory": pin_memory,
+            "undersampling_rate": rate,
+        }
+        run_args = (dataset_path, config, args.max_batches, args.warmup_batches)
+        result = _run_isolated(*run_args) if args.isolate else run_config(*run_args)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    with contextlib.ExitStack() as stack:
+        dataset_path = args.dataset_path
+        if dataset_path is None:
+            dataset_path = stack.enter_context(tempfile.TemporaryDirectory())
+            write_synthetic_tsv(os.path.join(dataset_path, "day_0.tsv"), args.num_rows)
+        results = _run_sweep(args, dataset_path)
+
+    report = json.dumps({"dataset_path": dataset_path, "results": results}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,154 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Micro-benchmark of the Criteo batch transform.
+
+Compares the vectorized ``_transform`` with the row-by-row ``_transform_rowwise``
+on synthetic collated batches and checks that both produce the same ``Batch``. With ``--max_ids`` above 1, the
+categorical values are multi-hot lists of up to that many comma separated ids.
+
+Example:
+    python -m torchrecipes.rec.benchmarks.criteo_transform_benchmark \
+        --batch_sizes 8192,65536 --max_ids 4 --max_ids_per_feature 3
+"""
+
+import argparse
+import random
+import sys
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional, Union
+
+import torch
+from torchrec.datasets.criteo import (
+    DEFAULT_CAT_NAMES,
+    DEFAULT_INT_NAMES,
+    DEFAULT_LABEL_NAME,
+)
+from torchrec.datasets.utils import Batch
+from torchrecipes.rec.datamodules.criteo_datamodule import (
+    _transform,
+    _transform_rowwise,
+)
+
+
+def random_collated_batch(
+    batch_size: int, empty_fraction: float = 0.0, seed: int = 0, max_ids: int = 1
+) -> Dict[str, Union[List[str], torch.Tensor]]:
+    """Builds a batch shaped like the output of ``datapipe.batch(...).collate()``
+    over Criteo rows. Non-empty categorical values hold 1 to ``max_ids`` comma
+    separated ids."""
+    rng = random.Random(seed)
+    batch: Dict[str, Union[List[str], torch.Tensor]] = {
+        DEFAULT_LABEL_NAME: torch.randint(
+            0, 2, (batch_size,), generator=torch.Generator().manual_seed(seed)
+        )
+    }
+    for col_name in DEFAULT_INT_NAMES:
+        batch[col_name] = torch.tensor(
+            [rng.randint(-2, 1000) for _ in range(batch_size)]
+        )
+    for col_name in DEFAULT_CAT_NAMES:
+        batch[col_name] = [
+            ""
+            if rng.random() < empty_fraction
+            else ",".join(
+                "%08x" % rng.getrandbits(32) for _ in range(rng.randint(1, max_ids))
+            )
+            for _ in range(batch_size)
+        ]
+    return batch
+
+
+def batches_equal(a: Batch, b: Batch) -> bool:
+    return (
+        torch.equal(a.dense_features, b.dense_features)
+        and torch.equal(a.labels, b.labels)
+        and a.sparse_features.keys() == b.sparse_features.keys()
+        and torch.equal(a.sparse_features.values(), b.sparse_features.values())
+        and torch.equal(a.sparse_features.lengths(), b.sparse_features.lengths())
+    )
+
+
+def _time_ms(fn: Callable[[], Batch], iters: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - start) * 1000 / iters
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Criteo batch transform benchmark")
+    parser.add_argument(
+        "--batch_sizes",
+        type=str,
+        default="8192,16384,65536",
+        help="Comma separated batch sizes to benchmark.",
+    )
+    parser.add_argument(
+        "--iters", type=int, default=5, help="number of timed iterations"
+    )
+    parser.add_argument(
+        "--empty_fraction",
+        type=float,
+        default=0.05,
+        help="Fraction of empty categorical values.",
+    )
+    parser.add_argument(
+        "--num_embeddings",
+        type=int,
+        default=100_000,
+        help="The number of embeddings (hash size) of each sparse feature.",
+    )
+    parser.add_argument(
+        "--max_ids",
+        type=int,
+        default=1,
+        help="Maximum number of comma separated ids per categorical value.",
+    )
+    parser.add_argument(
+        "--max_ids_per_feature",
+        type=int,
+        default=None,
+        help="If set, multi-hot values are truncated to this many ids.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    max_ids_per_feature: Optional[List[int]] = (
+        None
+        if args.max_ids_per_feature is None
+        else [args.max_ids_per_feature] * len(DEFAULT_CAT_NAMES)
+    )
+    kwargs = {"num_embeddings": args.num_embeddings}
+    if args.max_ids > 1:
+        kwargs.update(multi_hot_delimiter=",", max_ids_per_feature=max_ids_per_feature)
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        batch = random_collated_batch(
+            batch_size, args.empty_fraction, max_ids=args.max_ids
+        )
+        rowwise = partial(_transform_rowwise, batch, **kwargs)
+        vectorized = partial(_transform, batch, **kwargs)
+        if not batches_equal(rowwise(), vectorized()):
+            raise AssertionError(
+                f"vectorized transform output differs for batch_size={batch_size}"
+            )
+        rowwise_ms = _time_ms(rowwise, args.iters)
+        vectorized_ms = _time_ms(vectorized, args.iters)
+        print(
+            f"batch_size={batch_size} rowwise={rowwise_ms:.2f}ms "
+            f"vectorized={vectorized_ms:.2f}ms "
+            f"speedup={rowwise_ms / vectorized_ms:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,236 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Memory and quality benchmark of the embedding data types of
+UnshardedLightningDLRM.
+
+Generates synthetic batches whose labels depend on hidden per-id effects, so
+that the embeddings have something to learn, then trains and tests a DLRM for
+every swept embedding data type and optimizer state data type. Reports the
+bytes of the embedding tables and of their optimizer state, the bytes saved and
+the test AUROC and NE deltas relative to fp32 as JSON.
+
+Example:
+    python -m torchrecipes.rec.benchmarks.embedding_precision_benchmark \
+        --data_types fp32,fp16,bf16,int8 --state_data_types fp32,bf16 \
+        --num_embeddings 100000 --output /tmp/embedding_precision.json
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+import pytorch_lightning as pl
+import torch
+from torch.utils.data import DataLoader
+from torchrec import EmbeddingBagCollection, KeyedJaggedTensor
+from torchrec.datasets.utils import Batch
+from torchrec.modules.embedding_configs import EmbeddingBagConfig
+from torchrecipes.rec.modules.embedding_precision import embedding_storage_bytes
+from torchrecipes.rec.modules.unsharded_lightning_dlrm import UnshardedLightningDLRM
+
+
+def make_batches(
+    num_batches: int,
+    batch_size: int,
+    num_features: int,
+    num_embeddings: int,
+    num_dense: int,
+    seed: int,
+) -> List[Batch]:
+    """Batches of one id per feature, drawn from a skewed distribution, whose
+    labels are drawn with the sigmoid of the sum of hidden effects of their
+    ids. The effects only depend on ``num_embeddings``, not on ``seed``."""
+    effects = torch.randn(
+        num_features,
+        num_embeddings,
+        generator=torch.Generator().manual_seed(num_embeddings),
+    )
+    generator = torch.Generator().manual_seed(seed)
+    batches = []
+    for _ in range(num_batches):
+        ids = (
+            torch.rand(batch_size, num_features, generator=generator).pow(2)
+            * num_embeddings
+        ).long()
+        logits = effects.gather(1, ids.t()).sum(0)
+        labels = (torch.rand(batch_size, generator=generator) < logits.sigmoid()).long()
+        batches.append(
+            Batch(
+                dense_features=torch.rand(batch_size, num_dense, generator=generator),
+                sparse_features=KeyedJaggedTensor.from_lengths_sync(
+                    keys=[f"f{i}" for i in range(num_features)],
+                    # feature major
+                    values=ids.t().reshape(-1),
+                    lengths=torch.ones(num_features * batch_size, dtype=torch.int32),
+                ),
+                labels=labels,
+            )
+        )
+    return batches
+
+
+def _state_bytes(optimizer: Any) -> int:  # pyre-ignore[2]
+    nbytes = 0
+    for name, keyed_optimizer in optimizer.optimizers:
+        if name != "embedding":
+            continue
+        for state in keyed_optimizer.state.values():
+            for value in state.values():
+                if isinstance(value, torch.Tensor):
+                    nbytes += value.numel() * value.element_size()
+    return nbytes
+
+
+def run_config(
+    args: argparse.Namespace, data_type: str, state_data_type: str
+) -> Dict[str, Any]:  # pyre-ignore[3]
+    """Trains and tests a DLRM with the ``data_type`` embedding tables."""
+    torch.manual_seed(args.seed)
+    ebc = EmbeddingBagCollection(
+        tables=[
+            EmbeddingBagConfig(
+                name=f"t{i}",
+                embedding_dim=args.embedding_dim,
+                num_embeddings=args.num_embeddings,
+                feature_names=[f"f{i}"],
+            )
+            for i in range(args.num_features)
+        ]
+    )
+    model = UnshardedLightningDLRM(
+        ebc,
+        dense_in_features=args.num_dense,
+        dense_arch_layer_sizes=[args.embedding_dim],
+        over_arch_layer_sizes=[16, 1],
+        embedding_optimizer=args.embedding_optimizer,
+        embedding_lr=args.embedding_lr,
+        embedding_data_type=data_type,
+        embedding_state_data_type=state_data_type,
+    )
+
+    def loader(num_batches: int, seed: int) -> DataLoader:
+        batches = make_batches(
+            num_batches,
+            args.batch_size,
+            args.num_features,
+            args.num_embeddings,
+            args.num_dense,
+            seed,
+        )
+        return DataLoader(batches, batch_size=None)
+
+    trainer = pl.Trainer(
+        max_epochs=args.epochs,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        logger=False,
+    )
+    start = time.perf_counter()
+    trainer.fit(
+        model,
+        train_dataloaders=loader(args.num_train_batches, args.seed),
+        val_dataloaders=loader(1, args.seed + 1),
+    )
+    train_seconds = time.perf_counter() - start
+    trainer.test(model, dataloaders=loader(args.num_test_batches, args.seed + 2))
+    return {
+        "data_type": data_type,
+        "state_data_type": state_data_type,
+        "embedding_bytes": embedding_storage_bytes(ebc),
+        "state_bytes": _state_bytes(trainer.optimizers[0]),
+        "train_seconds": train_seconds,
+        "test_auroc": trainer.callback_metrics["test_auroc"].item(),
+        "test_ne": trainer.callback_metrics["test_ne"].item(),
+    }
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="embedding data type benchmark")
+    parser.add_argument(
+        "--data_types",
+        type=str,
+        default="fp32,fp16,bf16,int8",
+        help="Comma separated embedding data types to sweep, the deltas are"
+        " relative to fp32.",
+    )
+    parser.add_argument(
+        "--state_data_types",
+        type=str,
+        default="fp32",
+        help="Comma separated optimizer state data types to sweep.",
+    )
+    parser.add_argument(
+        "--embedding_optimizer",
+        type=str,
+        default="rowwise_adam",
+        help="row-wise optimizer of the embeddings, rowwise_adagrad or rowwise_adam",
+    )
+    parser.add_argument(
+        "--embedding_lr", type=float, default=0.01, help="embedding learning rate"
+    )
+    parser.add_argument("--num_features", type=int, default=4)
+    parser.add_argument("--num_embeddings", type=int, default=10_000)
+    parser.add_argument("--embedding_dim", type=int, default=16)
+    parser.add_argument("--num_dense", type=int, default=4)
+    parser.add_argument("--batch_size", type=int, default=512)
+    parser.add_argument("--num_train_batches", type=int, default=200)
+    parser.add_argument("--num_test_batches", type=int, default=50)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="path of the JSON report, printed if not set",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    sweep = itertools.product(
+        args.data_types.split(","), args.state_data_types.split(",")
+    )
+    results = []
+    for data_type, state_data_type in sweep:
+        result = run_config(args, data_type, state_data_type)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    baseline = next(
+        (
+            r
+            for r in results
+            if r["data_type"] == "fp32" and r["state_data_type"] == "fp32"
+        ),
+        None,
+    )
+    if baseline is not None:
+        baseline_bytes = baseline["embedding_bytes"] + baseline["state_bytes"]
+        for result in results:
+            nbytes = result["embedding_bytes"] + result["state_bytes"]
+            result["saved_bytes"] = baseline_bytes - nbytes
+            result["saved_fraction"] = 1 - nbytes / baseline_bytes
+            result["auroc_delta"] = result["test_auroc"] - baseline["test_auroc"]
+            result["ne_delta"] = result["test_ne"] - baseline["test_ne"]
+
+    report = json.dumps({"args": vars(args), "results": results}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
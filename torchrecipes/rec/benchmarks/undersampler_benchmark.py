@@ -0,0 +1,116 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Micro-benchmark of the distribution undersamplers.
+
+Compares the row-by-row ``DistributionUnderSampler`` with the chunked
+``ColumnarDistributionUnderSampler`` on synthetic imbalanced labels, for several
+update intervals, and reports the rows/s of each. The chunked sampler with an
+update interval of 1 is checked to keep the same rows as the row-by-row one.
+
+Example:
+    python -m torchrecipes.rec.benchmarks.undersampler_benchmark \
+        --num_rows 1000000 --chunk_size 8192 --update_intervals 1,1024,none
+"""
+
+import argparse
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+from torchrecipes.rec.datamodules.samplers.undersampler import (
+    ColumnarDistributionUnderSampler,
+    DistributionUnderSampler,
+)
+
+
+def _rows_per_sec(make: Callable[[], Iterable[Any]], num_rows: int) -> float:
+    start = time.perf_counter()
+    for _ in make():
+        pass
+    return num_rows / (time.perf_counter() - start)
+
+
+def _kept_rows(chunks: Iterable[Dict[str, torch.Tensor]]) -> List[int]:
+    return [i for chunk in chunks for i in chunk["id"].tolist()]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Distribution undersampler benchmark")
+    parser.add_argument(
+        "--num_rows", type=int, default=200_000, help="number of sampled rows"
+    )
+    parser.add_argument(
+        "--chunk_size", type=int, default=8192, help="number of rows per chunk"
+    )
+    parser.add_argument(
+        "--positive_rate",
+        type=float,
+        default=0.03,
+        help="Fraction of rows with label 1, the others have label 0.",
+    )
+    parser.add_argument(
+        "--update_intervals",
+        type=str,
+        default="1,1024,none",
+        help="Comma separated update intervals of the chunked sampler, none"
+        " updates once per chunk.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    rng = np.random.default_rng(0)
+    labels = torch.from_numpy(
+        (rng.random(args.num_rows) < args.positive_rate).astype(np.int64)
+    )
+    chunks = [
+        {"id": torch.arange(start, start + len(chunk_labels)), "label": chunk_labels}
+        for start, chunk_labels in zip(
+            range(0, args.num_rows, args.chunk_size),
+            torch.split(labels, args.chunk_size),
+        )
+    ]
+    rows = [{"id": i, "label": label} for i, label in enumerate(labels.tolist())]
+    output_dist = {0: 0.5, 1: 0.5}
+
+    def rowwise() -> DistributionUnderSampler:
+        return DistributionUnderSampler(
+            rows, lambda row: row["label"], output_dist, seed=0
+        )
+
+    def columnar(
+        update_interval: Optional[int],
+    ) -> ColumnarDistributionUnderSampler:
+        return ColumnarDistributionUnderSampler(
+            chunks,
+            lambda chunk: chunk["label"],
+            output_dist,
+            seed=0,
+            update_interval=update_interval,
+        )
+
+    if [row["id"] for row in rowwise()] != _kept_rows(columnar(1)):
+        raise AssertionError("chunked sampler with update_interval=1 differs")
+
+    rowwise_rate = _rows_per_sec(rowwise, args.num_rows)
+    print(f"rowwise rows/s={rowwise_rate:,.0f}")
+    for value in args.update_intervals.split(","):
+        update_interval = None if value == "none" else int(value)
+        rate = _rows_per_sec(lambda: columnar(update_interval), args.num_rows)
+        print(
+            f"chunk_size={args.chunk_size} update_interval={value} "
+            f"rows/s={rate:,.0f} speedup={rate / rowwise_rate:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
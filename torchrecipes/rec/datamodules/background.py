@@ -0,0 +1,97 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import queue
+import threading
+from typing import Any, Generic, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# put by a Producer after the last chunk
+END = object()
+
+
+class Failure:
+    """Error raised while reading the iterable of a :class:`Producer`, raised
+    again by :meth:`Producer.get` in the consuming thread."""
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+class Producer(Generic[T]):
+    """Reads an iterable on a background thread into a bounded queue of chunks.
+
+    Args:
+        iterable: Iterable to read, e.g. a datapipe.
+        chunk_size: Number of items per chunk.
+        prefetch_depth: Number of chunks read ahead.
+        stop: Set by the consumer to stop the thread, e.g. when it stops early.
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[T],
+        chunk_size: int,
+        prefetch_depth: int,
+        stop: threading.Event,
+    ) -> None:
+        self.iterable = iterable
+        self.chunk_size = chunk_size
+        self.stop = stop
+        # pyre-ignore[4]
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=prefetch_depth)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # pyre-ignore[2]
+    def _put(self, item: Any) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            chunk = []
+            for item in self.iterable:
+                chunk.append(item)
+                if len(chunk) == self.chunk_size:
+                    if not self._put(chunk):
+                        return
+                    chunk = []
+            if chunk and not self._put(chunk):
+                return
+            self._put(END)
+        except BaseException as e:
+            self._put(Failure(e))
+
+    def get(self) -> Optional[List[T]]:
+        """The next chunk, ``None`` once the iterable is exhausted. Errors of the
+        iterable are raised."""
+        item = self.queue.get()
+        if item is END:
+            return None
+        if isinstance(item, Failure):
+            raise item.error
+        return item
+
+
+def prefetch(iterable: Iterable[T], prefetch_depth: int) -> Iterator[T]:
+    """Iterates ``iterable`` read up to ``prefetch_depth`` items ahead by a
+    :class:`Producer`, which stops when the iteration does."""
+    stop = threading.Event()
+    producer = Producer(iterable, 1, prefetch_depth, stop)
+    try:
+        while (chunk := producer.get()) is not None:
+            yield chunk[0]
+    finally:
+        stop.set()
@@ -0,0 +1,313 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""On-disk cache of transformed batches.
+
+A cached stream of batches is stored under ``{cache_dir}/{key}/{stream}``, where
+``key`` is a hash of the config producing the batches and ``stream`` the
+``(rank, worker_id)`` shard reading them. A stream is split into shards of
+consecutive batches, stored as contiguous ``.npy`` arrays that are memory-mapped
+on read. Shards are evicted least recently used first once the cache exceeds
+its size cap, a stream missing a shard is rebuilt from its source, also when
+the shard is evicted by another process while the stream is read. The rebuilt
+stream resumes after the batches already read, so the source must replay the
+same batches on every iteration, e.g. sample with a fixed seed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import IterDataPipe
+from torchrec.datasets.utils import Batch
+from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
+from torchrecipes.rec.datamodules.commons import WeightedBatch
+from torchrecipes.rec.datamodules.sharding import current_shard
+
+_MANIFEST = "manifest.json"
+_SHARD_PREFIX = "shard_"
+_COLUMNS: Tuple[str, ...] = ("dense", "labels", "values", "lengths", "index")
+# only stored for streams of WeightedBatch
+_WEIGHTS = "weights"
+DEFAULT_SHARD_BYTES: int = 64 << 20
+
+
+def cache_key(config: Mapping[str, Any]) -> str:  # pyre-ignore[2]
+    """Hashes a JSON serializable config into a cache key."""
+    blob = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def file_signature(path: str) -> List[Any]:  # pyre-ignore[3]
+    """Identifies the content of a file by its path, size and modification time."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _shard_dirs(cache_dir: str) -> List[str]:
+    return [
+        os.path.join(cache_dir, key, stream, shard)
+        for key in os.listdir(cache_dir)
+        if os.path.isdir(os.path.join(cache_dir, key))
+        for stream in os.listdir(os.path.join(cache_dir, key))
+        if os.path.isdir(os.path.join(cache_dir, key, stream))
+        for shard in os.listdir(os.path.join(cache_dir, key, stream))
+        if shard.startswith(_SHARD_PREFIX) and not shard.endswith(".tmp")
+    ]
+
+
+def _dir_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def _remove_emptied(shard: str) -> None:
+    """Removes the stream directory of an evicted shard, with its manifest, once
+    it holds no other shard, then the key directory, with its config, once it
+    holds no other stream."""
+    stream_dir = os.path.dirname(shard)
+    key_dir = os.path.dirname(stream_dir)
+    try:
+        # shards being written by other processes keep their stream
+        if any(name.startswith(_SHARD_PREFIX) for name in os.listdir(stream_dir)):
+            return
+        shutil.rmtree(stream_dir, ignore_errors=True)
+        if any(
+            os.path.isdir(os.path.join(key_dir, name)) for name in os.listdir(key_dir)
+        ):
+            return
+        shutil.rmtree(key_dir, ignore_errors=True)
+    except FileNotFoundError:
+        # removed by another process meanwhile
+        pass
+
+
+def evict(cache_dir: str, max_bytes: int) -> None:
+    """Deletes the least recently used shards of a cache until it holds at most
+    ``max_bytes``, and the streams and keys left without shards."""
+    shards = []
+    for shard in _shard_dirs(cache_dir):
+        try:
+            shards.append((os.stat(shard).st_mtime_ns, _dir_size(shard), shard))
+        except FileNotFoundError:
+            # evicted by another process meanwhile
+            continue
+    total = sum(size for _, size, _ in shards)
+    for _, size, shard in sorted(shards):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(shard, ignore_errors=True)
+        _remove_emptied(shard)
+        total -= size
+
+
+def _batch_bytes(batch: Batch) -> int:
+    tensors = [
+        batch.dense_features,
+        batch.labels,
+        batch.sparse_features.values(),
+        batch.sparse_features.lengths(),
+    ]
+    if isinstance(batch, WeightedBatch):
+        tensors.append(batch.weights)
+    return sum(tensor.nbytes for tensor in tensors)
+
+
+def _write_shard(path: str, batches: List[Batch]) -> None:
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {
+        "dense": torch.cat([b.dense_features for b in batches]),
+        "labels": torch.cat([b.labels for b in batches]),
+        "values": torch.cat([b.sparse_features.values() for b in batches]),
+        "lengths": torch.cat([b.sparse_features.lengths() for b in batches]),
+        # rows and sparse values of every batch
+        "index": torch.tensor(
+            [[len(b.labels), len(b.sparse_features.values())] for b in batches],
+            dtype=torch.int64,
+        ),
+    }
+    if isinstance(batches[0], WeightedBatch):
+        # pyre-ignore[16]
+        columns[_WEIGHTS] = torch.cat([b.weights for b in batches])
+    for name, column in columns.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), column.numpy())
+    os.replace(tmp, path)
+
+
+def _read_shard(path: str, keys: List[str]) -> Iterator[Batch]:
+    columns = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in _COLUMNS
+    }
+    weighted = os.path.exists(os.path.join(path, f"{_WEIGHTS}.npy"))
+    if weighted:
+        columns[_WEIGHTS] = np.load(
+            os.path.join(path, f"{_WEIGHTS}.npy"), mmap_mode="r"
+        )
+
+    def read(name: str, start: int, end: int) -> torch.Tensor:
+        # copies the rows out of the read-only mapping
+        return torch.from_numpy(np.array(columns[name][start:end]))
+
+    row, value = 0, 0
+    for num_rows, num_values in columns["index"].tolist():
+        batch = Batch(
+            dense_features=read("dense", row, row + num_rows),
+            sparse_features=KeyedJaggedTensor.from_lengths_sync(
+                keys,
+                read("values", value, value + num_values),
+                read("lengths", row * len(keys), (row + num_rows) * len(keys)),
+            ),
+            labels=read("labels", row, row + num_rows),
+        )
+        if weighted:
+            batch = WeightedBatch(
+                dense_features=batch.dense_features,
+                sparse_features=batch.sparse_features,
+                labels=batch.labels,
+                weights=read(_WEIGHTS, row, row + num_rows),
+            )
+        yield batch
+        row += num_rows
+        value += num_values
+
+
+class BatchCache(IterDataPipe[Batch]):
+    r""":class:`BatchCache`.
+
+    Iterable datapipe caching the batches of a datapipe on disk. The first
+    complete iteration of every ``(rank, worker_id)`` shard reads the source
+    datapipe and writes its batches, later iterations, including those of later
+    runs with the same config, read them back from memory-mapped files. An
+    iteration stopped early does not complete the cache. A cached iteration
+    replays the batches of the first one, including their order and sampling.
+    A stream whose shard is evicted while it is read is rebuilt by iterating
+    ``datapipe`` again and skipping the batches already read, so ``datapipe``
+    must yield the same batches on every iteration.
+
+    Args:
+        datapipe: Deterministic datapipe of batches whose sparse features share
+            the same keys.
+        cache_dir: Root directory of the cache.
+        config: JSON serializable description of everything the batches of
+            ``datapipe`` depend on, batches of a different config are never read.
+        max_bytes: If not ``None``, least recently used shards are deleted
+            whenever the cache grows beyond this size.
+        shard_bytes: Bytes of batches per shard. Batches are held in memory
+            until their shard is written.
+        shard_batches: If not ``None``, maximum number of batches per shard.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[Batch],
+        cache_dir: str,
+        config: Mapping[str, Any],  # pyre-ignore[2]
+        max_bytes: Optional[int] = None,
+        shard_bytes: int = DEFAULT_SHARD_BYTES,
+        shard_batches: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        if shard_bytes < 1:
+            raise ValueError(f"shard_bytes {shard_bytes} must be positive")
+        if shard_batches is not None and shard_batches < 1:
+            raise ValueError(f"shard_batches {shard_batches} must be positive")
+        self.datapipe = datapipe
+        self.cache_dir = cache_dir
+        self.config: Dict[str, Any] = dict(config)  # pyre-ignore[4]
+        self.key: str = cache_key(config)
+        self.max_bytes = max_bytes
+        self.shard_bytes = shard_bytes
+        self.shard_batches = shard_batches
+        self.rank = rank
+        self.world_size = world_size
+
+    def _stream_dir(self) -> str:
+        shard_id, num_shards = current_shard(self.rank, self.world_size)
+        return os.path.join(
+            self.cache_dir, self.key, f"stream_{shard_id}_of_{num_shards}"
+        )
+
+    def _cached_shards(self, stream_dir: str) -> Optional[Tuple[List[str], List[str]]]:
+        try:
+            with open(os.path.join(stream_dir, _MANIFEST), "r") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        shards = [
+            os.path.join(stream_dir, f"{_SHARD_PREFIX}{i}")
+            for i in range(manifest["num_shards"])
+        ]
+        if not all(os.path.isdir(shard) for shard in shards):
+            return None
+        return shards, manifest["keys"]
+
+    def __iter__(self) -> Iterator[Batch]:
+        stream_dir = self._stream_dir()
+        cached = self._cached_shards(stream_dir)
+        if cached is None:
+            yield from self._fill(stream_dir)
+            return
+        shards, keys = cached
+        num_read = 0
+        try:
+            for shard in shards:
+                # the modification time of a shard is its last use
+                os.utime(shard)
+                for batch in _read_shard(shard, keys):
+                    yield batch
+                    num_read += 1
+        except FileNotFoundError:
+            # evicted by another rank or worker meanwhile
+            yield from self._fill(stream_dir, skip=num_read)
+
+    def _fill(self, stream_dir: str, skip: int = 0) -> Iterator[Batch]:
+        """Writes the stream from the source datapipe, yielding its batches
+        after the first ``skip`` ones."""
+        shutil.rmtree(stream_dir, ignore_errors=True)
+        os.makedirs(stream_dir)
+        num_shards = 0
+        keys: List[str] = []
+        pending: List[Batch] = []
+        pending_bytes = 0
+        for i, batch in enumerate(self.datapipe):
+            if i >= skip:
+                yield batch
+            keys = batch.sparse_features.keys()
+            pending.append(batch)
+            pending_bytes += _batch_bytes(batch)
+            if pending_bytes >= self.shard_bytes or len(pending) == self.shard_batches:
+                self._write(stream_dir, num_shards, pending)
+                num_shards += 1
+                pending = []
+                pending_bytes = 0
+        if pending:
+            self._write(stream_dir, num_shards, pending)
+            num_shards += 1
+        # removed by the eviction of other processes if all shards were evicted
+        os.makedirs(stream_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, self.key, "config.json"), "w") as f:
+            json.dump(self.config, f, sort_keys=True, default=str)
+        tmp = os.path.join(stream_dir, _MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"num_shards": num_shards, "keys": keys}, f)
+        os.replace(tmp, os.path.join(stream_dir, _MANIFEST))
+
+    def _write(self, stream_dir: str, shard: int, batches: List[Batch]) -> None:
+        _write_shard(os.path.join(stream_dir, f"{_SHARD_PREFIX}{shard}"), batches)
+        max_bytes = self.max_bytes
+        if max_bytes is not None:
+            evict(self.cache_dir, max_bytes)
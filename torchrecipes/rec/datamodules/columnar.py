@@ -0,0 +1,108 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Helpers for columnar chunks of rows.
+
+A columnar chunk maps column names to tensors, numpy arrays or lists holding the
+same number of rows, e.g. the output of ``datapipe.batch(n).collate()`` over rows
+of dicts. Row operations convert the columns to numpy arrays and back to their
+original type.
+"""
+
+from typing import Any, Dict, Iterator, List, Mapping, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import IterDataPipe
+
+Chunk = Mapping[str, Any]
+
+
+def to_numpy(value: Any) -> np.ndarray:  # pyre-ignore[2]
+    if isinstance(value, torch.Tensor):
+        return value.numpy()
+    if isinstance(value, np.ndarray):
+        return value
+    # e.g. the lists of strings of collated categorical columns, an object array
+    # only holds references, the strings are not copied
+    array = np.empty(len(value), dtype=object)
+    array[:] = value
+    return array
+
+
+def like(value: Any, array: np.ndarray) -> Any:  # pyre-ignore[2, 3]
+    """Converts ``array`` back to the type of the column ``value``."""
+    if isinstance(value, torch.Tensor):
+        return torch.from_numpy(array)
+    if isinstance(value, np.ndarray):
+        return array
+    return array.tolist()
+
+
+def num_rows(chunk: Chunk) -> int:
+    return len(next(iter(chunk.values())))
+
+
+def filter_rows(chunk: Chunk, mask: np.ndarray) -> Dict[str, Any]:
+    """Keeps the rows of a chunk where ``mask`` is true."""
+    return {key: like(value, to_numpy(value)[mask]) for key, value in chunk.items()}
+
+
+def concat_rows(chunks: Sequence[Chunk]) -> Dict[str, Any]:
+    """Concatenates the rows of chunks with the same columns."""
+    return {
+        key: like(value, np.concatenate([to_numpy(chunk[key]) for chunk in chunks]))
+        for key, value in chunks[0].items()
+    }
+
+
+class ColumnarBatcher(IterDataPipe[Dict[str, Any]]):
+    r""":class:`ColumnarBatcher`.
+
+    Iterable datapipe regrouping the rows of columnar chunks of any size, e.g.
+    filtered ones, into chunks of ``batch_size`` rows. The last chunk may be
+    smaller.
+
+    Args:
+        datapipe: Datapipe of columnar chunks.
+        batch_size: Number of rows per output chunk.
+    """
+
+    def __init__(self, datapipe: IterDataPipe[Chunk], batch_size: int) -> None:
+        if batch_size < 1:
+            raise ValueError(f"batch_size {batch_size} must be positive")
+        self.datapipe = datapipe
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        pending: List[Chunk] = []
+        pending_rows = 0
+        for chunk in self.datapipe:
+            size = num_rows(chunk)
+            if size == 0:
+                continue
+            if not pending and size == self.batch_size:
+                # nothing to regroup
+                yield dict(chunk)
+                continue
+            pending.append(chunk)
+            pending_rows += size
+            if pending_rows < self.batch_size:
+                continue
+            rows = concat_rows(pending)
+            start = 0
+            while pending_rows - start >= self.batch_size:
+                end = start + self.batch_size
+                yield {key: value[start:end] for key, value in rows.items()}
+                start = end
+            pending = [{key: value[start:] for key, value in rows.items()}]
+            pending_rows -= start
+            if pending_rows == 0:
+                pending = []
+        if pending:
+            yield concat_rows(pending)
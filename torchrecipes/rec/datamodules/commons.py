@@ -7,6 +7,7 @@
 from dataclasses import dataclass
 
 import torch
+import torchrec.datasets.utils as torchrec_utils
 from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
 
 
@@ -38,3 +39,35 @@ class Batch:
             sparse_features=self.sparse_features.pin_memory(),
             labels=self.labels.pin_memory(),
         )
+
+
+@dataclass
+class WeightedBatch(torchrec_utils.Batch):
+    """``Batch`` of :mod:`torchrec.datasets.utils` carrying a weight per row, e.g.
+    the inverse of the probability with which the row was sampled."""
+
+    weights: torch.Tensor
+
+    def to(self, device: torch.device, non_blocking: bool = False) -> "WeightedBatch":
+        return WeightedBatch(
+            dense_features=self.dense_features.to(
+                device=device, non_blocking=non_blocking
+            ),
+            sparse_features=self.sparse_features.to(
+                device=device, non_blocking=non_blocking
+            ),
+            labels=self.labels.to(device=device, non_blocking=non_blocking),
+            weights=self.weights.to(device=device, non_blocking=non_blocking),
+        )
+
+    def record_stream(self, stream: torch.cuda.streams.Stream) -> None:
+        super().record_stream(stream)
+        self.weights.record_stream(stream)
+
+    def pin_memory(self) -> "WeightedBatch":
+        return WeightedBatch(
+            dense_features=self.dense_features.pin_memory(),
+            sparse_features=self.sparse_features.pin_memory(),
+            labels=self.labels.pin_memory(),
+            weights=self.weights.pin_memory(),
+        )
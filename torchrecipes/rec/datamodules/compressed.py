@@ -0,0 +1,322 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Reading of gzip and zstd compressed line oriented files.
+
+Files are decompressed on background threads into a bounded queue of blocks
+that the line parser consumes, so decompression overlaps parsing and at most
+``prefetch_depth`` decompressed blocks are held per file.
+
+zstd files in the `seekable format
+<https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md>`_,
+i.e. independent frames followed by a seek table of their sizes, can be read
+from any decompressed byte offset: only the frames from that offset on are
+decompressed, several at a time on a thread pool. Other files (``.gz``, ``.zst``
+without seek table) can only be decompressed from the start. Running this module
+recompresses such files into seekable zstd ones. Reading or writing ``.zst``
+files requires the ``zstandard`` package.
+
+Example:
+    python -m torchrecipes.rec.datamodules.compressed \
+        --input /data/criteo/day_0.gz --output /data/criteo/day_0.tsv.zst
+"""
+
+import argparse
+import gzip
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Deque, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from torchrecipes.rec.datamodules.background import prefetch
+
+COMPRESSED_EXTENSIONS: Tuple[str, ...] = (".zst", ".gz")
+
+# seekable zstd format constants
+_SKIPPABLE_MAGIC = 0x184D2A5E
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_SKIPPABLE_HEADER: struct.Struct = struct.Struct("<II")
+_SEEK_TABLE_FOOTER: struct.Struct = struct.Struct("<IBI")
+_SEEK_TABLE_ENTRY: struct.Struct = struct.Struct("<II")
+_CHECKSUM_FLAG = 0x80
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def find_file(path: str) -> str:
+    """Returns ``path`` if it exists, else the first existing compressed version
+    of it, e.g. ``day_0.tsv.zst`` or ``day_0.gz`` for ``day_0.tsv``. ``path`` is
+    returned if none exists."""
+    if os.path.exists(path):
+        return path
+    stem = os.path.splitext(path)[0]
+    for candidate in (path, stem):
+        for extension in COMPRESSED_EXTENSIONS:
+            if os.path.exists(candidate + extension):
+                return candidate + extension
+    return path
+
+
+# pyre-ignore[3]
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "Reading or writing .zst files requires the zstandard package, "
+            "install it with `pip install zstandard`."
+        ) from e
+    return zstandard
+
+
+def read_seek_table(path: str) -> Optional[np.ndarray]:
+    """Reads the seek table of a seekable zstd file.
+
+    Returns:
+        A ``[num_frames + 1, 2]`` int64 array of the compressed and decompressed
+        offsets of the frames, followed by the sizes of the whole file, or
+        ``None`` if the file has no seek table.
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < _SKIPPABLE_HEADER.size + _SEEK_TABLE_FOOTER.size:
+            return None
+        f.seek(size - _SEEK_TABLE_FOOTER.size)
+        num_frames, descriptor, magic = _SEEK_TABLE_FOOTER.unpack(
+            f.read(_SEEK_TABLE_FOOTER.size)
+        )
+        if magic != _SEEKABLE_MAGIC:
+            return None
+        entry_size = _SEEK_TABLE_ENTRY.size + (4 if descriptor & _CHECKSUM_FLAG else 0)
+        table_size = num_frames * entry_size + _SEEK_TABLE_FOOTER.size
+        table_start = size - table_size - _SKIPPABLE_HEADER.size
+        if table_start < 0:
+            return None
+        f.seek(table_start)
+        skippable_magic, frame_size = _SKIPPABLE_HEADER.unpack(
+            f.read(_SKIPPABLE_HEADER.size)
+        )
+        if skippable_magic != _SKIPPABLE_MAGIC or frame_size != table_size:
+            return None
+        entries = np.frombuffer(f.read(num_frames * entry_size), dtype="<u4")
+    sizes = entries.reshape(num_frames, entry_size // 4)[:, :2].astype(np.int64)
+    offsets = np.zeros((num_frames + 1, 2), dtype=np.int64)
+    np.cumsum(sizes, axis=0, out=offsets[1:])
+    return offsets
+
+
+def write_seekable_zstd(
+    blocks: Iterable[bytes],
+    path: str,
+    frame_size: int = 1 << 22,
+    level: int = 3,
+) -> int:
+    """Compresses ``blocks`` into a seekable zstd file of independent frames of
+    ``frame_size`` decompressed bytes.
+
+    Returns:
+        The number of frames written.
+    """
+    if frame_size < 1:
+        raise ValueError(f"frame_size {frame_size} must be positive")
+    compressor = _zstandard().ZstdCompressor(level=level)
+    entries = []
+    pending = bytearray()
+
+    def write_frame(f: BinaryIO, data: bytes) -> None:
+        frame = compressor.compress(data)
+        f.write(frame)
+        entries.append(_SEEK_TABLE_ENTRY.pack(len(frame), len(data)))
+
+    with open(path, "wb") as f:
+        for block in blocks:
+            pending += block
+            while len(pending) >= frame_size:
+                write_frame(f, bytes(pending[:frame_size]))
+                del pending[:frame_size]
+        if pending:
+            write_frame(f, bytes(pending))
+        table = b"".join(entries) + _SEEK_TABLE_FOOTER.pack(
+            len(entries), 0, _SEEKABLE_MAGIC
+        )
+        f.write(_SKIPPABLE_HEADER.pack(_SKIPPABLE_MAGIC, len(table)))
+        f.write(table)
+    return len(entries)
+
+
+def _open_stream(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        # pyre-ignore[7]
+        return gzip.open(path, "rb")
+    f = open(path, "rb")
+    return _zstandard().ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+
+def read_blocks(path: str, block_size: int = 1 << 20) -> Iterator[bytes]:
+    """Decompresses a file from the start, in blocks of ``block_size`` bytes.
+    Plain files are read as they are."""
+    with (_open_stream(path) if is_compressed(path) else open(path, "rb")) as f:
+        while block := f.read(block_size):
+            yield block
+
+
+def _read_frame(path: str, offset: int, size: int, decompressed_size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size)
+    # decompression contexts are not thread safe, one per frame
+    return (
+        _zstandard()
+        .ZstdDecompressor()
+        .decompress(data, max_output_size=decompressed_size)
+    )
+
+
+def _read_frames(
+    path: str, offsets: np.ndarray, first: int, num_threads: int, prefetch_depth: int
+) -> Iterator[bytes]:
+    """Decompresses the frames of a seekable zstd file from the ``first`` one on,
+    up to ``prefetch_depth`` frames ahead on ``num_threads`` threads."""
+    futures: Deque["Future[bytes]"] = deque()
+    num_frames = len(offsets) - 1
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        try:
+            frame = first
+            while frame < num_frames or futures:
+                while frame < num_frames and len(futures) < prefetch_depth:
+                    (offset, decompressed), (end, decompressed_end) = offsets[
+                        frame : frame + 2
+                    ].tolist()
+                    futures.append(
+                        executor.submit(
+                            _read_frame,
+                            path,
+                            offset,
+                            end - offset,
+                            decompressed_end - decompressed,
+                        )
+                    )
+                    frame += 1
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _split_lines(
+    blocks: Iterable[bytes], offset: int, start: int, end: Optional[int]
+) -> Iterator[Tuple[int, bytes]]:
+    """Yields the ``(offset, line)`` pairs of the lines starting in ``[start, end)``
+    of the data of ``blocks``, which starts at byte ``offset``. The lines keep
+    their newline."""
+    pending = b""
+    for block in blocks:
+        data = pending + block
+        if offset + len(data) <= start:
+            # only the line crossing into the next block is needed
+            cut = data.rfind(b"\n") + 1
+            pending = data[cut:]
+            offset += cut
+            continue
+        lines = data.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if end is not None and offset >= end:
+                return
+            if offset >= start:
+                yield offset, line + b"\n"
+            offset += len(line) + 1
+    if pending and offset >= start and (end is None or offset < end):
+        # the last line may not be terminated
+        yield offset, pending
+
+
+def read_lines(
+    path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    num_threads: int = 1,
+    prefetch_depth: int = 4,
+    block_size: int = 1 << 20,
+) -> Iterator[Tuple[int, bytes]]:
+    """Yields the ``(offset, line)`` pairs of the lines of a compressed file
+    starting in ``[start, end)``, where ``offset`` is the byte offset of the line
+    in the decompressed data.
+
+    Args:
+        path: Path of a ``.gz`` or ``.zst`` file.
+        start: Decompressed byte offset of the first line to read.
+        end: If not ``None``, no line starting at or after this offset is read.
+        num_threads: Number of threads decompressing the frames of seekable zstd
+            files. Other files are decompressed by a single thread.
+        prefetch_depth: Number of blocks or frames decompressed ahead.
+        block_size: Size in bytes of the decompressed blocks of files without
+            seek table.
+    """
+    if num_threads < 1 or prefetch_depth < 1:
+        raise ValueError("num_threads and prefetch_depth must be positive.")
+    offsets = read_seek_table(path) if path.endswith(".zst") else None
+    if offsets is None:
+        blocks = prefetch(read_blocks(path, block_size), prefetch_depth)
+        yield from _split_lines(blocks, 0, start, end)
+        return
+    decompressed = offsets[:, 1]
+    # the frame holding byte start - 1, which tells whether a line starts at start
+    first = int(np.searchsorted(decompressed, max(start - 1, 0), side="right")) - 1
+    yield from _split_lines(
+        _read_frames(path, offsets, first, num_threads, prefetch_depth),
+        int(decompressed[first]),
+        start,
+        end,
+    )
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Seekable zstd recompressor")
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="the path of the plain, gzip or zstd file to recompress",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="the path of the seekable zstd file to write",
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=int,
+        default=1 << 22,
+        help="number of decompressed bytes per frame, the unit of seeking",
+    )
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=3,
+        help="zstd compression level",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    num_frames = write_seekable_zstd(
+        read_blocks(args.input), args.output, args.frame_size, args.level
+    )
+    print(f"Wrote {args.output}: {num_frames} frames")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
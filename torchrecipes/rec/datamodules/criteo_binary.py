@@ -0,0 +1,101 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import json
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.sharding import current_shard, shard_range
+
+# Every converted file (e.g. ``day_0.tsv``) is stored as the columns below, named
+# ``{prefix}_{column}.npy`` where prefix is the file name without extension
+# (e.g. ``day_0``), plus a ``{prefix}_meta.json`` describing the conversion.
+DENSE_COLUMN = "dense"
+SPARSE_COLUMN = "sparse"
+LABELS_COLUMN = "labels"
+BINARY_COLUMNS: Tuple[str, ...] = (DENSE_COLUMN, SPARSE_COLUMN, LABELS_COLUMN)
+# Stored in the sparse column in place of empty categorical values.
+MISSING_ID: int = -1
+
+
+def binary_column_path(prefix: str, column: str) -> str:
+    return f"{prefix}_{column}.npy"
+
+
+def binary_metadata_path(prefix: str) -> str:
+    return f"{prefix}_meta.json"
+
+
+def load_binary_metadata(prefix: str) -> Dict[str, Any]:
+    with open(binary_metadata_path(prefix), "r") as f:
+        return json.load(f)
+
+
+def load_binary_columns(prefix: str) -> Dict[str, np.ndarray]:
+    """Memory-maps the binary columns of one converted file."""
+    return {
+        column: np.load(binary_column_path(prefix, column), mmap_mode="r")
+        for column in BINARY_COLUMNS
+    }
+
+
+class BinaryCriteoIterDataPipe(IterDataPipe[Dict[str, np.ndarray]]):
+    r""":class:`BinaryCriteoIterDataPipe`.
+
+    Iterable datapipe over Criteo files converted by
+    :mod:`torchrecipes.rec.datamodules.criteo_preprocess`. Files are memory-mapped and
+    every item is a batch of rows, i.e. a dict of ``dense`` (int32, or float32 or
+    float16 if stored log transformed, ``[B, 13]``),
+    ``sparse`` (int32 pre-hashed ids, ``[B, 26]``, ``-1`` for missing values) and
+    ``labels`` (int8, ``[B]``) arrays. The arrays are views into the mapped files,
+    so no data is copied until the batch is transformed.
+
+    Args:
+        prefixes: Path prefixes of the converted files, e.g. ``/data/day_0``.
+        batch_size: Number of rows per batch. The last batch of each file may be
+            smaller.
+        row_range: Fraction of the rows of every file to read, as a
+            ``(start, end)`` tuple within ``[0.0, 1.0]``.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the files. The rows of every file
+            are split into contiguous ranges, one per ``(rank, worker_id)`` pair.
+    """
+
+    def __init__(
+        self,
+        prefixes: Sequence[str],
+        batch_size: int,
+        row_range: Tuple[float, float] = (0.0, 1.0),
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        if not (0.0 <= row_range[0] <= row_range[1] <= 1.0):
+            raise ValueError(f"Invalid row_range {row_range}.")
+        if not (0 <= rank < world_size):
+            raise ValueError(f"Invalid rank {rank} for world_size {world_size}.")
+        self.prefixes: List[str] = list(prefixes)
+        self.batch_size = batch_size
+        self.row_range = row_range
+        self.rank = rank
+        self.world_size = world_size
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        shard_id, num_shards = current_shard(self.rank, self.world_size)
+        for prefix in self.prefixes:
+            columns = load_binary_columns(prefix)
+            num_rows = len(columns[LABELS_COLUMN])
+            start, end = shard_range(
+                int(num_rows * self.row_range[0]),
+                int(num_rows * self.row_range[1]),
+                shard_id,
+                num_shards,
+            )
+            for offset in range(start, end, self.batch_size):
+                stop = min(offset + self.batch_size, end)
+                yield {column: array[offset:stop] for column, array in columns.items()}
@@ -7,37 +7,109 @@
 #!/usr/bin/env python3
 
 from functools import partial
+from itertools import accumulate, chain
 from typing import (
     Any,
+    Dict,
     Iterable,
     List,
     Mapping,
     Optional,
+    Sequence,
+    Tuple,
     Union,
     cast,
     Callable,
 )
 
+import numpy as np
 import pytorch_lightning as pl
 import torch
 from pyre_extensions import none_throws
 from torch.utils.data import DataLoader, IterDataPipe
 from torchrec.datasets.criteo import (
+    COLUMN_TYPE_CASTERS,
     DEFAULT_CAT_NAMES,
+    DEFAULT_COLUMN_NAMES,
     DEFAULT_INT_NAMES,
     DEFAULT_LABEL_NAME,
 )
-from torchrec.datasets.criteo import criteo_terabyte, criteo_kaggle
 from torchrec.datasets.utils import rand_split_train_val, Batch
 from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
-from torchrecipes.rec.datamodules.samplers.undersampler import ProportionUnderSampler
+from torchrecipes.rec.datamodules.batch_cache import BatchCache, file_signature
+from torchrecipes.rec.datamodules.compressed import find_file, is_compressed
+from torchrecipes.rec.datamodules.criteo_binary import (
+    binary_column_path,
+    BINARY_COLUMNS,
+    BinaryCriteoIterDataPipe,
+    DENSE_COLUMN,
+    LABELS_COLUMN,
+    load_binary_metadata,
+    MISSING_ID,
+    SPARSE_COLUMN,
+)
+from torchrecipes.rec.datamodules.criteo_vocab import CriteoVocab
+from torchrecipes.rec.datamodules.interleave import InterleavedReader
+from torchrecipes.rec.datamodules.prefetch import (
+    batch_prefetch_fn,
+    DevicePrefetcher,
+    trainer_device,
+)
+from torchrecipes.rec.datamodules.columnar import ColumnarBatcher
+from torchrecipes.rec.datamodules.commons import WeightedBatch
+from torchrecipes.rec.datamodules.samplers.undersampler import (
+    ColumnarProportionUnderSampler,
+    ProportionUnderSampler,
+)
+from torchrecipes.rec.datamodules.sharding import EvenBatches, ShardedLineReader
+from torchrecipes.rec.datamodules.shuffle import ShuffleBuffer
+from torchrecipes.rec.datamodules.train_val_split import (
+    is_train_offset,
+    is_val_offset,
+    load_val_index,
+    OffsetLineReader,
+)
+from torchrecipes.utils.distributed_utils import barrier, get_rank, get_world_size
+from torchrecipes.utils.loader_autotune import AUTO, autotune_loader
 
 
-def _transform(
+def _criteo_row_mapper(row: List[str]) -> Dict[str, Union[int, str]]:
+    # same mapping as the torchrec criteo datapipes, columns are matched from the
+    # right so that rows without label (kaggle test) are supported
+    return {
+        name: caster(value)
+        for name, caster, value in zip(
+            reversed(DEFAULT_COLUMN_NAMES), reversed(COLUMN_TYPE_CASTERS), reversed(row)
+        )
+    }
+
+
+def _log_dense(dense: torch.Tensor) -> torch.Tensor:
+    """Transforms int dense features in place into their float log features."""
+    # minimum value in criteo 1t/kaggle dataset of int features
+    # is -1/-2 so we add 3 before taking log
+    dense += 3
+    return dense.to(torch.get_default_dtype()).log_()
+
+
+def _dense_features(
+    batch: Mapping[str, Union[Iterable[str], torch.Tensor]]
+) -> torch.Tensor:
+    columns = [cast(torch.Tensor, batch[col_name]) for col_name in DEFAULT_INT_NAMES]
+    return _log_dense(torch.stack(columns, dim=1))
+
+
+def _transform_rowwise(
     batch: Mapping[str, Union[Iterable[str], torch.Tensor]],
     num_embeddings: Optional[int] = None,
     num_embeddings_per_feature: Optional[List[int]] = None,
+    multi_hot_delimiter: Optional[str] = None,
+    max_ids_per_feature: Optional[List[int]] = None,
 ) -> Batch:
+    """Reference row-by-row implementation of :func:`_transform`.
+
+    Kept as the baseline for ``torchrecipes.rec.benchmarks.criteo_transform_benchmark``.
+    """
     cat_list: List[torch.Tensor] = []
     for col_name in DEFAULT_INT_NAMES:
         val = cast(torch.Tensor, batch[col_name])
@@ -53,23 +125,20 @@ def _transform(
     kjt_lengths: List[int] = []
     for (col_idx, col_name) in enumerate(DEFAULT_CAT_NAMES):
         values = cast(Iterable[str], batch[col_name])
+        hash_size = (
+            none_throws(num_embeddings_per_feature)[col_idx]
+            if num_embeddings is None
+            else num_embeddings
+        )
+        max_ids = None if max_ids_per_feature is None else max_ids_per_feature[col_idx]
         for value in values:
-            if value:
-                kjt_values.append(
-                    int(value, 16)
-                    % (
-                        none_throws(num_embeddings_per_feature)[col_idx]
-                        if num_embeddings is None
-                        else num_embeddings
-                    )
-                )
-                kjt_lengths.append(1)
-            else:
-                kjt_lengths.append(0)
+            ids = _split_ids(value, multi_hot_delimiter, max_ids)
+            kjt_values.extend(int(i, 16) % hash_size for i in ids)
+            kjt_lengths.append(len(ids))
 
     sparse_features = KeyedJaggedTensor.from_lengths_sync(
         DEFAULT_CAT_NAMES,
-        torch.tensor(kjt_values),
+        torch.tensor(kjt_values, dtype=torch.int64),
         torch.tensor(kjt_lengths, dtype=torch.int32),
     )
     labels = batch[DEFAULT_LABEL_NAME]
@@ -82,6 +151,326 @@ def _transform(
     )
 
 
+def _build_hex_lut() -> np.ndarray:
+    # maps an ASCII code to its hex digit value, 255 marks non hex digit bytes
+    lut = np.full(256, 255, dtype=np.uint8)
+    for digit, char in enumerate("0123456789abcdef"):
+        lut[ord(char)] = lut[ord(char.upper())] = digit
+    return lut
+
+
+_HEX_LUT: np.ndarray = _build_hex_lut()
+# ids with more hex digits than this do not fit in an uint64
+_MAX_HEX_DIGITS = 16
+_SEP: int = ord("\t")
+
+# column of the importance weights attached to undersampled rows
+WEIGHT_NAME = "weight"
+DEFAULT_READ_CHUNK_SIZE = 100000
+# read_chunk_size candidates of the autotuner
+AUTO_READ_CHUNK_SIZES: Tuple[int, ...] = (1 << 16, 1 << 18, 1 << 20, 1 << 22)
+
+
+def _parse_hex_values(
+    buf: np.ndarray, ends: np.ndarray, lengths: np.ndarray, contiguous: bool
+) -> Optional[np.ndarray]:
+    """Parses the non-empty hex values of ``buf`` ending before ``ends`` and of
+    ``lengths`` characters as uint64. ``contiguous`` tells that the bytes of
+    ``buf`` are only these values and separators. ``None`` is returned if any
+    value cannot be parsed exactly this way."""
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    width = int(lengths.max())
+    if width > _MAX_HEX_DIGITS:
+        return None
+
+    if int(lengths.min()) == width:
+        # the common criteo case: every id has the same number of digits
+        valid = None
+        if contiguous:
+            codes = buf[buf != _SEP].reshape(-1, width)
+        else:
+            codes = buf[ends[:, None] - width + np.arange(width)]
+    else:
+        # right align the values in a [num_values, width] grid, shorter values are
+        # left padded with zeros which does not change their value
+        offsets = np.arange(width - 1, -1, -1)
+        valid = offsets < lengths[:, None]
+        codes = buf[np.where(valid, ends[:, None] - 1 - offsets, 0)]
+    digits = _HEX_LUT[codes]
+    if valid is not None:
+        digits[~valid] = 0
+    if np.any(digits == 255):
+        return None
+
+    if width in (2, 4, 8, 16):
+        # pack digit pairs into bytes and read them as big-endian integers
+        packed = np.ascontiguousarray((digits[:, 0::2] << 4) | digits[:, 1::2])
+        return packed.view(f">u{width // 2}").reshape(-1).astype(np.uint64)
+    ids = np.zeros(len(lengths), dtype=np.uint64)
+    for pos in range(width):
+        ids = ids * np.uint64(16) + digits[:, pos]
+    return ids
+
+
+def _parse_hex_columns(
+    columns: List[Sequence[str]],
+    delimiter: Optional[str] = None,
+    max_ids: Optional[Sequence[int]] = None,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Parses the hex ids of all categorical columns of a batch at once.
+
+    Args:
+        columns: Values of the categorical columns.
+        delimiter: If not ``None``, values are lists of ids separated by this
+            character, empty ids are skipped.
+        max_ids: If not ``None``, only the first ``max_ids[i]`` ids of every value
+            of column ``i`` are kept.
+
+    Returns:
+        A ``(ids, lengths)`` tuple. ``lengths`` is a ``[num_columns, batch_size]``
+        array of the number of ids of every value, a bool mask of the non-empty
+        values when every value holds at most one id, and ``ids`` holds the
+        parsed ids as uint64, column by column. ``None`` is returned if any value
+        cannot be parsed exactly this way.
+    """
+    flat = list(chain.from_iterable(columns))
+    try:
+        buf = np.frombuffer("\t".join(flat).encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+    # criteo values never contain the separator, bail out if one does
+    is_sep = buf == _SEP
+    seps = np.flatnonzero(is_sep)
+    if len(seps) != len(flat) - 1:
+        return None
+    if delimiter is not None:
+        is_delimiter = buf == ord(delimiter)
+        if np.any(is_delimiter):
+            return _parse_multi_hot(buf, is_sep, is_delimiter, len(columns), max_ids)
+    ends = np.append(seps, len(buf))
+    lengths = np.diff(ends, prepend=-1) - 1
+    mask = (lengths > 0).reshape(len(columns), -1)
+    ids = _parse_hex_values(
+        buf, ends[lengths > 0], lengths[lengths > 0], contiguous=True
+    )
+    return None if ids is None else (ids, mask)
+
+
+def _parse_multi_hot(
+    buf: np.ndarray,
+    is_sep: np.ndarray,
+    is_delimiter: np.ndarray,
+    num_columns: int,
+    max_ids: Optional[Sequence[int]],
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    # every id ends before a value separator, a delimiter or the end of buf
+    ends = np.append(np.flatnonzero(is_sep | is_delimiter), len(buf))
+    lengths = np.diff(ends, prepend=-1) - 1
+    # index of the value of every id, i.e. number of value separators before it
+    rows = np.zeros(len(ends), dtype=np.int64)
+    np.cumsum(is_sep[ends[:-1]], out=rows[1:])
+    num_values = int(rows[-1]) + 1
+    nonempty = lengths > 0
+    ends, lengths, rows = ends[nonempty], lengths[nonempty], rows[nonempty]
+    counts = np.bincount(rows, minlength=num_values)
+    if max_ids is not None:
+        caps = np.repeat(np.asarray(max_ids), num_values // num_columns)
+        if np.any(counts > caps):
+            # position of every id in its value
+            starts = np.cumsum(counts) - counts
+            keep = np.arange(len(rows)) - starts[rows] < caps[rows]
+            ends, lengths = ends[keep], lengths[keep]
+            counts = np.minimum(counts, caps)
+    ids = _parse_hex_values(buf, ends, lengths, contiguous=False)
+    return None if ids is None else (ids, counts.reshape(num_columns, -1))
+
+
+def _split_ids(
+    value: str, delimiter: Optional[str] = None, max_ids: Optional[int] = None
+) -> List[str]:
+    """Non-empty ids of a categorical value, see :func:`_parse_hex_columns`."""
+    if delimiter is None:
+        return [value] if value else []
+    return [i for i in value.split(delimiter) if i][:max_ids]
+
+
+def _split_columns(
+    columns: List[Sequence[str]],
+    delimiter: Optional[str] = None,
+    max_ids: Optional[Sequence[int]] = None,
+) -> Tuple[List[str], np.ndarray]:
+    """Slow path of :func:`_parse_hex_columns`, returns the ids as strings and
+    the lengths, or mask, of the values like it."""
+    ids = [
+        [
+            _split_ids(value, delimiter, None if max_ids is None else max_ids[i])
+            for value in column
+        ]
+        for i, column in enumerate(columns)
+    ]
+    lengths = np.array([[len(value) for value in column] for column in ids])
+    if lengths.max(initial=0) <= 1:
+        # single-hot values, the bool mask of the fast path
+        lengths = lengths > 0
+    return list(chain.from_iterable(chain.from_iterable(ids))), lengths
+
+
+def _hash_sizes(
+    num_embeddings: Optional[int] = None,
+    num_embeddings_per_feature: Optional[List[int]] = None,
+) -> List[int]:
+    return (
+        list(none_throws(num_embeddings_per_feature))
+        if num_embeddings is None
+        else [num_embeddings] * len(DEFAULT_CAT_NAMES)
+    )
+
+
+def _hash_categorical(
+    columns: List[Sequence[str]],
+    hash_sizes: List[int],
+    delimiter: Optional[str] = None,
+    max_ids: Optional[Sequence[int]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashes the hex ids of the categorical columns of a batch.
+
+    Args:
+        columns: Values of the categorical columns.
+        hash_sizes: Hash size of every column.
+        delimiter: Separator of multi-hot values, see :func:`_parse_hex_columns`.
+        max_ids: Maximum number of ids kept per value of every column.
+
+    Returns:
+        A ``(values, lengths)`` tuple, where ``values`` are the int64 hashed ids,
+        column by column, and ``lengths`` is the ``[num_columns, batch_size]``
+        array of the number of ids of every value, see :func:`_parse_hex_columns`.
+    """
+    parsed = _parse_hex_columns(columns, delimiter, max_ids)
+    if parsed is None:
+        # slow path for ids the vectorized parser cannot represent exactly
+        ids, lengths = _split_columns(columns, delimiter, max_ids)
+        sizes = np.repeat(hash_sizes, lengths.sum(axis=1)).tolist()
+        values = np.array(
+            [int(i, 16) % size for i, size in zip(ids, sizes)], dtype=np.int64
+        )
+        return values, lengths
+    ids, lengths = parsed
+    sizes = np.repeat(np.array(hash_sizes, dtype=np.uint64), lengths.sum(axis=1))
+    values = np.empty(len(ids), dtype=np.int64)
+    # the hashed ids are below the int64 hash sizes
+    np.remainder(ids, sizes, out=values.view(np.uint64))
+    return values, lengths
+
+
+def _categorical_ids(
+    columns: List[Sequence[str]],
+    delimiter: Optional[str] = None,
+    max_ids: Optional[Sequence[int]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Parses the hex ids of the categorical columns of a batch.
+
+    Returns:
+        A ``(ids, lengths)`` tuple as returned by :func:`_parse_hex_columns`. Ids
+        that do not fit in an uint64 are taken modulo 2**64.
+    """
+    parsed = _parse_hex_columns(columns, delimiter, max_ids)
+    if parsed is None:
+        ids, lengths = _split_columns(columns, delimiter, max_ids)
+        return (
+            np.array([int(i, 16) % (1 << 64) for i in ids], dtype=np.uint64),
+            lengths,
+        )
+    return parsed
+
+
+def _sparse_features(values: np.ndarray, lengths: np.ndarray) -> KeyedJaggedTensor:
+    """Builds the ``KeyedJaggedTensor`` of the categorical ``values`` of a batch,
+    column by column, where ``lengths`` holds the number of ids of every value as
+    returned by :func:`_hash_categorical`. The per key lengths and offsets are
+    passed precomputed, instead of synced from the lengths tensor."""
+    kjt_lengths = lengths.reshape(-1).astype(np.int32)
+    offsets = np.zeros(lengths.size + 1, dtype=np.int32)
+    np.cumsum(kjt_lengths, out=offsets[1:])
+    length_per_key = lengths.sum(axis=1).tolist()
+    return KeyedJaggedTensor(
+        keys=DEFAULT_CAT_NAMES,
+        values=torch.from_numpy(values),
+        lengths=torch.from_numpy(kjt_lengths),
+        offsets=torch.from_numpy(offsets),
+        stride=lengths.shape[1],
+        length_per_key=length_per_key,
+        offset_per_key=[0, *accumulate(length_per_key)],
+    )
+
+
+def _transform(
+    batch: Mapping[str, Union[Iterable[str], torch.Tensor]],
+    num_embeddings: Optional[int] = None,
+    num_embeddings_per_feature: Optional[List[int]] = None,
+    vocab: Optional[CriteoVocab] = None,
+    multi_hot_delimiter: Optional[str] = None,
+    max_ids_per_feature: Optional[List[int]] = None,
+) -> Batch:
+    columns = [cast(Sequence[str], batch[col_name]) for col_name in DEFAULT_CAT_NAMES]
+    if vocab is None:
+        kjt_values, lengths = _hash_categorical(
+            columns,
+            _hash_sizes(num_embeddings, num_embeddings_per_feature),
+            multi_hot_delimiter,
+            max_ids_per_feature,
+        )
+    else:
+        ids, lengths = _categorical_ids(
+            columns, multi_hot_delimiter, max_ids_per_feature
+        )
+        kjt_values = vocab.remap(ids, lengths.sum(axis=1))
+    dense_features = _dense_features(batch)
+    sparse_features = _sparse_features(kjt_values, lengths)
+    labels = batch[DEFAULT_LABEL_NAME]
+    assert isinstance(labels, torch.Tensor)
+
+    weights = batch.get(WEIGHT_NAME)
+    if weights is not None:
+        return WeightedBatch(
+            dense_features=dense_features,
+            sparse_features=sparse_features,
+            labels=labels,
+            weights=torch.as_tensor(weights, dtype=torch.float32),
+        )
+    return Batch(
+        dense_features=dense_features,
+        sparse_features=sparse_features,
+        labels=labels,
+    )
+
+
+def _transform_binary(batch: Mapping[str, np.ndarray]) -> Batch:
+    """Transforms a batch of :class:`BinaryCriteoIterDataPipe` into a ``Batch``
+    equal to the one :func:`_transform` builds from the same TSV rows. Dense
+    features stored log transformed are only converted to float32."""
+    dense = batch[DENSE_COLUMN]
+    if np.issubdtype(dense.dtype, np.floating):
+        dense_features = torch.from_numpy(np.array(dense, dtype=np.float32))
+    else:
+        dense_features = _log_dense(torch.from_numpy(dense.astype(np.int64)))
+
+    sparse = batch[SPARSE_COLUMN].T
+    mask = sparse != MISSING_ID
+    sparse_features = KeyedJaggedTensor.from_lengths_sync(
+        DEFAULT_CAT_NAMES,
+        torch.from_numpy(sparse[mask].astype(np.int64)),
+        torch.from_numpy(mask.reshape(-1).astype(np.int32)),
+    )
+    labels = torch.from_numpy(batch[LABELS_COLUMN].astype(np.int64))
+
+    return Batch(
+        dense_features=dense_features,
+        sparse_features=sparse_features,
+        labels=labels,
+    )
+
+
 class CriteoDataModule(pl.LightningDataModule):
     """`DataModule for Criteo 1TB Click Logs <https://ailab.criteo.com/download-criteo-1tb-click-logs-dataset/>`_ Dataset
     Args:
@@ -92,9 +481,17 @@ class CriteoDataModule(pl.LightningDataModule):
         num_embeddings: the number of embeddings (hash size) of the categorical (sparse) features
         num_embeddings_per_feature: the number of embeddings (hash size) of the categorical (sparse) features
         batch_size: int
-        num_workers: int
+        num_workers: number of dataloader workers. The rows are sharded across all
+            (rank, worker) pairs, so that every row is read once per epoch.
+            Ranks get slightly different numbers of rows, thus with several
+            ranks the dataloaders stop at the fewest batches of any rank, see
+            ``torchrecipes.rec.datamodules.sharding.EvenBatches``.
+            ``"auto"`` picks it in setup() by timing a short probe of the
+            dataloader with every candidate, see
+            ``torchrecipes.utils.loader_autotune``
         train_percent: percent of data to use for training vs validation- 0.0 - 1.0
-        read_chunk_size: int
+        read_chunk_size: size in bytes of the read buffer of each TSV file,
+            ``"auto"`` picks it in setup() like num_workers
         dataset_name: criteo_1t or criteo_kaggle,
             note that the test dataset of kaggle does not have label
         dataset_path: Path to the criteo dataset. Users MUST pass it
@@ -106,6 +503,88 @@ class CriteoDataModule(pl.LightningDataModule):
         worker_init_fn: If not ``None``, this will be called on each worker subprocess with the
             worker id (an int in ``[0, num_workers - 1]``) as input, after seeding and before data
             loading. (default: ``None``)
+        format: tsv or binary. ``binary`` reads the memory-mapped columns written by
+            ``torchrecipes.rec.datamodules.criteo_preprocess`` from dataset_path instead
+            of parsing the TSV files. The train/val split then takes the first
+            train_percent rows of every file for training. Default: tsv.
+        split_mode: random or hash, how tsv rows are split into train and val.
+            ``random`` draws every row's split while reading, thus the train and val
+            dataloaders each parse all rows. ``hash`` assigns rows by a hash of
+            their byte offset: the train dataloader skips val rows before parsing
+            them and the val dataloader seeks straight to its rows, using a per
+            file index of their offsets (see
+            ``torchrecipes.rec.datamodules.train_val_split``) built on first use if
+            it was not precomputed. Missing indexes are built by rank 0 in
+            :meth:`setup` while the other ranks wait. Default: random.
+        num_parallel_files: number of tsv files (days) read at the same time, each on
+            its own thread, interleaving batch_size rows of each. 1 reads the files
+            one after another. Default: 1.
+        prefetch_depth: number of chunks of batch_size rows each file reader thread
+            reads ahead when num_parallel_files > 1. Default: 4.
+        interleave_mode: round_robin or random, how the file of the next chunk is
+            picked when num_parallel_files > 1. Default: round_robin.
+        shuffle_buffer_size: if not ``None``, the train rows are shuffled in a buffer
+            of this many rows (see ``torchrecipes.rec.datamodules.shuffle``), in a
+            different order every epoch. The order is reproducible per (rank,
+            worker) if seed is set. Train dataloader workers are then persistent,
+            so that they keep track of the epoch. Default: None.
+        vocab_path: if not ``None``, path of a vocabulary file built by
+            ``torchrecipes.rec.datamodules.criteo_vocab_builder``. The frequent ids
+            of every categorical feature are then mapped to dense indices and the
+            other ids to one out-of-vocabulary index per feature, instead of being
+            hashed. num_embeddings is then set to None and
+            num_embeddings_per_feature to the vocabulary sizes. Only supported
+            for tsv format. Default: None.
+        batch_cache_dir: if not ``None``, the transformed batches are cached in this
+            directory (see ``torchrecipes.rec.datamodules.batch_cache``) by the first
+            complete epoch of every split, later epochs and runs with the same
+            dataset files and config read them back instead of parsing the data
+            again. The cached epochs replay the undersampling and order of the
+            first one, thus the cache cannot be combined with
+            shuffle_buffer_size. A stream is rebuilt by reading the data again,
+            which must then yield the same batches, thus the undersampling and
+            the random interleave_mode require a seed. Default: None.
+        batch_cache_max_bytes: if not ``None``, the least recently used shards of
+            batch_cache_dir are deleted once it grows beyond this size.
+            Default: None.
+        device_prefetch_depth: if positive, the dataloaders move this many batches
+            to the device of the trainer ahead of time, see
+            ``torchrecipes.rec.datamodules.prefetch.DevicePrefetcher``. Not needed
+            with models copying batches themselves, like ``LightningDLRM``. The
+            ``prefetch_batch`` method of the trained LightningModule, if any, is
+            called with the batches read ahead, see ``UnshardedLightningDLRM``.
+            Default: 0.
+        undersampling_weights: if ``True``, undersampled batches are
+            ``torchrecipes.rec.datamodules.commons.WeightedBatch`` holding the
+            inverse of the probability with which each row was kept, e.g.
+            1 / undersampling_rate for rows with label 0, so that a weighted loss
+            keeps the predicted CTR calibrated. Default: False.
+        multi_hot_delimiter: if not ``None``, the categorical values of the tsv
+            files are lists of hex ids separated by this character, e.g.
+            ``"6ac2f5d1,0a519c5c"`` with ``","``, and every feature gets as many
+            ids per row, empty ids being skipped. Values without delimiter are
+            parsed as fast as single ids. Only supported for tsv format.
+            Default: None.
+        decompress_threads: number of threads decompressing every seekable zstd
+            tsv file. Every tsv file ``day_N.tsv`` (or ``train.txt``/``test.txt``)
+            that does not exist is read from its compressed version
+            ``day_N.tsv.zst``, ``day_N.tsv.gz``, ``day_N.zst`` or ``day_N.gz``
+            if there is one, decompressed on background threads (see
+            ``torchrecipes.rec.datamodules.compressed``). Seekable zstd files are
+            sharded by byte ranges like plain ones, while the other compressed
+            files are decompressed whole by every (rank, worker) shard. The hash
+            split_mode reads the val rows of compressed files by decompressing
+            them instead of seeking to them. Default: 1.
+        autotune_memory_budget: maximum peak RSS in bytes of the process and its
+            dataloader workers of the settings picked for ``"auto"``
+            num_workers/read_chunk_size. Default: None, half of the available
+            memory.
+        max_ids_per_feature: if not ``None``, only the first
+            ``max_ids_per_feature[i]`` ids of every value of the i-th categorical
+            feature are kept, bounding the size of the batches. Requires
+            multi_hot_delimiter. Default: None.
+        split_seed: seed of the hash of the hash split_mode, the ``--seed`` of
+            ``torchrecipes.rec.datamodules.train_val_split``. Default: 0.
 
     Examples:
         >>> dm = CriteoDataModule(num_days=1, batch_size=3, num_days_test=1)
@@ -121,8 +600,8 @@ class CriteoDataModule(pl.LightningDataModule):
         num_embeddings_per_feature: Optional[List[int]] = None,
         batch_size: int = 32,
         train_percent: float = 0.8,
-        num_workers: int = 0,
-        read_chunk_size: int = 100000,
+        num_workers: Union[int, str] = 0,
+        read_chunk_size: Union[int, str] = DEFAULT_READ_CHUNK_SIZE,
         dataset_name: str = "criteo_1t",
         # pyre-fixme[9]: dataset_path is declared to have type `str` but is used as type `None`.
         dataset_path: str = None,
@@ -130,10 +609,55 @@ class CriteoDataModule(pl.LightningDataModule):
         pin_memory: bool = False,
         seed: Optional[int] = None,
         worker_init_fn: Optional[Callable[[int], None]] = None,
+        format: str = "tsv",
+        split_mode: str = "random",
+        num_parallel_files: int = 1,
+        prefetch_depth: int = 4,
+        interleave_mode: str = "round_robin",
+        shuffle_buffer_size: Optional[int] = None,
+        vocab_path: Optional[str] = None,
+        batch_cache_dir: Optional[str] = None,
+        batch_cache_max_bytes: Optional[int] = None,
+        device_prefetch_depth: int = 0,
+        undersampling_weights: bool = False,
+        multi_hot_delimiter: Optional[str] = None,
+        max_ids_per_feature: Optional[List[int]] = None,
+        decompress_threads: int = 1,
+        autotune_memory_budget: Optional[int] = None,
+        split_seed: int = 0,
     ) -> None:
         super().__init__()
         self._dataset_name: str = dataset_name
         self._dataset_path: str = dataset_path
+        if format not in ("tsv", "binary"):
+            raise ValueError(
+                f"Unknown format {format}. Please choose {{tsv, binary}} for format"
+            )
+        if format == "binary" and undersampling_rate is not None:
+            raise ValueError("undersampling_rate is not supported for binary format")
+        self._format = format
+        if split_mode not in ("random", "hash"):
+            raise ValueError(
+                f"Unknown split_mode {split_mode}. "
+                + "Please choose {random, hash} for split_mode"
+            )
+        self._split_mode = split_mode
+        self._split_seed = split_seed
+        if num_parallel_files < 1 or prefetch_depth < 1:
+            raise ValueError("num_parallel_files and prefetch_depth must be positive")
+        if interleave_mode not in ("round_robin", "random"):
+            raise ValueError(
+                f"Unknown interleave_mode {interleave_mode}. "
+                + "Please choose {round_robin, random} for interleave_mode"
+            )
+        self._num_parallel_files = num_parallel_files
+        self._prefetch_depth = prefetch_depth
+        self._interleave_mode = interleave_mode
+        if shuffle_buffer_size is not None and shuffle_buffer_size < 1:
+            raise ValueError(
+                f"shuffle_buffer_size {shuffle_buffer_size} must be positive"
+            )
+        self._shuffle_buffer_size = shuffle_buffer_size
         if dataset_name == "criteo_1t":
             if not (1 <= num_days <= 24):
                 raise ValueError(
@@ -169,11 +693,18 @@ class CriteoDataModule(pl.LightningDataModule):
                 " of sparse features ({DEFAULT_CAT_NAMES})."
             )
 
-        # TODO handle more workers for IterableDataset
-
+        for name, value in (
+            ("num_workers", num_workers),
+            ("read_chunk_size", read_chunk_size),
+        ):
+            if isinstance(value, str) and value != AUTO:
+                raise ValueError(
+                    f"Unknown {name} {value}. Please choose an int or auto for {name}"
+                )
         self.batch_size = batch_size
         self._num_workers = num_workers
         self._read_chunk_size = read_chunk_size
+        self._autotune_memory_budget = autotune_memory_budget
         self._num_days = num_days
         self._num_days_test = num_days_test
         self.num_embeddings = num_embeddings
@@ -183,72 +714,443 @@ class CriteoDataModule(pl.LightningDataModule):
         self._pin_memory = pin_memory
         self._seed = seed
         self._worker_init_fn = worker_init_fn
+        # rows are sharded across (rank, dataloader worker) pairs, set in setup()
+        self._rank = 0
+        self._world_size = 1
+
+        if batch_cache_dir is not None and shuffle_buffer_size is not None:
+            raise ValueError(
+                "batch_cache_dir cannot be combined with shuffle_buffer_size"
+            )
+        if (
+            batch_cache_dir is not None
+            and seed is None
+            and (
+                (undersampling_rate is not None and dataset_name == "criteo_1t")
+                or (interleave_mode == "random" and num_parallel_files > 1)
+            )
+        ):
+            raise ValueError(
+                "batch_cache_dir requires a seed with undersampling_rate or the "
+                "random interleave_mode, so that the cached streams can be rebuilt"
+            )
+        self._batch_cache_dir = batch_cache_dir
+        self._batch_cache_max_bytes = batch_cache_max_bytes
+        if device_prefetch_depth < 0:
+            raise ValueError(
+                f"device_prefetch_depth {device_prefetch_depth} must be non-negative"
+            )
+        self._device_prefetch_depth = device_prefetch_depth
+        self._undersampling_weights = undersampling_weights
+        if multi_hot_delimiter is not None:
+            if format == "binary":
+                raise ValueError(
+                    "multi_hot_delimiter is not supported for binary format"
+                )
+            if (
+                len(multi_hot_delimiter) != 1
+                or not multi_hot_delimiter.isascii()
+                or multi_hot_delimiter in "\t\n0123456789abcdefABCDEF"
+            ):
+                raise ValueError(
+                    f"multi_hot_delimiter {multi_hot_delimiter!r} must be a single"
+                    " ASCII character other than a tab, newline or hex digit"
+                )
+        if max_ids_per_feature is not None:
+            if multi_hot_delimiter is None:
+                raise ValueError("max_ids_per_feature requires multi_hot_delimiter")
+            if len(max_ids_per_feature) != len(DEFAULT_CAT_NAMES):
+                raise ValueError(
+                    f"Length of max_ids_per_feature ({len(max_ids_per_feature)})"
+                    f" does not match the number of sparse features"
+                    f" ({len(DEFAULT_CAT_NAMES)})."
+                )
+            if any(max_ids < 1 for max_ids in max_ids_per_feature):
+                raise ValueError("All max_ids_per_feature must be positive.")
+        self._multi_hot_delimiter = multi_hot_delimiter
+        if decompress_threads < 1:
+            raise ValueError(
+                f"decompress_threads {decompress_threads} must be positive"
+            )
+        self._decompress_threads = decompress_threads
+        self._max_ids_per_feature = max_ids_per_feature
+        self._vocab_path = vocab_path
+        self._vocab: Optional[CriteoVocab] = None
+        if vocab_path is not None:
+            if format == "binary":
+                raise ValueError("vocab_path is not supported for binary format")
+            self._vocab = CriteoVocab.load(vocab_path)
+            self.num_embeddings = None
+            self.num_embeddings_per_feature = self._vocab.num_embeddings_per_feature
 
         self._train_datapipe: Optional[IterDataPipe] = None
         self._val_datapipe: Optional[IterDataPipe] = None
         self._test_datapipe: Optional[IterDataPipe] = None
         self.keys: List[str] = DEFAULT_CAT_NAMES
 
-    def _create_datapipe_1t(self, day_range: Iterable[int]) -> IterDataPipe:
+    def _create_datapipe_1t(
+        self, day_range: Iterable[int], split: Optional[str] = None
+    ) -> IterDataPipe:
         # TODO (T105042401): replace the file path by using a file in memory, reference by a file handler
-        paths = [f"{self._dataset_path}/day_{day}.tsv" for day in day_range]
-        datapipe = criteo_terabyte(
-            paths,
-            # this is important because without it, the reader will attempt to synchronously download the whole file...
-            read_chunk_size=self._read_chunk_size,
-        )
+        paths = [find_file(f"{self._dataset_path}/day_{day}.tsv") for day in day_range]
+        return self._create_datapipe_tsv(paths, split)
 
+    def _undersampling_proportions(self) -> Optional[Dict[int, float]]:
+        # note that there is no need to downsampling in in Kaggle dataset
         undersampling_rate = self._undersampling_rate
-        if undersampling_rate is not None:
-            datapipe = ProportionUnderSampler(
-                datapipe,
-                self._get_label,
-                {0: undersampling_rate, 1: 1.0},
+        if undersampling_rate is None or self._dataset_name != "criteo_1t":
+            return None
+        return {0: undersampling_rate, 1: 1.0}
+
+    def _weight_key(self) -> Optional[str]:
+        return WEIGHT_NAME if self._undersampling_weights else None
+
+    def _undersample_rows(self, datapipe: IterDataPipe) -> IterDataPipe:
+        proportions = self._undersampling_proportions()
+        if proportions is None:
+            return datapipe
+        return ProportionUnderSampler(
+            datapipe,
+            self._get_label,
+            proportions,
+            seed=self._seed,
+            rank=self._rank,
+            world_size=self._world_size,
+            weight_key=self._weight_key(),
+        )
+
+    def _create_datapipe_kaggle(
+        self, partition: str, split: Optional[str] = None
+    ) -> IterDataPipe:
+        path = find_file(f"{self._dataset_path}/{partition}.txt")
+        return self._create_datapipe_tsv([path], split)
+
+    def _create_datapipe_tsv(
+        self, paths: List[str], split: Optional[str] = None
+    ) -> IterDataPipe:
+        """Reads all rows of paths, or only the rows of the ``train``/``val`` split
+        of the hash split mode."""
+        if self._num_parallel_files > 1 and len(paths) > 1:
+            return InterleavedReader(
+                [self._create_reader_tsv([path], split) for path in paths],
+                parallelism=self._num_parallel_files,
+                prefetch_depth=self._prefetch_depth,
+                chunk_size=self.batch_size,
+                mode=self._interleave_mode,
                 seed=self._seed,
             )
+        return self._create_reader_tsv(paths, split)
 
-        return datapipe
+    def _create_reader_tsv(
+        self, paths: List[str], split: Optional[str] = None
+    ) -> IterDataPipe:
+        if split == "val" and not any(map(is_compressed, paths)):
+            datapipe = OffsetLineReader(
+                paths,
+                [
+                    load_val_index(path, self._train_percent, self._split_seed)
+                    for path in paths
+                ],
+                rank=self._rank,
+                world_size=self._world_size,
+                buffer_size=self._read_chunk_size,
+            )
+        else:
+            datapipe = ShardedLineReader(
+                paths,
+                rank=self._rank,
+                world_size=self._world_size,
+                buffer_size=self._read_chunk_size,
+                offset_filter=None
+                if split is None
+                else partial(
+                    is_train_offset if split == "train" else is_val_offset,
+                    train_percent=self._train_percent,
+                    seed=self._split_seed,
+                ),
+                decompress_threads=self._decompress_threads,
+            )
+        return datapipe.map(_criteo_row_mapper)
 
-    def _create_datapipe_kaggle(self, partition: str) -> IterDataPipe:
-        # note that there is no need to downsampling in in Kaggle dataset
-        path = f"{self._dataset_path}/{partition}.txt"
-        return criteo_kaggle(
-            path,
-            # this is important because without it, the reader will attempt to synchronously download the whole file...
-            read_chunk_size=self._read_chunk_size,
+    def _create_datapipe_fit(self, split: Optional[str] = None) -> IterDataPipe:
+        if self._dataset_name == "criteo_1t":
+            return self._create_datapipe_1t(range(self._num_days), split)
+        elif self._dataset_name == "criteo_kaggle":
+            return self._create_datapipe_kaggle("train", split)
+        else:
+            raise ValueError(
+                f"Unknown dataset {self._dataset_name}. "
+                + "Please choose {criteo_1t, criteo_kaggle} for dataset_name"
+            )
+
+    def _shuffle(self, datapipe: IterDataPipe) -> IterDataPipe:
+        shuffle_buffer_size = self._shuffle_buffer_size
+        if shuffle_buffer_size is None:
+            return datapipe
+        return ShuffleBuffer(
+            datapipe,
+            shuffle_buffer_size,
+            seed=self._seed,
+            rank=self._rank,
+            world_size=self._world_size,
+        )
+
+    def _create_datapipe_binary(
+        self,
+        names: Iterable[str],
+        row_range: Tuple[float, float] = (0.0, 1.0),
+        shuffle: bool = False,
+    ) -> IterDataPipe:
+        prefixes = [f"{self._dataset_path}/{name}" for name in names]
+        hash_sizes = _hash_sizes(self.num_embeddings, self.num_embeddings_per_feature)
+        for prefix in prefixes:
+            if load_binary_metadata(prefix)["hash_sizes"] != hash_sizes:
+                raise ValueError(
+                    f"{prefix} was preprocessed with different hash sizes than "
+                    "num_embeddings/num_embeddings_per_feature."
+                )
+        datapipe = BinaryCriteoIterDataPipe(
+            prefixes,
+            self.batch_size,
+            row_range=row_range,
+            rank=self._rank,
+            world_size=self._world_size,
         )
+        if shuffle:
+            datapipe = self._shuffle(datapipe)
+        return datapipe.map(_transform_binary)
+
+    def _file_names(self, stage: str) -> List[str]:
+        if self._dataset_name == "criteo_1t":
+            days = (
+                range(self._num_days)
+                if stage == "fit"
+                else range(self._num_days, self._num_days + self._num_days_test)
+            )
+            return [f"day_{day}" for day in days]
+        return ["train" if stage == "fit" else "test"]
+
+    def _source_paths(self, stage: str) -> List[str]:
+        prefixes = [f"{self._dataset_path}/{name}" for name in self._file_names(stage)]
+        if self._format == "binary":
+            return [
+                binary_column_path(prefix, column)
+                for prefix in prefixes
+                for column in BINARY_COLUMNS
+            ]
+        extension = "tsv" if self._dataset_name == "criteo_1t" else "txt"
+        return [find_file(f"{prefix}.{extension}") for prefix in prefixes]
+
+    def _config(self, split: str) -> Dict[str, Any]:
+        """Describes the data read by a split, keys the batch cache."""
+        vocab_path = self._vocab_path
+        return {
+            "split": split,
+            "files": [
+                file_signature(path)
+                for path in self._source_paths("test" if split == "test" else "fit")
+            ],
+            "dataset_name": self._dataset_name,
+            "format": self._format,
+            "split_mode": self._split_mode,
+            "split_seed": self._split_seed,
+            "train_percent": self._train_percent,
+            "hash_sizes": _hash_sizes(
+                self.num_embeddings, self.num_embeddings_per_feature
+            ),
+            "vocab": None if vocab_path is None else file_signature(vocab_path),
+            "batch_size": self.batch_size,
+            "undersampling_rate": self._undersampling_rate,
+            "undersampling_weights": self._undersampling_weights,
+            "seed": self._seed,
+            "num_parallel_files": self._num_parallel_files,
+            "interleave_mode": self._interleave_mode,
+            "multi_hot_delimiter": self._multi_hot_delimiter,
+            "max_ids_per_feature": self._max_ids_per_feature,
+        }
+
+    def _cache(
+        self, datapipe: IterDataPipe, split: str, enabled: bool = True
+    ) -> IterDataPipe:
+        batch_cache_dir = self._batch_cache_dir
+        if batch_cache_dir is None or not enabled:
+            return datapipe
+        return BatchCache(
+            datapipe,
+            batch_cache_dir,
+            self._config(split),
+            max_bytes=self._batch_cache_max_bytes,
+            rank=self._rank,
+            world_size=self._world_size,
+        )
+
+    def _setup_binary(self, stage: Optional[str], cache: bool = True) -> None:
+        if stage == "fit" or stage is None:
+            names = self._file_names("fit")
+            self._train_datapipe = self._cache(
+                self._create_datapipe_binary(
+                    names, (0.0, self._train_percent), shuffle=True
+                ),
+                "train",
+                cache,
+            )
+            self._val_datapipe = self._cache(
+                self._create_datapipe_binary(names, (self._train_percent, 1.0)),
+                "val",
+                cache,
+            )
+        if (stage == "test" or stage is None) and self._dataset_name == "criteo_1t":
+            self._test_datapipe = self._cache(
+                self._create_datapipe_binary(self._file_names("test")),
+                "test",
+                cache,
+            )
 
     @staticmethod
     # pyre-ignore[2, 3]
     def _get_label(row: Any) -> Any:
         return row["label"]
 
-    def _batch_collate_transform(self, datapipe: IterDataPipe) -> IterDataPipe:
+    @staticmethod
+    # pyre-ignore[2, 3]
+    def _get_labels(chunk: Any) -> Any:
+        return chunk[DEFAULT_LABEL_NAME]
+
+    def _batch_collate_transform(
+        self, datapipe: IterDataPipe, shuffle: bool = False, undersample: bool = False
+    ) -> IterDataPipe:
         _transform_partial = partial(
             _transform,
             num_embeddings=self.num_embeddings,
             num_embeddings_per_feature=self.num_embeddings_per_feature,
+            vocab=self._vocab,
+            multi_hot_delimiter=self._multi_hot_delimiter,
+            max_ids_per_feature=self._max_ids_per_feature,
         )
-        return datapipe.batch(self.batch_size).collate().map(_transform_partial)
+        datapipe = datapipe.batch(self.batch_size).collate()
+        proportions = self._undersampling_proportions()
+        if undersample and proportions is not None:
+            # sampled chunk by chunk, then regrouped into full batches
+            datapipe = ColumnarBatcher(
+                ColumnarProportionUnderSampler(
+                    datapipe,
+                    self._get_labels,
+                    proportions,
+                    seed=self._seed,
+                    rank=self._rank,
+                    world_size=self._world_size,
+                    weight_key=self._weight_key(),
+                ),
+                self.batch_size,
+            )
+        if shuffle:
+            # rows are shuffled as columns, before the categorical ids are parsed
+            datapipe = self._shuffle(datapipe)
+        return datapipe.map(_transform_partial)
 
     def setup(self, stage: Optional[str] = None) -> None:
         if self._worker_init_fn is not None:
             self._worker_init_fn(0)
+        self._rank = get_rank()
+        self._world_size = get_world_size()
+        self._prepare_val_indexes(stage)
+        if self._num_workers == AUTO or self._read_chunk_size == AUTO:
+            self._autotune(stage)
+        self._setup_datapipes(stage)
+
+    def _prepare_val_indexes(self, stage: Optional[str]) -> None:
+        """Builds the missing val indexes of the hash split_mode on rank 0 while
+        the other ranks wait, so that ranks sharing the dataset directory do not
+        all build them. Ranks of other nodes with their own copy of the dataset
+        build theirs on first use."""
+        if (
+            self._format != "tsv"
+            or self._split_mode != "hash"
+            or stage not in ("fit", None)
+            or self._world_size == 1
+        ):
+            return
+        if self._rank == 0:
+            for path in self._source_paths("fit"):
+                if not is_compressed(path):
+                    load_val_index(path, self._train_percent, self._split_seed)
+        barrier()
+
+    def _autotune(self, stage: Optional[str]) -> None:
+        """Picks the ``"auto"`` num_workers and read_chunk_size by probing the
+        train dataloader, or the test one for the test stage."""
+        auto_workers = self._num_workers == AUTO
+        auto_chunk = self._read_chunk_size == AUTO and self._format == "tsv"
+        probe_stage = "test" if stage == "test" else "fit"
+
+        def make_loader(num_workers: int, read_chunk_size: Optional[int]) -> DataLoader:
+            self._num_workers = num_workers
+            self._read_chunk_size = (
+                DEFAULT_READ_CHUNK_SIZE if read_chunk_size is None else read_chunk_size
+            )
+            # the probe does not fill the batch cache
+            self._setup_datapipes(probe_stage, cache=False)
+            if probe_stage == "fit" or self._dataset_name == "criteo_kaggle":
+                datapipe = none_throws(
+                    self._train_datapipe if probe_stage == "fit" else self._val_datapipe
+                )
+            else:
+                datapipe = none_throws(self._test_datapipe)
+            return self._build_dataloader(datapipe)
+
+        num_workers = self._num_workers
+        read_chunk_size = self._read_chunk_size
+        setting = autotune_loader(
+            make_loader,
+            {
+                **self._config(probe_stage),
+                "datamodule": type(self).__name__,
+                "world_size": self._world_size,
+                "shuffle_buffer_size": self._shuffle_buffer_size,
+                "decompress_threads": self._decompress_threads,
+            },
+            num_workers=None if auto_workers else [cast(int, num_workers)],
+            chunk_sizes=AUTO_READ_CHUNK_SIZES
+            if auto_chunk
+            else [None if read_chunk_size == AUTO else cast(int, read_chunk_size)],
+            memory_budget=self._autotune_memory_budget,
+        )
+        self._num_workers = setting.num_workers
+        self._read_chunk_size = (
+            DEFAULT_READ_CHUNK_SIZE
+            if setting.chunk_size is None
+            else setting.chunk_size
+        )
+
+    def _setup_datapipes(self, stage: Optional[str], cache: bool = True) -> None:
+        if self._format == "binary":
+            self._setup_binary(stage, cache)
+            return
         if stage == "fit" or stage is None:
-            if self._dataset_name == "criteo_1t":
-                datapipe = self._create_datapipe_1t(range(self._num_days))
-            elif self._dataset_name == "criteo_kaggle":
-                datapipe = self._create_datapipe_kaggle("train")
+            if self._split_mode == "hash":
+                train_datapipe = self._create_datapipe_fit("train")
+                val_datapipe = self._create_datapipe_fit("val")
+                undersample = True
             else:
-                raise ValueError(
-                    f"Unknown dataset {self._dataset_name}. "
-                    + "Please choose {criteo_1t, criteo_kaggle} for dataset_name"
+                # the split draws a random number per undersampled row, thus rows
+                # are undersampled one at a time before it
+                train_datapipe, val_datapipe = rand_split_train_val(
+                    self._undersample_rows(self._create_datapipe_fit()),
+                    self._train_percent,
                 )
-            train_datapipe, val_datapipe = rand_split_train_val(
-                datapipe, self._train_percent
+                undersample = False
+            self._train_datapipe = self._cache(
+                self._batch_collate_transform(
+                    train_datapipe, shuffle=True, undersample=undersample
+                ),
+                "train",
+                cache,
+            )
+            self._val_datapipe = self._cache(
+                self._batch_collate_transform(val_datapipe, undersample=undersample),
+                "val",
+                cache,
             )
-            self._train_datapipe = self._batch_collate_transform(train_datapipe)
-            self._val_datapipe = self._batch_collate_transform(val_datapipe)
 
         if stage == "test" or stage is None:
             if self._dataset_name == "criteo_1t":
@@ -262,29 +1164,58 @@ class CriteoDataModule(pl.LightningDataModule):
                     f"Unknown dataset {self._dataset_name}. "
                     + "Please choose {criteo_1t, criteo_kaggle} for dataset_name"
                 )
-            self._test_datapipe = self._batch_collate_transform(datapipe)
+            self._test_datapipe = self._cache(
+                self._batch_collate_transform(datapipe, undersample=True),
+                "test",
+                cache,
+            )
 
-    def _create_dataloader(self, datapipe: IterDataPipe) -> DataLoader:
+    def _build_dataloader(
+        self, datapipe: IterDataPipe, persistent_workers: bool = False
+    ) -> DataLoader:
+        num_workers = cast(int, self._num_workers)
         return DataLoader(
             datapipe,
-            num_workers=self._num_workers,
+            num_workers=num_workers,
             pin_memory=self._pin_memory,
             batch_size=None,
             batch_sampler=None,
             worker_init_fn=self._worker_init_fn,
+            persistent_workers=persistent_workers and num_workers > 0,
         )
 
-    def train_dataloader(self) -> DataLoader:
+    def _create_dataloader(
+        self, datapipe: IterDataPipe, persistent_workers: bool = False
+    ) -> Iterable[Batch]:
+        dataloader: Iterable[Batch] = self._build_dataloader(
+            datapipe, persistent_workers
+        )
+        if self._device_prefetch_depth > 0:
+            dataloader = DevicePrefetcher(
+                dataloader,
+                trainer_device(self),
+                depth=self._device_prefetch_depth,
+                on_prefetch=batch_prefetch_fn(self),
+            )
+        if self._world_size > 1:
+            # ranks read different numbers of rows
+            return EvenBatches(dataloader, trainer_device(self))
+        return dataloader
+
+    def train_dataloader(self) -> Iterable[Batch]:
         datapipe = self._train_datapipe
         assert isinstance(datapipe, IterDataPipe)
-        return self._create_dataloader(datapipe)
+        # the shuffle buffer of each worker counts the epochs it iterated
+        return self._create_dataloader(
+            datapipe, persistent_workers=self._shuffle_buffer_size is not None
+        )
 
-    def val_dataloader(self) -> DataLoader:
+    def val_dataloader(self) -> Iterable[Batch]:
         datapipe = self._val_datapipe
         assert isinstance(datapipe, IterDataPipe)
         return self._create_dataloader(datapipe)
 
-    def test_dataloader(self) -> DataLoader:
+    def test_dataloader(self) -> Iterable[Batch]:
         if self._dataset_name == "criteo_1t":
             datapipe = self._test_datapipe
         elif self._dataset_name == "criteo_kaggle":
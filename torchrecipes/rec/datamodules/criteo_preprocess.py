@@ -0,0 +1,262 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Converts Criteo TSV files into the binary columns read by
+``CriteoDataModule(format="binary")``.
+
+Every file is parsed once into int32 dense features, int32 pre-hashed sparse ids
+and int8 labels, stored as ``.npy`` files next to each other in the output
+directory. Compressed day files, e.g. ``day_0.gz``, are read directly if the
+TSV files do not exist. With ``--dense_dtype float32`` or ``float16``, the dense features are
+stored already log transformed, so that reading them costs a copy per batch.
+
+Example:
+    python -m torchrecipes.rec.datamodules.criteo_preprocess \
+        --dataset_path /data/criteo --output_path /data/criteo_binary \
+        --num_days 24 --num_embeddings 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import cast, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torchrec.datasets.criteo import (
+    DEFAULT_CAT_NAMES,
+    DEFAULT_INT_NAMES,
+    DEFAULT_LABEL_NAME,
+)
+from torchrecipes.rec.datamodules.compressed import find_file, read_blocks
+from torchrecipes.rec.datamodules.criteo_binary import (
+    binary_column_path,
+    binary_metadata_path,
+    DENSE_COLUMN,
+    LABELS_COLUMN,
+    MISSING_ID,
+    SPARSE_COLUMN,
+)
+from torchrecipes.rec.datamodules.criteo_datamodule import (
+    _criteo_row_mapper,
+    _hash_categorical,
+    _hash_sizes,
+    _log_dense,
+)
+from torchrecipes.rec.datamodules.sharding import ShardedLineReader
+
+_INT32_MIN: int = np.iinfo(np.int32).min
+_INT32_MAX: int = np.iinfo(np.int32).max
+DENSE_DTYPES: Tuple[str, ...] = ("int32", "float32", "float16")
+
+
+def _count_rows(path: str, block_size: int = 1 << 24) -> int:
+    num_rows = 0
+    last = b"\n"
+    for block in read_blocks(path, block_size):
+        num_rows += block.count(b"\n")
+        last = block[-1:]
+    # the last line may not be terminated
+    return num_rows + (last != b"\n")
+
+
+def tsv_to_binary(
+    path: str,
+    prefix: str,
+    hash_sizes: List[int],
+    read_chunk_size: int = 100000,
+    dense_dtype: str = "int32",
+) -> int:
+    """Converts one labeled Criteo TSV file into binary columns.
+
+    Args:
+        path: Path of the TSV file, e.g. ``/data/criteo/day_0.tsv``, possibly
+            compressed, e.g. ``/data/criteo/day_0.gz``.
+        prefix: Path prefix of the output files, e.g. ``/data/binary/day_0``.
+        hash_sizes: Number of embeddings of every sparse feature. The sparse ids
+            are stored modulo these values.
+        read_chunk_size: Number of rows parsed at once.
+        dense_dtype: int32 stores the raw dense features, float32 and float16 store
+            them log transformed as ``CriteoDataModule`` feeds them to the model.
+
+    Returns:
+        The number of converted rows.
+    """
+    if len(hash_sizes) != len(DEFAULT_CAT_NAMES):
+        raise ValueError(
+            f"Expected {len(DEFAULT_CAT_NAMES)} hash sizes, got {len(hash_sizes)}."
+        )
+    if max(hash_sizes) - 1 > _INT32_MAX:
+        raise ValueError("Hashed sparse ids must fit in int32.")
+    if dense_dtype not in DENSE_DTYPES:
+        raise ValueError(
+            f"Unknown dense_dtype {dense_dtype}. "
+            + "Please choose {int32, float32, float16} for dense_dtype"
+        )
+    num_rows = _count_rows(path)
+    dense = np.lib.format.open_memmap(
+        binary_column_path(prefix, DENSE_COLUMN),
+        mode="w+",
+        dtype=np.dtype(dense_dtype),
+        shape=(num_rows, len(DEFAULT_INT_NAMES)),
+    )
+    sparse = np.lib.format.open_memmap(
+        binary_column_path(prefix, SPARSE_COLUMN),
+        mode="w+",
+        dtype=np.int32,
+        shape=(num_rows, len(DEFAULT_CAT_NAMES)),
+    )
+    labels = np.lib.format.open_memmap(
+        binary_column_path(prefix, LABELS_COLUMN),
+        mode="w+",
+        dtype=np.int8,
+        shape=(num_rows,),
+    )
+
+    offset = 0
+    datapipe = (
+        ShardedLineReader([path])
+        .map(_criteo_row_mapper)
+        .batch(read_chunk_size)
+        .collate()
+    )
+    for chunk in datapipe:
+        dense_columns = np.stack(
+            [cast(torch.Tensor, chunk[name]).numpy() for name in DEFAULT_INT_NAMES],
+            axis=1,
+        )
+        if dense_dtype != "int32":
+            dense_columns = _log_dense(torch.from_numpy(dense_columns)).numpy()
+        elif dense_columns.min() < _INT32_MIN or dense_columns.max() > _INT32_MAX:
+            raise ValueError(f"Dense feature values in {path} do not fit in int32.")
+        size = len(dense_columns)
+        end = offset + size
+
+        values, mask = _hash_categorical(
+            [cast(Sequence[str], chunk[name]) for name in DEFAULT_CAT_NAMES],
+            hash_sizes,
+        )
+        sparse_columns = np.full(mask.shape, MISSING_ID, dtype=np.int32)
+        sparse_columns[mask] = values
+
+        dense[offset:end] = dense_columns
+        sparse[offset:end] = sparse_columns.T
+        labels[offset:end] = cast(torch.Tensor, chunk[DEFAULT_LABEL_NAME]).numpy()
+        offset = end
+    if offset != num_rows:
+        raise ValueError(f"Expected {num_rows} rows in {path}, parsed {offset}.")
+
+    for array in (dense, sparse, labels):
+        array.flush()
+    with open(binary_metadata_path(prefix), "w") as f:
+        json.dump(
+            {
+                "num_rows": num_rows,
+                "hash_sizes": hash_sizes,
+                "dense_dtype": dense_dtype,
+            },
+            f,
+        )
+    return num_rows
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Criteo TSV to binary converter")
+    parser.add_argument(
+        "--dataset_name",
+        type=str,
+        default="criteo_1t",
+        help="dataset to convert, current support criteo_1t, criteo_kaggle",
+    )
+    parser.add_argument(
+        "--dataset_path",
+        type=str,
+        required=True,
+        help="the path of the TSV dataset",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="the path to write the binary dataset to",
+    )
+    parser.add_argument(
+        "--num_days",
+        type=int,
+        default=24,
+        help="number of criteo_1t days to convert, starting from day_0",
+    )
+    parser.add_argument(
+        "--num_embeddings",
+        type=int,
+        default=100_000,
+        help="max_ind_size. The number of embeddings in each embedding table. Defaults"
+        " to 100_000 if num_embeddings_per_feature is not supplied.",
+    )
+    parser.add_argument(
+        "--num_embeddings_per_feature",
+        type=str,
+        default=None,
+        help="Comma separated max_ind_size per sparse feature. The number of embeddings"
+        " in each embedding table. 26 values are expected for the Criteo dataset.",
+    )
+    parser.add_argument(
+        "--read_chunk_size",
+        type=int,
+        default=100_000,
+        help="number of rows parsed at once",
+    )
+    parser.add_argument(
+        "--dense_dtype",
+        type=str,
+        default="int32",
+        choices=DENSE_DTYPES,
+        help="dtype of the stored dense features. float32 and float16 store them log"
+        " transformed, so that batches need no dense transform.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+
+    num_embeddings: Optional[int] = args.num_embeddings
+    num_embeddings_per_feature: Optional[List[int]] = None
+    if args.num_embeddings_per_feature is not None:
+        num_embeddings_per_feature = list(
+            map(int, args.num_embeddings_per_feature.split(","))
+        )
+        num_embeddings = None
+    hash_sizes = _hash_sizes(num_embeddings, num_embeddings_per_feature)
+
+    if args.dataset_name == "criteo_1t":
+        files = [(f"day_{day}.tsv", f"day_{day}") for day in range(args.num_days)]
+    elif args.dataset_name == "criteo_kaggle":
+        # the kaggle test file has no labels, thus not useable
+        files = [("train.txt", "train")]
+    else:
+        raise ValueError(
+            f"Unknown dataset {args.dataset_name}. "
+            + "Please choose {criteo_1t, criteo_kaggle} for dataset_name"
+        )
+
+    os.makedirs(args.output_path, exist_ok=True)
+    for filename, name in files:
+        num_rows = tsv_to_binary(
+            find_file(os.path.join(args.dataset_path, filename)),
+            os.path.join(args.output_path, name),
+            hash_sizes,
+            read_chunk_size=args.read_chunk_size,
+            dense_dtype=args.dense_dtype,
+        )
+        print(f"Converted {filename}: {num_rows} rows")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
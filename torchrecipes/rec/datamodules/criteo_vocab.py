@@ -0,0 +1,74 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+from typing import List, Sequence
+
+import numpy as np
+from torchrec.datasets.criteo import DEFAULT_CAT_NAMES
+
+
+class CriteoVocab:
+    """Per-feature vocabularies of the Criteo categorical features.
+
+    The vocabulary of a feature is the sorted array of its frequent raw ids. A raw
+    id is remapped to its position in that array, every other id to the shared
+    out-of-vocabulary (OOV) index right after it, so the embedding table of a
+    feature needs ``len(ids) + 1`` rows.
+
+    Vocabularies are built by ``torchrecipes.rec.datamodules.criteo_vocab_builder``
+    and stored as a ``.npz`` file with one uint64 array per feature name.
+
+    Args:
+        ids: Frequent raw ids of every categorical feature, in the order of
+            ``DEFAULT_CAT_NAMES``.
+    """
+
+    def __init__(self, ids: Sequence[np.ndarray]) -> None:
+        if len(ids) != len(DEFAULT_CAT_NAMES):
+            raise ValueError(
+                f"Expected {len(DEFAULT_CAT_NAMES)} vocabularies, got {len(ids)}."
+            )
+        self.ids: List[np.ndarray] = [np.unique(x.astype(np.uint64)) for x in ids]
+
+    @property
+    def num_embeddings_per_feature(self) -> List[int]:
+        return [len(x) + 1 for x in self.ids]
+
+    def remap(self, ids: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """Remaps raw ids to embedding indices.
+
+        Args:
+            ids: uint64 raw ids of all features, feature by feature.
+            lengths: Number of ids of every feature.
+
+        Returns:
+            The int64 indices of the ids.
+        """
+        indices = np.empty(len(ids), dtype=np.int64)
+        start = 0
+        for vocab, length in zip(self.ids, lengths.tolist()):
+            end = start + length
+            feature_ids = ids[start:end]
+            if len(vocab) == 0:
+                indices[start:end] = 0
+            else:
+                pos = np.searchsorted(vocab, feature_ids)
+                # positions past the end are clipped, the comparison rejects them
+                found = vocab[np.minimum(pos, len(vocab) - 1)] == feature_ids
+                indices[start:end] = np.where(found, pos, len(vocab))
+            start = end
+        return indices
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, **dict(zip(DEFAULT_CAT_NAMES, self.ids)))
+
+    @classmethod
+    def load(cls, path: str) -> "CriteoVocab":
+        with np.load(path) as f:
+            return cls([f[name] for name in DEFAULT_CAT_NAMES])
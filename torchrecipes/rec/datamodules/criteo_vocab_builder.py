@@ -0,0 +1,349 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Builds the vocabularies of the Criteo categorical features, loaded by
+``CriteoDataModule(vocab_path=...)``.
+
+The ids of every feature are counted in one pass over the TSV files with a
+count-min sketch. An id becomes a vocabulary candidate as soon as its estimated
+count reaches ``min_count``, so besides the sketches only the candidates are held
+in memory: the ids counted at least ``min_count`` times, at most
+``total_count / min_count`` per feature, plus the false positives of the sketch,
+rarer ids whose estimate is inflated by collisions. Estimated counts never
+undercount, thus no frequent id is missed.
+
+The collisions grow with the number of ids counted per counter, so a sketch of a
+fixed width saturates on large datasets and lets almost every id through. The
+width is therefore sized from the number of rows, such that an id seen once
+becomes a false positive with probability at most ``false_positive_rate``, see
+:func:`sketch_width_for`. Ids seen more often, but fewer than ``min_count``
+times, are more likely to.
+
+Example:
+    python -m torchrecipes.rec.datamodules.criteo_vocab_builder \
+        --dataset_path /data/criteo --num_days 24 --min_count 4 \
+        --output_path /data/criteo/vocab.npz
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+from typing import cast, List, Optional, Sequence
+
+import numpy as np
+from torchrec.datasets.criteo import DEFAULT_CAT_NAMES
+from torchrecipes.rec.datamodules.compressed import find_file, read_blocks
+from torchrecipes.rec.datamodules.criteo_datamodule import (
+    _categorical_ids,
+    _criteo_row_mapper,
+)
+from torchrecipes.rec.datamodules.criteo_vocab import CriteoVocab
+from torchrecipes.rec.datamodules.sharding import ShardedLineReader
+from torchrecipes.rec.datamodules.train_val_split import _mix_array
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """Approximate counts of uint64 ids in a fixed ``[depth, width]`` table.
+
+    Args:
+        width: Number of counters per row.
+        depth: Number of rows, each with its own hash function.
+    """
+
+    def __init__(self, width: int = 1 << 20, depth: int = 4) -> None:
+        if width < 1 or depth < 1:
+            raise ValueError("width and depth must be positive")
+        self.width = width
+        self.table: np.ndarray = np.zeros((depth, width), dtype=np.uint32)
+
+    def _slots(self, ids: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [
+                _mix_array(ids, row) % np.uint64(self.width)
+                for row in range(len(self.table))
+            ]
+        ).astype(np.int64)
+
+    def add(self, ids: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """Adds ``counts`` to unique ``ids`` and returns their new estimates."""
+        slots = self._slots(ids)
+        for row, row_slots in zip(self.table, slots):
+            np.add.at(row, row_slots, counts.astype(np.uint32))
+        return self._estimate(slots)
+
+    def estimate(self, ids: np.ndarray) -> np.ndarray:
+        return self._estimate(self._slots(ids))
+
+    def _estimate(self, slots: np.ndarray) -> np.ndarray:
+        return np.min(
+            [row[row_slots] for row, row_slots in zip(self.table, slots)], axis=0
+        )
+
+
+def sketch_width_for(
+    num_ids: int, min_count: int, depth: int = 4, false_positive_rate: float = 0.01
+) -> int:
+    """Width of a count-min sketch of ``num_ids`` counted ids such that an id
+    seen once reaches an estimate of ``min_count`` with probability at most
+    ``false_positive_rate``.
+
+    The expected overcount of an id in every row of the sketch is at most
+    ``num_ids / width``, so by Markov's inequality the ``depth`` rows all
+    overcount it by ``min_count - 1`` with probability at most
+    ``(num_ids / (width * (min_count - 1))) ** depth``.
+    """
+    if not 0 < false_positive_rate < 1:
+        raise ValueError(
+            f"false_positive_rate {false_positive_rate} must be within 0 and 1"
+        )
+    if min_count < 2:
+        # every id is kept, the sketch is not needed
+        return 1
+    width = num_ids / ((min_count - 1) * false_positive_rate ** (1 / depth))
+    return max(1, math.ceil(width))
+
+
+def count_rows(paths: Sequence[str], block_size: int = 1 << 24) -> int:
+    """Number of lines of files, possibly compressed, without parsing them."""
+    return sum(
+        block.count(b"\n") for path in paths for block in read_blocks(path, block_size)
+    )
+
+
+class _Candidates:
+    """Set of uint64 ids, merged into a sorted array lazily."""
+
+    def __init__(self) -> None:
+        self.ids: np.ndarray = np.zeros(0, dtype=np.uint64)
+        self._pending: List[np.ndarray] = []
+        self._num_pending = 0
+
+    def add(self, ids: np.ndarray) -> None:
+        self._pending.append(ids)
+        self._num_pending += len(ids)
+        # merging costs O(len(self.ids)), only do so once as many ids are pending
+        if self._num_pending > max(len(self.ids), 1 << 16):
+            self.merge()
+
+    def merge(self) -> np.ndarray:
+        if self._pending:
+            self.ids = np.unique(np.concatenate([self.ids] + self._pending))
+            self._pending = []
+            self._num_pending = 0
+        return self.ids
+
+
+def build_vocab(
+    paths: Sequence[str],
+    min_count: int = 2,
+    max_vocab_size: Optional[int] = None,
+    sketch_width: Optional[int] = None,
+    sketch_depth: int = 4,
+    read_chunk_size: int = 100000,
+    multi_hot_delimiter: Optional[str] = None,
+    false_positive_rate: float = 0.01,
+    num_rows: Optional[int] = None,
+) -> CriteoVocab:
+    """Builds the vocabularies of the categorical features of labeled Criteo TSV
+    files.
+
+    Args:
+        paths: Paths of the TSV files, possibly compressed.
+        min_count: Minimum estimated count of the ids kept in a vocabulary.
+        max_vocab_size: If not ``None``, only this many most frequent ids of
+            every feature are kept.
+        sketch_width: Number of counters per row of the sketch of every feature.
+            If ``None``, sized for one id per row and feature by
+            :func:`sketch_width_for`. Multi-hot values with more ids per row
+            need a larger width.
+        sketch_depth: Number of rows of the sketch of every feature.
+        read_chunk_size: Number of rows parsed at once.
+        multi_hot_delimiter: If not ``None``, separator of the ids of multi-hot
+            categorical values, see ``CriteoDataModule``.
+        false_positive_rate: Target probability of an id seen once to be kept,
+            sizes the sketch if ``sketch_width`` is ``None``.
+        num_rows: Number of rows of the files, counted in a pass over the files
+            without parsing them if ``None`` and needed to size the sketch.
+    """
+    if min_count < 1:
+        raise ValueError(f"min_count {min_count} must be positive")
+    sized_for = None
+    if sketch_width is None:
+        if num_rows is None:
+            num_rows = count_rows(paths)
+        sketch_width = sketch_width_for(
+            num_rows, min_count, sketch_depth, false_positive_rate
+        )
+        sized_for = num_rows
+        logger.info(
+            f"Sized the count-min sketches for {num_rows} rows: {sketch_width} "
+            f"counters per row, {4 * sketch_depth * sketch_width} bytes per feature"
+        )
+    sketches = [CountMinSketch(sketch_width, sketch_depth) for _ in DEFAULT_CAT_NAMES]
+    candidates = [_Candidates() for _ in DEFAULT_CAT_NAMES]
+    num_counted = np.zeros(len(DEFAULT_CAT_NAMES), dtype=np.int64)
+
+    datapipe = (
+        ShardedLineReader(paths)
+        .map(_criteo_row_mapper)
+        .batch(read_chunk_size)
+        .collate()
+    )
+    for chunk in datapipe:
+        ids, lengths = _categorical_ids(
+            [cast(Sequence[str], chunk[name]) for name in DEFAULT_CAT_NAMES],
+            multi_hot_delimiter,
+        )
+        feature_lengths = lengths.sum(axis=1)
+        num_counted += feature_lengths
+        start = 0
+        for sketch, feature_candidates, length in zip(
+            sketches, candidates, feature_lengths.tolist()
+        ):
+            unique_ids, counts = np.unique(
+                ids[start : start + length], return_counts=True
+            )
+            start += length
+            estimates = sketch.add(unique_ids, counts)
+            feature_candidates.add(unique_ids[estimates >= min_count])
+
+    if sized_for is not None and num_counted.max() > sized_for:
+        logger.warning(
+            f"Counted up to {num_counted.max()} ids per feature with sketches sized "
+            f"for {sized_for}, more ids than false_positive_rate allows are kept. "
+            "Please set a larger sketch_width for multi-hot values"
+        )
+
+    vocabs = []
+    for sketch, feature_candidates in zip(sketches, candidates):
+        vocab = feature_candidates.merge()
+        if max_vocab_size is not None and len(vocab) > max_vocab_size:
+            # stable sort, ties keep the smaller ids
+            order = np.argsort(-sketch.estimate(vocab).astype(np.int64), kind="stable")
+            vocab = vocab[order[:max_vocab_size]]
+        vocabs.append(vocab)
+    return CriteoVocab(vocabs)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Criteo vocabulary builder")
+    parser.add_argument(
+        "--dataset_name",
+        type=str,
+        default="criteo_1t",
+        help="dataset to index, current support criteo_1t, criteo_kaggle",
+    )
+    parser.add_argument(
+        "--dataset_path",
+        type=str,
+        required=True,
+        help="the path of the TSV dataset",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="the path of the vocabulary file to write",
+    )
+    parser.add_argument(
+        "--num_days",
+        type=int,
+        default=24,
+        help="number of criteo_1t days to index, starting from day_0",
+    )
+    parser.add_argument(
+        "--min_count",
+        type=int,
+        default=2,
+        help="minimum count of the ids kept in the vocabularies",
+    )
+    parser.add_argument(
+        "--max_vocab_size",
+        type=int,
+        default=None,
+        help="maximum number of ids kept per feature, the most frequent ones",
+    )
+    parser.add_argument(
+        "--sketch_width",
+        type=int,
+        default=None,
+        help="number of counters per row of the count-min sketch of each feature,"
+        " every sketch takes 4 * sketch_depth * sketch_width bytes. Sized from the"
+        " number of rows and --false_positive_rate if not set",
+    )
+    parser.add_argument(
+        "--false_positive_rate",
+        type=float,
+        default=0.01,
+        help="target probability of an id seen once to be kept in a vocabulary",
+    )
+    parser.add_argument(
+        "--num_rows",
+        type=int,
+        default=None,
+        help="number of rows of the dataset, counted if not set",
+    )
+    parser.add_argument(
+        "--sketch_depth",
+        type=int,
+        default=4,
+        help="number of rows of the count-min sketch of each feature",
+    )
+    parser.add_argument(
+        "--read_chunk_size",
+        type=int,
+        default=100_000,
+        help="number of rows parsed at once",
+    )
+    parser.add_argument(
+        "--multi_hot_delimiter",
+        type=str,
+        default=None,
+        help="separator of the ids of multi-hot categorical values",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    if args.dataset_name == "criteo_1t":
+        paths = [
+            find_file(os.path.join(args.dataset_path, f"day_{day}.tsv"))
+            for day in range(args.num_days)
+        ]
+    elif args.dataset_name == "criteo_kaggle":
+        paths = [find_file(os.path.join(args.dataset_path, "train.txt"))]
+    else:
+        raise ValueError(
+            f"Unknown dataset {args.dataset_name}. "
+            + "Please choose {criteo_1t, criteo_kaggle} for dataset_name"
+        )
+    vocab = build_vocab(
+        paths,
+        min_count=args.min_count,
+        max_vocab_size=args.max_vocab_size,
+        sketch_width=args.sketch_width,
+        sketch_depth=args.sketch_depth,
+        read_chunk_size=args.read_chunk_size,
+        multi_hot_delimiter=args.multi_hot_delimiter,
+        false_positive_rate=args.false_positive_rate,
+        num_rows=args.num_rows,
+    )
+    vocab.save(args.output_path)
+    print(
+        "Vocabulary sizes (including the OOV index): "
+        + ",".join(map(str, vocab.num_embeddings_per_feature))
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
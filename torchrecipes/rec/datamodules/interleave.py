@@ -0,0 +1,93 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import random
+import threading
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Sequence, TypeVar
+
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.background import Producer
+
+T = TypeVar("T")
+
+
+class InterleavedReader(IterDataPipe[T]):
+    r""":class:`InterleavedReader`.
+
+    Iterable datapipe reading several datapipes at once, e.g. one per file, each on
+    its own background thread, and interleaving chunks of their items. Up to
+    ``parallelism`` datapipes are read at a time, the next pending one starts when
+    one is exhausted. Every reader thread reads ahead at most ``prefetch_depth``
+    chunks. The output order only depends on the inputs and ``seed``, not on thread
+    timing.
+
+    Args:
+        datapipes: Datapipes to interleave.
+        parallelism: Number of datapipes read at the same time.
+        prefetch_depth: Number of chunks each reader thread reads ahead.
+        chunk_size: Number of consecutive items taken from one datapipe at a time.
+        mode: round_robin or random, how the next chunk's datapipe is picked
+            among the ones being read.
+        seed: Random seed of the random mode.
+    """
+
+    def __init__(
+        self,
+        datapipes: Sequence[IterDataPipe[T]],
+        parallelism: int = 2,
+        prefetch_depth: int = 4,
+        chunk_size: int = 1024,
+        mode: str = "round_robin",
+        seed: Optional[int] = None,
+    ) -> None:
+        if parallelism < 1 or prefetch_depth < 1 or chunk_size < 1:
+            raise ValueError(
+                "parallelism, prefetch_depth and chunk_size must be positive."
+            )
+        if mode not in ("round_robin", "random"):
+            raise ValueError(
+                f"Unknown mode {mode}. Please choose {{round_robin, random}} for mode"
+            )
+        self.datapipes: List[IterDataPipe[T]] = list(datapipes)
+        self.parallelism = parallelism
+        self.prefetch_depth = prefetch_depth
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.seed = seed
+
+    def __iter__(self) -> Iterator[T]:
+        rng = random.Random(self.seed)
+        pending: Deque[IterDataPipe[T]] = deque(self.datapipes)
+        active: List[Producer[T]] = []
+        stop = threading.Event()
+        cursor = 0
+        try:
+            while pending or active:
+                while pending and len(active) < self.parallelism:
+                    active.append(
+                        Producer(
+                            pending.popleft(),
+                            self.chunk_size,
+                            self.prefetch_depth,
+                            stop,
+                        )
+                    )
+                if self.mode == "random":
+                    cursor = rng.randrange(len(active))
+                else:
+                    cursor %= len(active)
+                chunk = active[cursor].get()
+                if chunk is None:
+                    # the next active producer shifts into cursor
+                    active.pop(cursor)
+                    continue
+                yield from chunk
+                cursor += 1
+        finally:
+            stop.set()
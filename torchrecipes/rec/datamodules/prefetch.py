@@ -0,0 +1,129 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import threading
+from collections import deque
+from typing import Callable, Deque, Iterable, Iterator, Optional, Tuple, TypeVar
+
+import pytorch_lightning as pl
+import torch
+from torchrecipes.rec.datamodules.background import Producer
+
+# batches providing pin_memory, to and record_stream, e.g. the Batch of
+# torchrecipes.rec.datamodules.commons or torchrec.datasets.utils
+T = TypeVar("T")
+
+
+def trainer_device(datamodule: pl.LightningDataModule) -> torch.device:
+    """The device the trainer of a datamodule trains on, cpu if it has none."""
+    trainer = datamodule.trainer
+    if trainer is None:
+        return torch.device("cpu")
+    return trainer.strategy.root_device
+
+
+def batch_prefetch_fn(
+    datamodule: pl.LightningDataModule,
+) -> Optional[Callable[[T], None]]:
+    """The ``prefetch_batch`` method of the LightningModule trained with a
+    datamodule if it has one, e.g. to load embedding cache rows ahead of time."""
+    trainer = datamodule.trainer
+    if trainer is None:
+        return None
+    return getattr(trainer.lightning_module, "prefetch_batch", None)
+
+
+class DevicePrefetcher(Iterable[T]):
+    r""":class:`DevicePrefetcher`.
+
+    Iterates the batches of an iterable, e.g. a dataloader, moved to a device ahead
+    of time. A background thread reads and pins up to ``depth`` batches. On CUDA
+    devices up to ``depth`` more batches are copied asynchronously on a side
+    stream, the compute stream only waits for the copy of the batch it receives,
+    and the copied tensors are recorded on it so that the caching allocator does
+    not reuse their memory while they are in use. On other devices it reduces to
+    a background thread reading ahead, so that loading overlaps with compute.
+
+    Args:
+        iterable: Iterable of batches.
+        device: Device to move the batches to.
+        depth: Number of batches read ahead, and on CUDA copied ahead.
+        pin_memory: Whether to pin the batches before copying them to a CUDA
+            device, required for the copies to be asynchronous.
+        on_prefetch: Called in the background thread with every batch read,
+            ``depth`` batches ahead of the batch consumed.
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[T],
+        device: torch.device,
+        depth: int = 2,
+        pin_memory: bool = True,
+        on_prefetch: Optional[Callable[[T], None]] = None,
+    ) -> None:
+        if depth < 1:
+            raise ValueError(f"depth {depth} must be positive")
+        self.iterable = iterable
+        self.device = device
+        self.depth = depth
+        self.pin_memory: bool = pin_memory and device.type == "cuda"
+        self.on_prefetch = on_prefetch
+
+    def __len__(self) -> int:
+        # pyre-ignore[6]: raises TypeError like len() if iterable has no length
+        return len(self.iterable)
+
+    def _host_batches(self) -> Iterator[T]:
+        on_prefetch = self.on_prefetch
+        for batch in self.iterable:
+            if on_prefetch is not None:
+                on_prefetch(batch)
+            # pyre-ignore[16]
+            yield batch.pin_memory() if self.pin_memory else batch
+
+    def _read(self, producer: Producer[T]) -> Optional[T]:
+        chunk = producer.get()
+        return None if chunk is None else chunk[0]
+
+    def __iter__(self) -> Iterator[T]:
+        stop = threading.Event()
+        producer = Producer(self._host_batches(), 1, self.depth, stop)
+        try:
+            if self.device.type != "cuda":
+                while (batch := self._read(producer)) is not None:
+                    yield batch
+                return
+
+            stream = torch.cuda.Stream(self.device)
+            # device batch, copy done event and the host batch kept alive until
+            # the copy is consumed
+            in_flight: Deque[Tuple[T, torch.cuda.Event, T]] = deque()
+            exhausted = False
+            while True:
+                while not exhausted and len(in_flight) < self.depth:
+                    batch = self._read(producer)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    with torch.cuda.stream(stream):
+                        # pyre-ignore[16]
+                        moved = batch.to(self.device, non_blocking=True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                    in_flight.append((moved, event, batch))
+                if not in_flight:
+                    return
+                moved, event, _ = in_flight.popleft()
+                current = torch.cuda.current_stream(self.device)
+                current.wait_event(event)
+                # pyre-ignore[16]
+                moved.record_stream(current)
+                yield moved
+        finally:
+            stop.set()
@@ -5,13 +5,18 @@
 
 
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Optional, List, Union
 
 import pytorch_lightning as pl
 from hydra.core.config_store import ConfigStore
 from torch.utils.data import DataLoader
 from torchrec.datasets.random import RandomRecDataset
 from torchrecipes.core.conf import DataModuleConf
+from torchrecipes.rec.datamodules.prefetch import (
+    batch_prefetch_fn,
+    DevicePrefetcher,
+    trainer_device,
+)
 from torchrecipes.utils.config_utils import get_class_name_str
 
 
@@ -25,6 +30,11 @@ class RandomRecDataModule(pl.LightningDataModule):
         "sparse_features": KeyedJaggedTensor,
         "labels": torch.Tensor,
     }
+
+    If ``device_prefetch_depth`` is positive, the dataloaders move this many
+    batches to the device of the trainer ahead of time, see
+    ``torchrecipes.rec.datamodules.prefetch.DevicePrefetcher``, which also passes
+    them to the ``prefetch_batch`` method of the trained LightningModule, if any.
     """
 
     def __init__(
@@ -38,6 +48,7 @@ class RandomRecDataModule(pl.LightningDataModule):
         ids_per_feature: int = 2,
         num_dense: int = 50,
         num_workers: int = 0,
+        device_prefetch_depth: int = 0,
     ) -> None:
         super().__init__()
         self.keys: List[str] = keys if keys else ["f1", "f3", "f2"]
@@ -49,6 +60,7 @@ class RandomRecDataModule(pl.LightningDataModule):
         self.ids_per_feature = ids_per_feature
         self.num_dense = num_dense
         self.num_workers = num_workers
+        self.device_prefetch_depth = device_prefetch_depth
         self.init_loader: DataLoader = DataLoader(
             RandomRecDataset(
                 keys=self.keys,
@@ -65,14 +77,24 @@ class RandomRecDataModule(pl.LightningDataModule):
             num_workers=self.num_workers,
         )
 
-    def train_dataloader(self) -> DataLoader:
+    def _dataloader(self) -> Union[DataLoader, DevicePrefetcher]:
+        if self.device_prefetch_depth > 0:
+            return DevicePrefetcher(
+                self.init_loader,
+                trainer_device(self),
+                depth=self.device_prefetch_depth,
+                on_prefetch=batch_prefetch_fn(self),
+            )
         return self.init_loader
 
-    def val_dataloader(self) -> DataLoader:
-        return self.init_loader
+    def train_dataloader(self) -> Union[DataLoader, DevicePrefetcher]:
+        return self._dataloader()
 
-    def test_dataloader(self) -> DataLoader:
-        return self.init_loader
+    def val_dataloader(self) -> Union[DataLoader, DevicePrefetcher]:
+        return self._dataloader()
+
+    def test_dataloader(self) -> Union[DataLoader, DevicePrefetcher]:
+        return self._dataloader()
 
 
 @dataclass
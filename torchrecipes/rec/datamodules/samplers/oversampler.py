@@ -0,0 +1,340 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import logging
+import random
+import sys
+from collections import Counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+
+import numpy as np
+import torch
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.samplers.undersampler import UnderSampler
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+
+def row_nbytes(row: Any) -> int:  # pyre-ignore[2]
+    """Approximate number of bytes held by a row, e.g. a dict of strings or
+    tensors. Keys are not counted, they are shared by all rows."""
+    if isinstance(row, torch.Tensor):
+        return row.element_size() * row.nelement()
+    if isinstance(row, np.ndarray):
+        return row.nbytes
+    if isinstance(row, Mapping):
+        return sys.getsizeof(row) + sum(row_nbytes(v) for v in row.values())
+    if isinstance(row, (list, tuple)):
+        return sys.getsizeof(row) + sum(row_nbytes(v) for v in row)
+    return sys.getsizeof(row)
+
+
+class ReplayBuffer(Generic[T, U]):
+    r""":class:`ReplayBuffer`.
+
+    Bounded buffer of rows per label/class to replay rows from. Each class holds a
+    uniform reservoir sample of the rows added for it, of at most ``capacity``
+    rows. If ``max_bytes`` is set, rows that would bring the estimated size of the
+    buffer, see :func:`row_nbytes`, over it are not kept. If ``max_replays`` is
+    set, rows are removed once they were sampled that many times.
+
+    Args:
+        capacity: Maximum number of rows kept per class.
+        max_bytes: Maximum estimated number of bytes held by all classes.
+        max_replays: Maximum number of times a row is sampled.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        max_bytes: Optional[int] = None,
+        max_replays: Optional[int] = None,
+    ) -> None:
+        if capacity < 1:
+            raise ValueError(f"capacity {capacity} must be positive")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError(f"max_bytes {max_bytes} must be positive")
+        if max_replays is not None and max_replays < 1:
+            raise ValueError(f"max_replays {max_replays} must be positive")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_replays = max_replays
+        self.rows: Dict[U, List[T]] = {}
+        self._sizes: Dict[U, List[int]] = {}
+        self._replays: Dict[U, List[int]] = {}
+        self._seen: Counter[U] = Counter()
+        self.nbytes = 0
+        self.peak_nbytes = 0
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.rows.values())
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.max_bytes is None or self.nbytes + nbytes <= self.max_bytes
+
+    def add(self, label: U, row: T, rng: random.Random) -> None:
+        self._seen[label] += 1
+        rows = self.rows.setdefault(label, [])
+        sizes = self._sizes.setdefault(label, [])
+        replays = self._replays.setdefault(label, [])
+        size = row_nbytes(row)
+        if len(rows) < self.capacity:
+            if not self._fits(size):
+                return
+            rows.append(row)
+            sizes.append(size)
+            replays.append(0)
+        else:
+            i = rng.randrange(self._seen[label])
+            if i >= len(rows) or not self._fits(size - sizes[i]):
+                return
+            self.nbytes -= sizes[i]
+            rows[i] = row
+            sizes[i] = size
+            replays[i] = 0
+        self.nbytes += size
+        self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+
+    def sample(self, label: U, rng: random.Random) -> Optional[T]:
+        rows = self.rows.get(label)
+        if not rows:
+            return None
+        i = rng.randrange(len(rows))
+        row = rows[i]
+        replays = self._replays[label]
+        replays[i] += 1
+        if self.max_replays is not None and replays[i] >= self.max_replays:
+            # swapped with the last row, so that the removal is O(1)
+            sizes = self._sizes[label]
+            self.nbytes -= sizes[i]
+            for values in (rows, sizes, replays):
+                values[i] = values[-1]
+                values.pop()
+        return row
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rows": len(self),
+            "bytes": self.nbytes,
+            "peak_bytes": self.peak_nbytes,
+        }
+
+
+class _ReplaySampler(UnderSampler[T]):
+    def __init__(
+        self,
+        datapipe: IterDataPipe[T],
+        row_to_label: Callable[[T], U],
+        buffer_size: int,
+        max_buffer_bytes: Optional[int],
+        seed: Optional[int],
+        rank: int,
+        world_size: int,
+        max_replays: Optional[int] = None,
+    ) -> None:
+        super().__init__(
+            datapipe, row_to_label, seed=seed, rank=rank, world_size=world_size
+        )
+        self.buffer_size = buffer_size
+        self.max_buffer_bytes = max_buffer_bytes
+        self.max_replays = max_replays
+        self.replay_buffer: ReplayBuffer[T, Any] = ReplayBuffer(
+            buffer_size, max_buffer_bytes, max_replays
+        )
+
+    def _reset(self) -> None:
+        self._reset_rng()
+        # rows are only replayed within the epoch they were read in
+        self.replay_buffer = ReplayBuffer(
+            self.buffer_size, self.max_buffer_bytes, self.max_replays
+        )
+
+    def _report(self) -> None:
+        logger.info(
+            f"{type(self).__name__} replay buffer: {self.replay_buffer.stats()}"
+        )
+
+
+class ProportionOverSampler(_ReplaySampler[T]):
+    r""":class:`ProportionOverSampler`.
+
+    Iterable datapipe wrapper for over-sampling if it is known how much to
+    oversample each label/class. Every row is yielded, and rows of oversampled
+    classes are added to a bounded :class:`ReplayBuffer`. After each such row,
+    rows drawn at random from the buffer of its class are replayed, so that each
+    class is yielded its multiplicity times as often as it is read, without reading
+    more data. Replaying buffered rows rather than repeating the current one
+    spreads the copies of a row over the epoch.
+
+    Args:
+        datapipe: Iterable datapipe to oversample from.
+        row_to_label: Function called over each item from datapipe to generate
+            label/class.
+        multiplicities: How much to oversample each label/class. The keys are the
+            classes while the values, at least 1, are the expected number of times
+            the rows of a class are yielded. Example: a multiplicity of 2.5 for
+            class c indicates that on average, every row read of class c is
+            followed by 1.5 replayed rows of class c. Classes not in
+            ``multiplicities`` are yielded once.
+        buffer_size: Maximum number of rows buffered per class.
+        max_buffer_bytes: Maximum estimated number of bytes buffered, see
+            :class:`ReplayBuffer`.
+        seed: Random seed for reproducibility.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[T],
+        row_to_label: Callable[[T], U],
+        multiplicities: Dict[U, float],
+        buffer_size: int = 10000,
+        max_buffer_bytes: Optional[int] = None,
+        seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        if any(m < 1 for m in multiplicities.values()):
+            raise ValueError("All multiplicities must be at least 1.")
+        super().__init__(
+            datapipe,
+            row_to_label,
+            buffer_size,
+            max_buffer_bytes,
+            seed,
+            rank,
+            world_size,
+        )
+        self.multiplicities = multiplicities
+
+    def __iter__(self) -> Iterator[T]:
+        self._reset()
+        for row in self.datapipe:
+            yield row
+            y = self.row_to_label(row)
+            multiplicity = self.multiplicities.get(y, 1.0)
+            if multiplicity == 1:
+                continue
+            self.replay_buffer.add(y, row, self.rng)
+            extra = multiplicity - 1
+            copies = int(extra) + int(self.rng.random() < extra - int(extra))
+            for _ in range(copies):
+                replayed = self.replay_buffer.sample(y, self.rng)
+                if replayed is not None:
+                    yield replayed
+        self._report()
+
+
+class WeightedReplaySampler(_ReplaySampler[T]):
+    r""":class:`WeightedReplaySampler`.
+
+    Iterable datapipe wrapper reaching a desired output distribution of
+    labels/classes by replaying rows instead of dropping them. Every row is
+    yielded. Rows of classes yielded less often than their target share so far are
+    added to a bounded :class:`ReplayBuffer`, and after each row, rows drawn at
+    random from the buffers of these classes are replayed until every class is
+    within one row of its target share. Classes above their target are never
+    dropped, so the target is reached as long as it only increases the share of
+    the minority classes. Every buffered row is replayed at most ``max_replays``
+    times, so that a few rows of a rare class cannot dominate the output. A class
+    whose buffered rows are used up stays below its target until more of its
+    rows are read.
+
+    Args:
+        datapipe: Iterable datapipe to sample from.
+        row_to_label: Function called over each item from datapipe to generate
+            label/class.
+        output_dist: The desired label/class distribution. The keys are the classes
+            while the values are the desired class percentages, which must be
+            positive for at least two classes. The values, however, do not have
+            to be normalized to sum up to 1. Rows of other classes are yielded
+            once and do not count towards the shares.
+        buffer_size: Maximum number of rows buffered per class.
+        max_buffer_bytes: Maximum estimated number of bytes buffered, see
+            :class:`ReplayBuffer`.
+        seed: Random seed for reproducibility.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+        max_replays: Maximum number of times a buffered row is replayed,
+            unbounded if ``None``.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[T],
+        row_to_label: Callable[[T], U],
+        output_dist: Dict[U, float],
+        buffer_size: int = 10000,
+        max_buffer_bytes: Optional[int] = None,
+        seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+        max_replays: Optional[int] = 10,
+    ) -> None:
+        # with a zero share, or a single class, the deficit of the other classes
+        # never shrinks and the replay never ends
+        if any(v <= 0 for v in output_dist.values()):
+            raise ValueError("Only positive values are allowed in output_dist.")
+        if len(output_dist) < 2:
+            raise ValueError("output_dist must have at least two classes.")
+        total = sum(output_dist.values())
+        super().__init__(
+            datapipe,
+            row_to_label,
+            buffer_size,
+            max_buffer_bytes,
+            seed,
+            rank,
+            world_size,
+            max_replays,
+        )
+        self.output_dist: Dict[U, float] = {
+            label: value / total for label, value in output_dist.items()
+        }
+
+    def __iter__(self) -> Iterator[T]:
+        self._reset()
+        f = self.output_dist
+        counts: Counter[U] = Counter()
+        # rows of the classes of output_dist yielded so far
+        num_rows = 0
+        for row in self.datapipe:
+            yield row
+            y = self.row_to_label(row)
+            if y not in f:
+                continue
+            counts[y] += 1
+            num_rows += 1
+            if f[y] * num_rows > counts[y] - 1:
+                self.replay_buffer.add(y, row, self.rng)
+            replayed = True
+            while replayed:
+                replayed = False
+                for label, share in f.items():
+                    if share * num_rows - counts[label] < 1:
+                        continue
+                    row = self.replay_buffer.sample(label, self.rng)
+                    if row is None:
+                        continue
+                    yield row
+                    counts[label] += 1
+                    num_rows += 1
+                    replayed = True
+        self._report()
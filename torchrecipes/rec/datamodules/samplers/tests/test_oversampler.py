@@ -0,0 +1,118 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import random
+from collections import Counter
+from typing import Optional
+
+import testslide
+import torch
+from torchrecipes.rec.datamodules.samplers.oversampler import (
+    ProportionOverSampler,
+    ReplayBuffer,
+    row_nbytes,
+    WeightedReplaySampler,
+)
+from torchrecipes.rec.datamodules.samplers.tests.test_undersampler import IDP_NoLen
+
+
+class TestOverSampler(testslide.TestCase):
+    def test_proportion_oversampler(self) -> None:
+        labels = [int(i % 10 == 0) for i in range(10000)]
+        sampler = ProportionOverSampler(
+            IDP_NoLen(labels), lambda x: x, {1: 3.0}, buffer_size=100, seed=0
+        )
+        counts = Counter(sampler)
+        self.assertEqual(counts[0], 9000)
+        self.assertEqual(counts[1], 3000)
+        self.assertLessEqual(sampler.replay_buffer.stats()["rows"], 100)
+
+    def test_proportion_oversampler_errors(self) -> None:
+        with self.assertRaisesRegex(
+            ValueError, "All multiplicities must be at least 1."
+        ):
+            ProportionOverSampler(IDP_NoLen(range(4)), lambda x: x % 2, {0: 0.5})
+
+    def test_weighted_replay_sampler(self) -> None:
+        rng = random.Random(0)
+        rows = [{"label": int(rng.random() < 0.1), "id": i} for i in range(5000)]
+        sampler = WeightedReplaySampler(
+            IDP_NoLen(rows),
+            lambda row: row["label"],
+            {0: 0.6, 1: 0.4},
+            buffer_size=50,
+            seed=0,
+        )
+        sampled = list(sampler)
+        counts = Counter(row["label"] for row in sampled)
+        # every row read is yielded, the minority is replayed up to its share
+        self.assertGreaterEqual(counts[0], sum(1 for row in rows if row["label"] == 0))
+        self.assertAlmostEqual(counts[1] / len(sampled), 0.4, delta=0.001)
+        self.assertEqual({row["id"] for row in sampled}, {row["id"] for row in rows})
+
+    def test_weighted_replay_sampler_errors(self) -> None:
+        for output_dist in ({0: 1.0, 1: 0.0}, {1: 1.0}, {0: 1.0, 1: -0.5}):
+            with self.assertRaises(ValueError):
+                WeightedReplaySampler(IDP_NoLen(range(4)), lambda x: x % 2, output_dist)
+        # positive shares end the replay after every row
+        sampled = list(
+            WeightedReplaySampler(
+                IDP_NoLen(range(4)), lambda x: x % 2, {0: 0.9, 1: 0.1}, seed=0
+            )
+        )
+        self.assertLess(len(sampled), 100)
+        self.assertEqual(set(sampled), {0, 1, 2, 3})
+
+    def test_weighted_replay_sampler_max_replays(self) -> None:
+        # a single minority row among 1000
+        rows = [{"label": int(i == 0), "id": i} for i in range(1000)]
+
+        def minority(max_replays: Optional[int]) -> int:
+            sampled = list(
+                WeightedReplaySampler(
+                    IDP_NoLen(rows),
+                    lambda row: row["label"],
+                    {0: 0.5, 1: 0.5},
+                    seed=0,
+                    max_replays=max_replays,
+                )
+            )
+            self.assertEqual(sum(1 for row in sampled if row["label"] == 0), 999)
+            return sum(1 for row in sampled if row["label"] == 1)
+
+        # read once and replayed at most max_replays times
+        self.assertEqual(minority(3), 4)
+        # unbounded, the row makes up half of the output
+        self.assertGreaterEqual(minority(None), 998)
+        with self.assertRaises(ValueError):
+            WeightedReplaySampler(
+                IDP_NoLen(rows),
+                lambda row: row["label"],
+                {0: 0.5, 1: 0.5},
+                max_replays=0,
+            )
+
+    def test_replay_buffer_caps(self) -> None:
+        row = {"dense": torch.zeros(16)}
+        size = row_nbytes(row)
+        buffer: ReplayBuffer = ReplayBuffer(capacity=10, max_bytes=4 * size)
+        rng = random.Random(0)
+        for _ in range(100):
+            buffer.add(0, {"dense": torch.zeros(16)}, rng)
+            buffer.add(1, {"dense": torch.zeros(16)}, rng)
+        stats = buffer.stats()
+        self.assertEqual(stats["rows"], 4)
+        self.assertLessEqual(stats["peak_bytes"], 4 * size)
+        self.assertIsNotNone(buffer.sample(0, rng))
+        self.assertIsNone(buffer.sample(2, rng))
+
+        buffer = ReplayBuffer(capacity=10)
+        for _ in range(100):
+            buffer.add(0, row, rng)
+        self.assertEqual(len(buffer), 10)
+        self.assertEqual(buffer.stats()["bytes"], 10 * size)
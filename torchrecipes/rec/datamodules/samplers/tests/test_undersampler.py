@@ -6,11 +6,20 @@
 
 #!/usr/bin/env python3
 
-from typing import TypeVar, Iterable, Iterator
+import os
+import tempfile
+import uuid
+from typing import Dict, TypeVar, Iterable, Iterator, List
 
+import numpy as np
 import testslide
+import torch
+import torch.distributed as dist
+from torch.distributed.launcher.api import elastic_launch, LaunchConfig
 from torch.utils.data import IterDataPipe
 from torchrecipes.rec.datamodules.samplers.undersampler import (
+    ColumnarDistributionUnderSampler,
+    ColumnarProportionUnderSampler,
     ProportionUnderSampler,
     DistributionUnderSampler,
 )
@@ -28,6 +37,31 @@ class IDP_NoLen(IterDataPipe[T]):
             yield i
 
 
+def _sync_counts() -> List[Dict[int, float]]:
+    dist.init_process_group("gloo")
+    rank = dist.get_rank()
+    sync_group = dist.new_group(backend="gloo")
+    # uneven shards with different class balance
+    n = 300 + 77 * rank
+    labels = [int(i % (2 + rank) == 0) for i in range(n)]
+    sampler = DistributionUnderSampler(
+        IDP_NoLen(labels),
+        lambda x: x,
+        {0: 0.5, 1: 0.5},
+        seed=0,
+        rank=rank,
+        world_size=2,
+        sync_interval=16,
+        sync_group=sync_group,
+    )
+    counts = []
+    for _ in range(2):
+        list(sampler)
+        counts.append(dict(sampler.input_dist))
+    dist.destroy_process_group()
+    return counts
+
+
 class TestUnderSampler(testslide.TestCase):
     def test_proportion_undersampler(self) -> None:
         n = 20
@@ -90,3 +124,194 @@ class TestUnderSampler(testslide.TestCase):
             DistributionUnderSampler(
                 idp, lambda x: x % 2, {0: 0.0, 1: 0.9, 2: 0.1}, {0: 0.5, 1: 0.5}
             )
+        with self.assertRaisesRegex(ValueError, "sync_group is required"):
+            DistributionUnderSampler(
+                idp, lambda x: x % 2, {0: 0.5, 1: 0.5}, sync_interval=16
+            )
+
+    def test_columnar_proportion_undersampler(self) -> None:
+        n = 1000
+        proportions = {0: 0.3, 1: 0.8}
+        expected = list(
+            ProportionUnderSampler(
+                IDP_NoLen(range(n)), lambda x: x % 2, proportions, seed=7
+            )
+        )
+        chunks = [
+            {"id": torch.arange(start, min(start + 64, n)), "name": ["x"] * 64}
+            for start in range(0, n, 64)
+        ]
+        chunks[-1]["name"] = chunks[-1]["name"][: len(chunks[-1]["id"])]
+        sampled = list(
+            ColumnarProportionUnderSampler(
+                IDP_NoLen(chunks), lambda c: c["id"] % 2, proportions, seed=7
+            )
+        )
+        self.assertEqual(
+            [i for chunk in sampled for i in chunk["id"].tolist()], expected
+        )
+        for chunk in sampled:
+            self.assertEqual(len(chunk["name"]), len(chunk["id"]))
+
+    def test_columnar_proportion_undersampler_keeps_all(self) -> None:
+        chunk = {"label": np.array([0, 1, 1])}
+        sampled = list(
+            ColumnarProportionUnderSampler(
+                IDP_NoLen([chunk]), lambda c: c["label"], {0: 1.0, 1: 1.0}
+            )
+        )
+        self.assertEqual(len(sampled), 1)
+        self.assertIs(sampled[0], chunk)
+
+    def test_columnar_proportion_undersampler_errors(self) -> None:
+        idp = IDP_NoLen([{"label": np.array([0, 2])}])
+        with self.assertRaisesRegex(
+            ValueError, "All proportions must be within 0 and 1."
+        ):
+            ColumnarProportionUnderSampler(idp, lambda c: c["label"], {0: -0.1})
+        with self.assertRaises(KeyError):
+            list(ColumnarProportionUnderSampler(idp, lambda c: c["label"], {0: 0.5}))
+
+    def test_columnar_distribution_undersampler(self) -> None:
+        n = 2000
+        labels = np.random.default_rng(0).choice([0, 0, 0, 1, 2, 5], n)
+        chunks = [
+            {"id": torch.arange(start, min(start + 128, n)), "label": labels[start:]}
+            for start in range(0, n, 128)
+        ]
+        for chunk in chunks:
+            chunk["label"] = chunk["label"][: len(chunk["id"])]
+        output_dist = {0: 0.5, 1: 0.3, 2: 0.2}
+        for input_dist in [None, {0: 3, 1: 1, 2: 1, 5: 1}]:
+            expected = list(
+                DistributionUnderSampler(
+                    IDP_NoLen(range(n)),
+                    lambda i: labels[i],
+                    output_dist,
+                    input_dist,
+                    seed=5,
+                )
+            )
+            sampled = ColumnarDistributionUnderSampler(
+                IDP_NoLen(chunks),
+                lambda c: c["label"],
+                output_dist,
+                input_dist,
+                seed=5,
+                update_interval=1,
+            )
+            self.assertEqual(
+                [i for chunk in sampled for i in chunk["id"].tolist()], expected
+            )
+
+        # coarser estimates still drop the unknown class and follow output_dist
+        sampled = ColumnarDistributionUnderSampler(
+            IDP_NoLen(chunks), lambda c: c["label"], output_dist, seed=5
+        )
+        counts = np.bincount(np.concatenate([c["label"] for c in sampled]))
+        self.assertEqual(counts[3:].sum(), 0)
+        self.assertGreater(counts[0], counts[1])
+        self.assertGreater(counts[1], counts[2])
+
+    def test_columnar_distribution_undersampler_errors(self) -> None:
+        idp = IDP_NoLen([{"label": np.array([0, 1])}])
+        with self.assertRaisesRegex(
+            ValueError, "Only non-negative values are allowed in output_dist."
+        ):
+            ColumnarDistributionUnderSampler(idp, lambda c: c["label"], {0: -1.0})
+        with self.assertRaisesRegex(
+            ValueError, "All keys in output_dist must be present in input_dist."
+        ):
+            ColumnarDistributionUnderSampler(
+                idp, lambda c: c["label"], {0: 1.0, 1: 1.0}, {0: 1.0}
+            )
+        with self.assertRaises(ValueError):
+            ColumnarDistributionUnderSampler(
+                idp, lambda c: c["label"], {0: 1.0}, update_interval=0
+            )
+        with self.assertRaisesRegex(ValueError, "sync_group is required"):
+            ColumnarDistributionUnderSampler(
+                idp, lambda c: c["label"], {0: 1.0}, sync_interval=16
+            )
+
+    def test_shard_streams(self) -> None:
+        def kept(rank: int, epoch: int) -> List[int]:
+            sampler = ProportionUnderSampler(
+                IDP_NoLen(range(200)),
+                lambda x: 0,
+                {0: 0.5},
+                seed=1,
+                rank=rank,
+                world_size=2,
+            )
+            sampler.set_epoch(epoch)
+            return list(sampler)
+
+        self.assertEqual(kept(0, 0), kept(0, 0))
+        self.assertNotEqual(kept(0, 0), kept(1, 0))
+        self.assertNotEqual(kept(0, 0), kept(0, 1))
+
+        # the epoch advances on every iteration
+        sampler = ProportionUnderSampler(
+            IDP_NoLen(range(200)), lambda x: 0, {0: 0.5}, seed=1, rank=1, world_size=2
+        )
+        self.assertEqual([list(sampler), list(sampler)], [kept(1, 0), kept(1, 1)])
+
+    def test_distribution_undersampler_sync(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lc = LaunchConfig(
+                min_nodes=1,
+                max_nodes=1,
+                nproc_per_node=2,
+                run_id=str(uuid.uuid4()),
+                rdzv_backend="c10d",
+                rdzv_endpoint=os.path.join(tmpdir, "rdzv"),
+                rdzv_configs={"store_type": "file"},
+                start_method="spawn",
+                monitor_interval=1,
+                max_restarts=0,
+            )
+            results = elastic_launch(config=lc, entrypoint=_sync_counts)()
+
+        # both ranks end every epoch with the counts of all ranks
+        labels = [int(i % 2 == 0) for i in range(300)]
+        labels += [int(i % 3 == 0) for i in range(377)]
+        for epoch in range(2):
+            expected = {label: (epoch + 1) * labels.count(label) for label in (0, 1)}
+            self.assertEqual(results[0][epoch], expected)
+            self.assertEqual(results[1][epoch], expected)
+
+    def test_proportion_undersampler_weights(self) -> None:
+        rows = [{"id": i, "label": i % 2} for i in range(100)]
+        proportions = {0: 0.25, 1: 0.5}
+        sampled = list(
+            ProportionUnderSampler(
+                IDP_NoLen(rows),
+                lambda row: row["label"],
+                proportions,
+                seed=0,
+                weight_key="weight",
+            )
+        )
+        self.assertEqual(
+            [row["weight"] for row in sampled],
+            [4.0 if row["label"] == 0 else 2.0 for row in sampled],
+        )
+
+        chunks = [
+            {"id": torch.arange(i, i + 10), "label": torch.arange(i, i + 10) % 2}
+            for i in range(0, 100, 10)
+        ]
+        columnar = list(
+            ColumnarProportionUnderSampler(
+                IDP_NoLen(chunks),
+                lambda c: c["label"],
+                proportions,
+                seed=0,
+                weight_key="weight",
+            )
+        )
+        self.assertEqual(
+            [w for chunk in columnar for w in chunk["weight"].tolist()],
+            [row["weight"] for row in sampled],
+        )
@@ -7,29 +7,153 @@
 import random
 from collections import Counter
 from typing import (
+    Any,
     Callable,
     Dict,
     Iterator,
+    List,
     Optional,
+    Tuple,
     TypeVar,
 )
 
-from torch.utils.data import IterDataPipe
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import get_worker_info, IterDataPipe
+from torchrecipes.rec.datamodules.columnar import Chunk, filter_rows, to_numpy
+from torchrecipes.rec.datamodules.sharding import current_shard
 
 T = TypeVar("T")
 U = TypeVar("U")
 
 
+def _uniforms(rng: random.Random, size: int) -> np.ndarray:
+    """Draws the next ``size`` values of ``rng.random()`` at once.
+
+    Python's ``random.Random`` and numpy's ``RandomState`` share the MT19937
+    generator and the 53-bit float conversion, so the state of ``rng`` is moved to
+    numpy for the draw and back, leaving ``rng`` where ``size`` calls of
+    ``rng.random()`` would.
+    """
+    version, state, gauss = rng.getstate()
+    mt = np.random.RandomState()
+    mt.set_state(("MT19937", np.array(state[:-1], dtype=np.uint32), state[-1]))
+    values = mt.random_sample(size)
+    _, key, pos, _, _ = mt.get_state()
+    rng.setstate((version, tuple(key.tolist()) + (pos,), gauss))
+    return values
+
+
+class _CountSync:
+    """Periodic, non-blocking all-reduce of class counts across ranks.
+
+    Once at least ``interval`` rows were counted, the counts added since the last
+    round are all-reduced asynchronously, and the counts of the other ranks are
+    picked up by a later :meth:`update` once the round has completed, so that
+    sampling never waits for slower ranks. Every round also sums whether the ranks
+    still read data, and :meth:`join` keeps running rounds at the end of an epoch
+    until all ranks are done, so that every rank runs the same rounds.
+
+    The rounds start at data-dependent points of the iteration, so they run on a
+    dedicated ``group``, never on the default group, whose collectives training
+    issues in a fixed order on every rank.
+    """
+
+    def __init__(
+        self,
+        num_classes: int,
+        interval: int,
+        group: dist.ProcessGroup,
+    ) -> None:
+        self.interval = interval
+        self.group = group
+        self._pending: np.ndarray = np.zeros(num_classes)
+        self._sent: np.ndarray = np.zeros(num_classes)
+        self._rows = 0
+        self._work: Optional[dist.Work] = None
+        self._tensor: Optional[torch.Tensor] = None
+
+    @staticmethod
+    def needed(group: dist.ProcessGroup) -> bool:
+        if not (dist.is_available() and dist.is_initialized()):
+            return False
+        if dist.get_world_size(group) < 2:
+            return False
+        if get_worker_info() is not None:
+            raise RuntimeError(
+                "Class counts can only be synchronized across ranks in the main "
+                "process, please use num_workers=0"
+            )
+        return True
+
+    def _launch(self, reading: bool) -> None:
+        self._sent = self._pending
+        self._pending = np.zeros(len(self._sent))
+        self._rows = 0
+        device = torch.device("cpu")
+        if dist.get_backend(self.group) == "nccl":
+            device = torch.device("cuda", torch.cuda.current_device())
+        self._tensor = torch.from_numpy(np.append(self._sent, float(reading))).to(
+            device
+        )
+        self._work = dist.all_reduce(self._tensor, group=self.group, async_op=True)
+
+    def _collect(self) -> Tuple[np.ndarray, int]:
+        work, tensor = self._work, self._tensor
+        assert work is not None and tensor is not None
+        work.wait()
+        self._work = None
+        values = tensor.cpu().numpy()
+        return values[:-1] - self._sent, int(values[-1])
+
+    def update(self, counts: np.ndarray) -> Optional[np.ndarray]:
+        """Adds the counts of the rows read by this rank. Returns the counts of the
+        other ranks received since the last call, if any."""
+        self._pending += counts
+        self._rows += int(counts.sum())
+        others = None
+        if self._work is not None and self._work.is_completed():
+            others, _ = self._collect()
+        if self._work is None and self._rows >= self.interval:
+            self._launch(reading=True)
+        return others
+
+    def join(self) -> np.ndarray:
+        """Waits for all ranks to finish reading, returns the counts of the other
+        ranks received meanwhile."""
+        others = np.zeros(len(self._pending))
+        if self._work is not None:
+            others += self._collect()[0]
+        while True:
+            self._launch(reading=False)
+            received, reading = self._collect()
+            others += received
+            if reading == 0:
+                return others
+
+
 class UnderSampler(IterDataPipe[T]):
     r""":class:`UnderSampler`.
 
     Iterable datapipe wrapper for under-sampling.
 
+    Every ``(rank, worker_id)`` shard of the data, see
+    :func:`~torchrecipes.rec.datamodules.sharding.current_shard`, samples with its
+    own random stream derived from ``(seed, epoch, shard_id)``. Thus shards make
+    independent decisions, so each one keeps the target proportions, and the
+    decisions are reproducible per shard while changing every epoch. The epoch is
+    advanced on every iteration or set explicitly by :meth:`set_epoch`. Note that
+    dataloader workers iterate copies of the datapipe, so they only advance the
+    epoch across iterations if they are persistent.
+
     Args:
         datapipe: Iterable datapipe to undersample from.
         row_to_label: Function called over each item from datapipe to generate
             label/class.
-        seed: Random seed for reproducibility.
+        seed: Random seed for reproducibility. ``None`` seeds from fresh OS entropy.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
     """
 
     def __init__(
@@ -37,12 +161,32 @@ class UnderSampler(IterDataPipe[T]):
         datapipe: IterDataPipe[T],
         row_to_label: Callable[[T], U],
         seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
     ) -> None:
         self.datapipe = datapipe
         self.row_to_label = row_to_label
         self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
         self.rng = random.Random(seed)
 
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _reset_rng(self) -> None:
+        """Seeds ``rng`` for the current shard and epoch, then advances the epoch."""
+        if self.seed is None:
+            self.rng = random.Random()
+        else:
+            shard_id, _ = current_shard(self.rank, self.world_size)
+            state = np.random.SeedSequence([self.seed, self.epoch, shard_id])
+            self.rng = random.Random(
+                int.from_bytes(state.generate_state(4).tobytes(), "little")
+            )
+        self.epoch += 1
+
     def __iter__(self) -> Iterator[T]:
         raise NotImplementedError
 
@@ -68,6 +212,20 @@ class DistributionUnderSampler(UnderSampler[T]):
             If known, then :class:`DistributionUnderSampler` will not update the
             distribution as it processes datapipe.
         seed: Random seed for reproducibility.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+        sync_interval: If set and ``torch.distributed`` is initialized, the counts
+            of the classes of ``output_dist`` are all-reduced over ``sync_group``
+            every ``sync_interval`` rows, so that the running estimate of the input
+            distribution, and thus the output distribution, is global rather than
+            per rank. The all-reduce does not block sampling, but every rank must
+            read its data to the end, in the main process. Unused if
+            ``input_dist`` is known.
+        sync_group: Process group to synchronize the counts over, required if
+            ``sync_interval`` is set. It must be dedicated to the sampler, e.g.
+            ``dist.new_group(backend="gloo")`` created by every rank in setup, as
+            the all-reduces start at data-dependent points, out of order with the
+            collectives of training on the default group.
 
     References:
         - https://www.wikiwand.com/en/Rejection_sampling
@@ -82,6 +240,10 @@ class DistributionUnderSampler(UnderSampler[T]):
         output_dist: Dict[U, float],
         input_dist: Optional[Dict[U, float]] = None,
         seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+        sync_interval: Optional[int] = None,
+        sync_group: Optional[dist.ProcessGroup] = None,
     ) -> None:
         if any(v < 0 for v in output_dist.values()):
             raise ValueError("Only non-negative values are allowed in output_dist.")
@@ -92,15 +254,53 @@ class DistributionUnderSampler(UnderSampler[T]):
                 raise ValueError(
                     "All keys in output_dist must be present in input_dist."
                 )
+        if sync_interval is not None and sync_interval < 1:
+            raise ValueError(f"sync_interval {sync_interval} must be positive")
+        if sync_interval is not None and sync_group is None:
+            raise ValueError(
+                "sync_group is required if sync_interval is set, please create a "
+                "dedicated group, e.g. dist.new_group(backend='gloo')"
+            )
 
-        super().__init__(datapipe, row_to_label, seed=seed)
+        super().__init__(
+            datapipe, row_to_label, seed=seed, rank=rank, world_size=world_size
+        )
         self.input_dist: Counter[U] = Counter(input_dist)  # pyre-ignore[6]
         self.output_dist: Counter[U] = Counter(output_dist)
         self._update_input_dist: bool = not bool(input_dist)
         # The pivot represents the class for which no undersampling is performed.
         self._pivot: Optional[U] = None
+        self.sync_interval = sync_interval
+        self.sync_group = sync_group
+        self._sync: Optional[_CountSync] = None
+
+    def _start_sync(self) -> Optional[_CountSync]:
+        sync_group = self.sync_group
+        if (
+            self.sync_interval is None
+            or sync_group is None
+            or not self._update_input_dist
+            or not _CountSync.needed(sync_group)
+        ):
+            return None
+        if self._sync is None:
+            self._sync = _CountSync(
+                len(self.output_dist), self.sync_interval, sync_group
+            )
+        return self._sync
+
+    def _add_counts(self, others: Optional[np.ndarray]) -> None:
+        if others is not None:
+            for label, count in zip(self.output_dist.keys(), others.tolist()):
+                self.input_dist[label] += count
 
     def __iter__(self) -> Iterator[T]:
+        self._reset_rng()
+        sync = self._start_sync()
+        classes = list(self.output_dist.keys())
+        # rows of each class read since the counts were last passed to sync
+        unsynced: Counter[U] = Counter()
+        num_unsynced = 0
         for row in self.datapipe:
             # To ease notation
             f = self.output_dist
@@ -109,6 +309,14 @@ class DistributionUnderSampler(UnderSampler[T]):
             y = self.row_to_label(row)
             if self._update_input_dist:
                 g[y] += 1
+                if sync is not None:
+                    unsynced[y] += 1
+                    num_unsynced += 1
+                    if num_unsynced == sync.interval:
+                        counts = np.array([unsynced[c] for c in classes], dtype=float)
+                        self._add_counts(sync.update(counts))
+                        unsynced.clear()
+                        num_unsynced = 0
 
             # Determine the sampling ratio
             if self._pivot is None or self._update_input_dist:
@@ -120,6 +328,11 @@ class DistributionUnderSampler(UnderSampler[T]):
             if self.rng.random() < ratio:
                 yield row
 
+        if sync is not None:
+            counts = np.array([unsynced[c] for c in classes], dtype=float)
+            self._add_counts(sync.update(counts))
+            self._add_counts(sync.join())
+
 
 class ProportionUnderSampler(UnderSampler[T]):
     r""":class:`ProportionUnderSampler`.
@@ -136,6 +349,11 @@ class ProportionUnderSampler(UnderSampler[T]):
             should be kept. Example: a proportion of 0.3 for class c indicates that
             30% of rows from datapipe whose label is c should be kept.
         seed: Random seed for reproducibility.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+        weight_key: If set, rows are mappings, and every kept row is yielded as a
+            copy with the inverse of its sampling proportion under this key, i.e.
+            an importance weight undoing the undersampling in expectation.
     """
 
     def __init__(
@@ -144,13 +362,268 @@ class ProportionUnderSampler(UnderSampler[T]):
         row_to_label: Callable[[T], U],
         proportions: Dict[U, float],
         seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+        weight_key: Optional[str] = None,
     ) -> None:
         if any(p < 0 or p > 1 for p in proportions.values()):
             raise ValueError("All proportions must be within 0 and 1.")
-        super().__init__(datapipe, row_to_label, seed=seed)
+        super().__init__(
+            datapipe, row_to_label, seed=seed, rank=rank, world_size=world_size
+        )
         self.proportions = proportions
+        self.weight_key = weight_key
 
     def __iter__(self) -> Iterator[T]:
+        self._reset_rng()
+        weight_key = self.weight_key
         for row in self.datapipe:
-            if self.rng.random() < self.proportions[self.row_to_label(row)]:
-                yield row
+            proportion = self.proportions[self.row_to_label(row)]
+            if self.rng.random() < proportion:
+                if weight_key is None:
+                    yield row
+                else:
+                    # pyre-ignore[6, 7]: rows are mappings if weight_key is set
+                    yield {**row, weight_key: 1.0 / proportion}
+
+
+class ColumnarProportionUnderSampler(UnderSampler[Chunk]):
+    r""":class:`ColumnarProportionUnderSampler`.
+
+    Chunked :class:`ProportionUnderSampler` over columnar chunks of rows, i.e.
+    mappings from column names to tensors, numpy arrays or lists, e.g. the output of
+    ``datapipe.batch(n).collate()``. The rows of a chunk are sampled at once with a
+    vectorized keep-mask and the remaining rows are yielded as one chunk. With the
+    same seed, it keeps exactly the rows :class:`ProportionUnderSampler` keeps.
+
+    Args:
+        datapipe: Iterable datapipe of columnar chunks to undersample from.
+        chunk_to_labels: Function called over each chunk to get the labels/classes of
+            its rows, as a tensor or numpy array.
+        proportions: How much to undersample each label/class, see
+            :class:`ProportionUnderSampler`.
+        seed: Random seed for reproducibility.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+        weight_key: If set, a float32 tensor column of this name holding the
+            inverse of the sampling proportion of every kept row is added to the
+            yielded chunks, see :class:`ProportionUnderSampler`.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[Chunk],
+        chunk_to_labels: Callable[[Chunk], Any],
+        proportions: Dict[Any, float],  # pyre-ignore[2]
+        seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+        weight_key: Optional[str] = None,
+    ) -> None:
+        if any(p < 0 or p > 1 for p in proportions.values()):
+            raise ValueError("All proportions must be within 0 and 1.")
+        super().__init__(
+            datapipe, chunk_to_labels, seed=seed, rank=rank, world_size=world_size
+        )
+        self.proportions = proportions
+        self.weight_key = weight_key
+
+    def __iter__(self) -> Iterator[Chunk]:
+        self._reset_rng()
+        weight_key = self.weight_key
+        for chunk in self.datapipe:
+            labels = to_numpy(self.row_to_label(chunk))
+            if len(labels) == 0:
+                continue
+            keep_probs = np.empty(len(labels))
+            known = np.zeros(len(labels), dtype=bool)
+            for label, proportion in self.proportions.items():
+                mask = labels == label
+                keep_probs[mask] = proportion
+                known |= mask
+            if not known.all():
+                raise KeyError(labels[~known][0])
+            keep = _uniforms(self.rng, len(labels)) < keep_probs
+            if not keep.any():
+                continue
+            kept = chunk if keep.all() else filter_rows(chunk, keep)
+            if weight_key is not None:
+                weights = (1.0 / keep_probs[keep]).astype(np.float32)
+                kept = {**kept, weight_key: torch.from_numpy(weights)}
+            yield kept
+
+
+class ColumnarDistributionUnderSampler(UnderSampler[Chunk]):
+    r""":class:`ColumnarDistributionUnderSampler`.
+
+    Chunked :class:`DistributionUnderSampler` over columnar chunks of rows, i.e.
+    mappings from column names to tensors, numpy arrays or lists, e.g. the output of
+    ``datapipe.batch(n).collate()``. Instead of updating the estimate of the input
+    distribution and the pivot for every row, the rows of a chunk are processed in
+    segments of ``update_interval`` rows: the class counts are updated with one
+    ``bincount`` per segment, the pivot is recomputed once, and the rows are
+    rejection sampled with a vectorized mask. The kept rows of a chunk are yielded as
+    one chunk. With ``update_interval=1`` and the same seed, it keeps exactly the rows
+    :class:`DistributionUnderSampler` keeps.
+
+    Args:
+        datapipe: Iterable datapipe of columnar chunks to undersample from.
+        chunk_to_labels: Function called over each chunk to get the labels/classes of
+            its rows, as a tensor or numpy array.
+        output_dist: The desired label/class distribution, see
+            :class:`DistributionUnderSampler`. Rows of other classes are dropped.
+        input_dist: Optional known label/class distribution of the input, see
+            :class:`DistributionUnderSampler`.
+        seed: Random seed for reproducibility.
+        update_interval: Number of rows between updates of the running estimate of
+            the input distribution. ``None`` updates it once per chunk. Smaller
+            intervals give fresher estimates at the cost of more Python work per
+            row. Unused if ``input_dist`` is known.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+        sync_interval: Number of rows between all-reduces of the class counts
+            across ranks, see :class:`DistributionUnderSampler`.
+        sync_group: Process group to synchronize the counts over, see
+            :class:`DistributionUnderSampler`.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[Chunk],
+        chunk_to_labels: Callable[[Chunk], Any],
+        output_dist: Dict[Any, float],  # pyre-ignore[2]
+        input_dist: Optional[Dict[Any, float]] = None,  # pyre-ignore[2]
+        seed: Optional[int] = None,
+        update_interval: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+        sync_interval: Optional[int] = None,
+        sync_group: Optional[dist.ProcessGroup] = None,
+    ) -> None:
+        if any(v < 0 for v in output_dist.values()):
+            raise ValueError("Only non-negative values are allowed in output_dist.")
+        if input_dist:
+            if any(v <= 0 for v in input_dist.values()):
+                raise ValueError("Only positive values are allowed in input_dist.")
+            if not (output_dist.keys() <= input_dist.keys()):
+                raise ValueError(
+                    "All keys in output_dist must be present in input_dist."
+                )
+        if update_interval is not None and update_interval < 1:
+            raise ValueError(f"update_interval {update_interval} must be positive")
+        if sync_interval is not None and sync_interval < 1:
+            raise ValueError(f"sync_interval {sync_interval} must be positive")
+        if sync_interval is not None and sync_group is None:
+            raise ValueError(
+                "sync_group is required if sync_interval is set, please create a "
+                "dedicated group, e.g. dist.new_group(backend='gloo')"
+            )
+
+        super().__init__(
+            datapipe, chunk_to_labels, seed=seed, rank=rank, world_size=world_size
+        )
+        self.classes: List[Any] = list(output_dist.keys())  # pyre-ignore[4]
+        self.output_dist: np.ndarray = np.array(
+            list(output_dist.values()), dtype=np.float64
+        )
+        self._update_input_dist: bool = not bool(input_dist)
+        # counts of the classes of output_dist seen so far, or their known
+        # proportions in the input. Rows of other classes are never kept, so they
+        # do not need to be counted.
+        self.input_dist: np.ndarray = (
+            np.array([input_dist[c] for c in self.classes], dtype=np.float64)
+            if input_dist
+            else np.zeros(len(self.classes), dtype=np.float64)
+        )
+        self.update_interval = update_interval
+        # The pivot represents the class for which no undersampling is performed.
+        self._pivot: Optional[int] = None
+        self.sync_interval = sync_interval
+        self.sync_group = sync_group
+        self._sync: Optional[_CountSync] = None
+
+    def _start_sync(self) -> Optional[_CountSync]:
+        sync_group = self.sync_group
+        if (
+            self.sync_interval is None
+            or sync_group is None
+            or not self._update_input_dist
+            or not _CountSync.needed(sync_group)
+        ):
+            return None
+        if self._sync is None:
+            self._sync = _CountSync(len(self.classes), self.sync_interval, sync_group)
+        return self._sync
+
+    def _codes(self, labels: np.ndarray) -> np.ndarray:
+        """Index of the class of each label in ``classes``, -1 if unknown."""
+        codes = np.full(len(labels), -1, dtype=np.int64)
+        for i, label in enumerate(self.classes):
+            codes[labels == label] = i
+        return codes
+
+    def _update_pivot(self) -> None:
+        g = self.input_dist
+        seen = g > 0
+        if not seen.any():
+            self._pivot = None
+            return
+        ratios = np.full(len(g), -np.inf)
+        ratios[seen] = self.output_dist[seen] / g[seen]
+        self._pivot = int(np.argmax(ratios))
+
+    def _sampling_ratios(self, codes: np.ndarray) -> np.ndarray:
+        ratios = np.zeros(len(codes))
+        pivot = self._pivot
+        if pivot is None:
+            return ratios
+        known = codes >= 0
+        f = self.output_dist
+        g = self.input_dist
+        numerator = f[codes[known]] * g[pivot]
+        denominator = f[pivot] * g[codes[known]]
+        positive = denominator > 0
+        known_ratios = np.zeros(len(numerator))
+        known_ratios[positive] = numerator[positive] / denominator[positive]
+        ratios[known] = known_ratios
+        return ratios
+
+    def __iter__(self) -> Iterator[Chunk]:
+        self._reset_rng()
+        sync = self._start_sync()
+        for chunk in self.datapipe:
+            codes = self._codes(to_numpy(self.row_to_label(chunk)))
+            size = len(codes)
+            if size == 0:
+                continue
+            # the segments consume the uniforms in row order, as rows would
+            uniforms = _uniforms(self.rng, size)
+            if not self._update_input_dist:
+                if self._pivot is None:
+                    self._update_pivot()
+                keep = uniforms < self._sampling_ratios(codes)
+            else:
+                interval = self.update_interval or size
+                keep = np.empty(size, dtype=bool)
+                for start in range(0, size, interval):
+                    end = start + interval
+                    segment = codes[start:end]
+                    counts = np.bincount(
+                        segment[segment >= 0], minlength=len(self.classes)
+                    )
+                    self.input_dist += counts
+                    if sync is not None:
+                        others = sync.update(counts)
+                        if others is not None:
+                            self.input_dist += others
+                    self._update_pivot()
+                    keep[start:end] = uniforms[start:end] < self._sampling_ratios(
+                        segment
+                    )
+            if keep.all():
+                yield chunk
+            elif keep.any():
+                yield filter_rows(chunk, keep)
+
+        if sync is not None:
+            self.input_dist += sync.join()
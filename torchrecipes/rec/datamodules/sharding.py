@@ -0,0 +1,200 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import csv
+import itertools
+import os
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import get_worker_info, IterDataPipe
+from torchrecipes.rec.datamodules.compressed import (
+    is_compressed,
+    read_lines,
+    read_seek_table,
+)
+
+T = TypeVar("T")
+
+
+def current_shard(rank: int = 0, world_size: int = 1) -> Tuple[int, int]:
+    """Returns ``(shard_id, num_shards)`` of the calling dataloader worker.
+
+    Every ``(rank, worker_id)`` pair owns one shard, so data split into
+    ``num_shards`` parts is read exactly once per epoch across all ranks and workers.
+    """
+    worker_info = get_worker_info()
+    worker_id, num_workers = (
+        (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+    )
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+def shard_range(
+    start: int, end: int, shard_id: int, num_shards: int
+) -> Tuple[int, int]:
+    """Splits ``[start, end)`` into ``num_shards`` contiguous ranges of nearly equal
+    size and returns the one of ``shard_id``."""
+    size = end - start
+    return (
+        start + size * shard_id // num_shards,
+        start + size * (shard_id + 1) // num_shards,
+    )
+
+
+class ShardedLineReader(IterDataPipe[List[str]]):
+    r""":class:`ShardedLineReader`.
+
+    Iterable datapipe reading delimiter separated lines of files, split into fields.
+    Every file is split into byte ranges, one per ``(rank, worker_id)`` shard, and
+    each shard only reads the lines starting in its own range. Thus each line is
+    read once per epoch, by exactly one shard, without any shard parsing the lines
+    of the others.
+
+    ``.gz`` and ``.zst`` files are decompressed on background threads, see
+    ``torchrecipes.rec.datamodules.compressed``, and line offsets refer to the
+    decompressed data. Seekable zstd files are split into byte ranges like plain
+    files. Other compressed files cannot be seeked, thus every shard decompresses
+    the whole file and only parses every ``num_shards``-th line.
+
+    Args:
+        paths: Paths of the files to read.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the files.
+        delimiter: Field delimiter.
+        buffer_size: Size in bytes of the read buffer of each file.
+        offset_filter: If not ``None``, only the lines for whose starting byte offset
+            it returns ``True`` are parsed and yielded.
+        decompress_threads: Number of threads decompressing the frames of a
+            seekable zstd file.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        rank: int = 0,
+        world_size: int = 1,
+        delimiter: str = "\t",
+        buffer_size: int = -1,
+        offset_filter: Optional[Callable[[int], bool]] = None,
+        decompress_threads: int = 1,
+    ) -> None:
+        if not (0 <= rank < world_size):
+            raise ValueError(f"Invalid rank {rank} for world_size {world_size}.")
+        self.paths: List[str] = list(paths)
+        self.rank = rank
+        self.world_size = world_size
+        self.delimiter = delimiter
+        self.buffer_size = buffer_size
+        self.offset_filter = offset_filter
+        self.decompress_threads = decompress_threads
+
+    def _read_lines(self, path: str, start: int, end: int) -> Iterator[str]:
+        with open(path, "rb", buffering=self.buffer_size) as f:
+            pos = start
+            if start > 0:
+                # the line crossing start belongs to the previous shard
+                f.seek(start - 1)
+                pos = start - 1 + len(f.readline())
+            offset_filter = self.offset_filter
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                if offset_filter is None or offset_filter(pos):
+                    yield line.decode("utf-8")
+                pos += len(line)
+
+    def _read_compressed_lines(
+        self, path: str, shard_id: int, num_shards: int
+    ) -> Iterator[str]:
+        seek_table = read_seek_table(path) if path.endswith(".zst") else None
+        if seek_table is None:
+            start, end, step = 0, None, num_shards
+        else:
+            start, end = shard_range(0, int(seek_table[-1, 1]), shard_id, num_shards)
+            shard_id, step = 0, 1
+        lines = read_lines(path, start, end, num_threads=self.decompress_threads)
+        offset_filter = self.offset_filter
+        for i, (pos, line) in enumerate(lines):
+            if i % step == shard_id and (offset_filter is None or offset_filter(pos)):
+                yield line.decode("utf-8")
+
+    def __iter__(self) -> Iterator[List[str]]:
+        shard_id, num_shards = current_shard(self.rank, self.world_size)
+        for path in self.paths:
+            if is_compressed(path):
+                lines = self._read_compressed_lines(path, shard_id, num_shards)
+            else:
+                start, end = shard_range(0, os.path.getsize(path), shard_id, num_shards)
+                lines = self._read_lines(path, start, end)
+            yield from csv.reader(lines, delimiter=self.delimiter)
+
+
+class EvenBatches(Iterable[T]):
+    r""":class:`EvenBatches`.
+
+    Iterates the batches of an iterable, e.g. a dataloader, until the iterable
+    of any rank runs out, so that every rank yields the same number of batches.
+    The shards of :class:`ShardedLineReader`, undersampling and the train/val
+    split give ranks different numbers of rows, and a rank running out first
+    would leave the others blocked in the collectives of their next step, e.g.
+    the all-to-all of a sharded model. Ranks thus drop the few batches beyond
+    the global minimum.
+
+    Every rank reads ahead up to ``check_interval`` batches, then the number it
+    got is all-reduced to the minimum across ranks, which is how many of them are
+    yielded. The all-reduce runs in the calling thread, since dataloader workers
+    have no process group, and synchronizes the host with the device of the
+    count, so it only runs once every ``check_interval`` batches. Without a
+    process group the batches are passed through.
+
+    Args:
+        iterable: Iterable of batches.
+        device: Device of the count, the CUDA device of the rank with nccl.
+        check_interval: Number of batches read ahead and yielded per all-reduce,
+            which are held at once, e.g. on the device if they were prefetched
+            to it.
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[T],
+        device: Optional[torch.device] = None,
+        check_interval: int = 16,
+    ) -> None:
+        if check_interval < 1:
+            raise ValueError(f"check_interval {check_interval} must be positive")
+        self.iterable = iterable
+        self.device: torch.device = device or torch.device("cpu")
+        self.check_interval = check_interval
+
+    def __iter__(self) -> Iterator[T]:
+        if not dist.is_initialized() or dist.get_world_size() == 1:
+            yield from self.iterable
+            return
+        iterator = iter(self.iterable)
+        count = torch.empty(1, dtype=torch.int64, device=self.device)
+        while True:
+            batches = list(itertools.islice(iterator, self.check_interval))
+            count.fill_(len(batches))
+            dist.all_reduce(count, op=dist.ReduceOp.MIN)
+            num_batches = int(count.item())
+            yield from batches[:num_batches]
+            if num_batches < self.check_interval:
+                return
@@ -0,0 +1,115 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.columnar import Chunk, like, num_rows, to_numpy
+from torchrecipes.rec.datamodules.sharding import current_shard
+
+
+class ShuffleBuffer(IterDataPipe[Dict[str, Any]]):
+    r""":class:`ShuffleBuffer`.
+
+    Iterable datapipe shuffling the rows of columnar chunks, i.e. mappings from
+    column names to tensors, numpy arrays or lists holding the same number of rows
+    (e.g. the output of ``.batch(n).collate()``), in a buffer of fixed capacity.
+
+    The buffer is filled with the first chunks, up to ``buffer_size`` rows. Then
+    every incoming chunk swaps its rows with as many rows drawn at random from the
+    buffer, which are yielded as a chunk of the same size, and the rest of the buffer
+    is yielded in random order at the end. The memory held is the buffer, allocated
+    once, plus one chunk.
+
+    The random stream is seeded by ``(seed, epoch, shard_id)``, where ``shard_id``
+    is the ``(rank, worker_id)`` shard of the reader, so each shard gets a
+    reproducible order that changes every epoch. The epoch is advanced on every
+    iteration or set explicitly by :meth:`set_epoch`. Note that dataloader workers
+    iterate copies of the datapipe, so they only advance the epoch across
+    iterations if they are persistent.
+
+    Args:
+        datapipe: Datapipe of columnar chunks.
+        buffer_size: Capacity of the buffer in rows.
+        seed: Random seed. ``None`` seeds from fresh OS entropy.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the data.
+    """
+
+    def __init__(
+        self,
+        datapipe: IterDataPipe[Chunk],
+        buffer_size: int,
+        seed: Optional[int] = None,
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        if buffer_size < 1:
+            raise ValueError(f"buffer_size {buffer_size} must be positive")
+        self.datapipe = datapipe
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _rng(self, epoch: int) -> np.random.Generator:
+        if self.seed is None:
+            return np.random.default_rng()
+        shard_id, _ = current_shard(self.rank, self.world_size)
+        return np.random.default_rng([self.seed, epoch, shard_id])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        rng = self._rng(self.epoch)
+        self.epoch += 1
+        buffer: Dict[str, np.ndarray] = {}
+        template: Chunk = {}
+        filled = 0
+        max_rows = 1
+        for chunk in self.datapipe:
+            size = num_rows(chunk)
+            if size == 0:
+                continue
+            max_rows = max(max_rows, size)
+            columns = {key: to_numpy(value) for key, value in chunk.items()}
+            if not buffer:
+                template = chunk
+                buffer = {
+                    key: np.empty(
+                        (self.buffer_size,) + column.shape[1:], dtype=column.dtype
+                    )
+                    for key, column in columns.items()
+                }
+            start = 0
+            if filled + size <= self.buffer_size or filled < size:
+                start = min(size, self.buffer_size - filled)
+                for key, column in columns.items():
+                    buffer[key][filled : filled + start] = column[:start]
+                filled += start
+            # only chunks larger than the filled buffer are swapped in pieces
+            while start < size:
+                end = min(size, start + filled)
+                slots = rng.choice(filled, size=end - start, replace=False)
+                out = {}
+                for key, column in columns.items():
+                    out[key] = like(template[key], buffer[key][slots])
+                    buffer[key][slots] = column[start:end]
+                yield out
+                start = end
+
+        order = rng.permutation(filled)
+        for start in range(0, filled, max_rows):
+            slots = order[start : start + max_rows]
+            yield {
+                key: like(template[key], column[slots])
+                for key, column in buffer.items()
+            }
@@ -0,0 +1,194 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+from typing import Iterator, List
+
+import testslide
+import torch
+from torch.utils.data import IterDataPipe
+from torchrec.datasets.utils import Batch
+from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
+from torchrecipes.rec.datamodules.batch_cache import BatchCache, cache_key
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+
+
+def _random_batch(batch_size: int) -> Batch:
+    lengths = (torch.arange(2 * batch_size) % 3).int()
+    return Batch(
+        dense_features=torch.rand(batch_size, 4),
+        sparse_features=KeyedJaggedTensor.from_lengths_sync(
+            ["f1", "f2"],
+            torch.randint(0, 100, (int(lengths.sum()),)),
+            lengths,
+        ),
+        labels=torch.randint(0, 2, (batch_size,)),
+    )
+
+
+class CountingDataPipe(IterDataPipe[Batch]):
+    def __init__(self, batches: List[Batch]) -> None:
+        super().__init__()
+        self.batches = batches
+        self.num_iterations = 0
+
+    def __iter__(self) -> Iterator[Batch]:
+        self.num_iterations += 1
+        yield from self.batches
+
+
+def _assert_batches_equal(
+    test: testslide.TestCase, first: List[Batch], second: List[Batch]
+) -> None:
+    test.assertEqual(len(first), len(second))
+    for a, b in zip(first, second):
+        test.assertTrue(torch.equal(a.dense_features, b.dense_features))
+        test.assertTrue(torch.equal(a.labels, b.labels))
+        test.assertEqual(a.sparse_features.keys(), b.sparse_features.keys())
+        test.assertTrue(
+            torch.equal(a.sparse_features.values(), b.sparse_features.values())
+        )
+        test.assertTrue(
+            torch.equal(a.sparse_features.lengths(), b.sparse_features.lengths())
+        )
+
+
+class TestBatchCache(testslide.TestCase):
+    def test_cache(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        batches = [_random_batch(8) for _ in range(4)] + [_random_batch(3)]
+        source = CountingDataPipe(batches)
+        cache = BatchCache(source, cache_dir, {"a": 1}, shard_batches=2)
+        _assert_batches_equal(self, list(cache), batches)
+        _assert_batches_equal(self, list(cache), batches)
+        self.assertEqual(source.num_iterations, 1)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(cache_dir, cache.key, "stream_0_of_1"))),
+            ["manifest.json", "shard_0", "shard_1", "shard_2"],
+        )
+
+        # another config misses
+        other = BatchCache(source, cache_dir, {"a": 2}, shard_batches=2)
+        self.assertNotEqual(other.key, cache.key)
+        self.assertEqual(cache_key({"a": 1}), cache.key)
+        _assert_batches_equal(self, list(other), batches)
+        self.assertEqual(source.num_iterations, 2)
+
+    def test_incomplete_iteration(self) -> None:
+        batches = [_random_batch(4) for _ in range(3)]
+        source = CountingDataPipe(batches)
+        cache = BatchCache(source, tempfile.mkdtemp(), {}, shard_batches=1)
+        it = iter(cache)
+        next(it)
+        del it
+        _assert_batches_equal(self, list(cache), batches)
+        self.assertEqual(source.num_iterations, 2)
+        list(cache)
+        self.assertEqual(source.num_iterations, 2)
+
+    def test_shard_bytes(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        batches = [_random_batch(8) for _ in range(4)]
+        # every batch is over 200 bytes, e.g. 128 of dense features
+        cache = BatchCache(CountingDataPipe(batches), cache_dir, {}, shard_bytes=200)
+        _assert_batches_equal(self, list(cache), batches)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(cache_dir, cache.key, "stream_0_of_1"))),
+            ["manifest.json", "shard_0", "shard_1", "shard_2", "shard_3"],
+        )
+        with self.assertRaises(ValueError):
+            BatchCache(CountingDataPipe(batches), cache_dir, {}, shard_bytes=0)
+
+    def test_shard_evicted_while_reading(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        batches = [_random_batch(4) for _ in range(3)]
+        source = CountingDataPipe(batches)
+        cache = BatchCache(source, cache_dir, {}, shard_batches=1)
+        list(cache)
+        it = iter(cache)
+        read = [next(it)]
+        # another process evicts the next shard
+        shutil.rmtree(os.path.join(cache_dir, cache.key, "stream_0_of_1", "shard_1"))
+        read += list(it)
+        _assert_batches_equal(self, read, batches)
+        self.assertEqual(source.num_iterations, 2)
+        # the stream is complete again
+        _assert_batches_equal(self, list(cache), batches)
+        self.assertEqual(source.num_iterations, 2)
+
+    def test_eviction(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        old = CountingDataPipe([_random_batch(16) for _ in range(2)])
+        old_cache = BatchCache(old, cache_dir, {"day": 0})
+        list(old_cache)
+        shard_dir = os.path.join(cache_dir, old_cache.key, "stream_0_of_1", "shard_0")
+        shard_size = sum(entry.stat().st_size for entry in os.scandir(shard_dir))
+
+        new = CountingDataPipe([_random_batch(16) for _ in range(2)])
+        new_cache = BatchCache(
+            new, cache_dir, {"day": 1}, max_bytes=shard_size * 3 // 2
+        )
+        list(new_cache)
+        list(new_cache)
+        self.assertEqual(new.num_iterations, 1)
+        # the least recently used shard was evicted with its emptied stream and
+        # key, its stream is rebuilt
+        self.assertFalse(os.path.exists(shard_dir))
+        self.assertEqual(os.listdir(cache_dir), [new_cache.key])
+        list(old_cache)
+        self.assertEqual(old.num_iterations, 2)
+
+    def test_criteo_datamodule_cache(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        cache_dir: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=50, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ):
+
+            def batches(**kwargs: int) -> List[Batch]:
+                dm = CriteoDataModule(
+                    num_days=1,
+                    num_days_test=1,
+                    batch_size=8,
+                    dataset_path=dataset_path,
+                    batch_cache_dir=cache_dir,
+                    **kwargs,
+                )
+                dm.setup(stage="test")
+                return list(dm.test_dataloader())
+
+            expected = batches()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            _assert_batches_equal(self, batches(), expected)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            # another hashing config gets its own entry
+            batches(num_embeddings=10)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            with self.assertRaisesRegex(ValueError, "shuffle_buffer_size"):
+                CriteoDataModule(
+                    dataset_path=dataset_path,
+                    batch_cache_dir=cache_dir,
+                    shuffle_buffer_size=16,
+                )
+            # unseeded undersampling would not replay the same batches
+            with self.assertRaisesRegex(ValueError, "requires a seed"):
+                CriteoDataModule(
+                    dataset_path=dataset_path,
+                    batch_cache_dir=cache_dir,
+                    undersampling_rate=0.5,
+                )
+            CriteoDataModule(
+                dataset_path=dataset_path,
+                batch_cache_dir=cache_dir,
+                undersampling_rate=0.5,
+                seed=0,
+            )
@@ -0,0 +1,45 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import numpy as np
+import testslide
+import torch
+from torchrecipes.rec.datamodules.columnar import (
+    ColumnarBatcher,
+    concat_rows,
+    filter_rows,
+)
+
+
+class TestColumnar(testslide.TestCase):
+    def test_filter_concat_rows(self) -> None:
+        chunk = {"a": torch.arange(4), "b": np.arange(4) * 2, "c": list("wxyz")}
+        filtered = filter_rows(chunk, np.array([True, False, True, False]))
+        self.assertEqual(filtered["a"].tolist(), [0, 2])
+        self.assertEqual(filtered["b"].tolist(), [0, 4])
+        self.assertEqual(filtered["c"], ["w", "y"])
+        concatenated = concat_rows([filtered, chunk])
+        self.assertIsInstance(concatenated["a"], torch.Tensor)
+        self.assertEqual(concatenated["a"].tolist(), [0, 2, 0, 1, 2, 3])
+        self.assertEqual(concatenated["c"], ["w", "y", "w", "x", "y", "z"])
+
+    def test_batcher(self) -> None:
+        sizes = [3, 5, 0, 1, 4, 4, 2]
+        chunks = []
+        start = 0
+        for size in sizes:
+            chunks.append({"a": torch.arange(start, start + size), "b": ["x"] * size})
+            start += size
+        batches = list(ColumnarBatcher(chunks, 4))
+        self.assertEqual([len(batch["a"]) for batch in batches], [4, 4, 4, 4, 3])
+        self.assertEqual(
+            [i for batch in batches for i in batch["a"].tolist()], list(range(start))
+        )
+        self.assertEqual([len(batch["b"]) for batch in batches], [4, 4, 4, 4, 3])
+        with self.assertRaises(ValueError):
+            ColumnarBatcher(chunks, 0)
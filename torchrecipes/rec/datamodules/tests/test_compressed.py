@@ -0,0 +1,163 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import gzip
+import importlib.util
+import os
+import struct
+import tempfile
+import unittest
+from typing import List, Tuple
+
+import testslide
+from torchrecipes.rec.benchmarks.criteo_transform_benchmark import batches_equal
+from torchrecipes.rec.datamodules.compressed import (
+    _split_lines,
+    find_file,
+    read_blocks,
+    read_lines,
+    read_seek_table,
+    write_seekable_zstd,
+)
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.sharding import ShardedLineReader
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+
+HAS_ZSTANDARD: bool = importlib.util.find_spec("zstandard") is not None
+
+
+def _lines(data: bytes) -> List[Tuple[int, bytes]]:
+    lines = []
+    offset = 0
+    for line in data.splitlines(keepends=True):
+        lines.append((offset, line))
+        offset += len(line)
+    return lines
+
+
+def _write_gz(path: str, data: bytes) -> None:
+    with gzip.open(path, "wb") as f:
+        f.write(data)
+
+
+class TestCompressed(testslide.TestCase):
+    def test_split_lines(self) -> None:
+        # no trailing newline on the last line
+        data = b"".join(b"%d\t%s\n" % (i, b"x" * (i % 11)) for i in range(40))[:-1]
+        expected = _lines(data)
+        for block_size in (1, 7, 64, len(data)):
+            blocks = [data[i : i + block_size] for i in range(0, len(data), block_size)]
+            self.assertEqual(list(_split_lines(blocks, 0, 0, None)), expected)
+            for start, end in ((0, 50), (13, 120), (120, len(data) + 1)):
+                self.assertEqual(
+                    list(_split_lines(blocks, 0, start, end)),
+                    [line for line in expected if start <= line[0] < end],
+                )
+
+    def test_read_gz(self) -> None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "data.tsv.gz")
+        data = b"".join(b"%d\t%s\n" % (i, b"y" * (i % 5)) for i in range(1000))
+        _write_gz(path, data)
+        self.assertEqual(b"".join(read_blocks(path, block_size=100)), data)
+        self.assertEqual(
+            list(read_lines(path, prefetch_depth=1, block_size=64)), _lines(data)
+        )
+        self.assertEqual(
+            list(read_lines(path, 100, 200)),
+            [line for line in _lines(data) if 100 <= line[0] < 200],
+        )
+        # stopping early stops the decompression thread
+        lines = read_lines(path, prefetch_depth=1, block_size=16)
+        self.assertEqual(next(lines), (0, b"0\t\n"))
+        lines.close()
+
+        self.assertEqual(find_file(os.path.join(tmp, "data.tsv")), path)
+        self.assertEqual(find_file(path), path)
+        missing = os.path.join(tmp, "missing.tsv")
+        self.assertEqual(find_file(missing), missing)
+
+    def test_sharded_line_reader_gz(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "data.gz")
+        lines = [[str(i), "x" * (i % 7)] for i in range(50)]
+        _write_gz(path, "\n".join("\t".join(line) for line in lines).encode())
+        rows = []
+        for rank in range(3):
+            rows += list(ShardedLineReader([path], rank=rank, world_size=3))
+        self.assertEqual(sorted(rows, key=lambda row: int(row[0])), lines)
+
+    def test_read_seek_table(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "data.zst")
+        sizes = [(10, 100), (20, 200), (5, 50)]
+        table = b"".join(struct.pack("<III", *size, 0) for size in sizes)
+        # seek table with checksums
+        table += struct.pack("<IBI", len(sizes), 0x80, 0x8F92EAB1)
+        with open(path, "wb") as f:
+            f.write(b"\0" * 35)
+            f.write(struct.pack("<II", 0x184D2A5E, len(table)))
+            f.write(table)
+        self.assertEqual(
+            read_seek_table(path).tolist(),
+            [[0, 0], [10, 100], [30, 300], [35, 350]],
+        )
+        with open(path, "wb") as f:
+            f.write(b"\0" * 35)
+        self.assertIsNone(read_seek_table(path))
+
+    @unittest.skipUnless(HAS_ZSTANDARD, "requires zstandard")
+    def test_seekable_zstd(self) -> None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "data.zst")
+        data = b"".join(b"%d\t%s\n" % (i, b"z" * (i % 13)) for i in range(500))
+        num_frames = write_seekable_zstd([data[:1000], data[1000:]], path, 256)
+        self.assertEqual(num_frames, (len(data) + 255) // 256)
+        self.assertEqual(read_seek_table(path)[-1, 1], len(data))
+        self.assertEqual(b"".join(read_blocks(path)), data)
+        for start, end in ((0, None), (255, 257), (1000, 3000)):
+            self.assertEqual(
+                list(read_lines(path, start, end, num_threads=3, prefetch_depth=2)),
+                [
+                    line
+                    for line in _lines(data)
+                    if start <= line[0] and (end is None or line[0] < end)
+                ],
+            )
+        rows = []
+        for rank in range(4):
+            rows += list(ShardedLineReader([path], rank=rank, world_size=4))
+        self.assertEqual(
+            rows, [line.decode().split("\t") for line in data.splitlines()]
+        )
+
+    def test_criteo_gz(self) -> None:
+        dataset_path = tempfile.mkdtemp()
+        gz_path = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=30, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ) as paths:
+            for path in paths:
+                name = os.path.splitext(os.path.basename(path))[0]
+                with open(path, "rb") as f:
+                    _write_gz(os.path.join(gz_path, f"{name}.gz"), f.read())
+            kwargs = {
+                "num_days": 1,
+                "num_days_test": 1,
+                "batch_size": 4,
+                "split_mode": "hash",
+                "decompress_threads": 2,
+            }
+            dm_tsv = CriteoDataModule(dataset_path=dataset_path, **kwargs)
+            dm_gz = CriteoDataModule(dataset_path=gz_path, **kwargs)
+            dm_tsv.setup()
+            dm_gz.setup()
+            for dataloader in ("train_dataloader", "val_dataloader", "test_dataloader"):
+                expected = list(getattr(dm_tsv, dataloader)())
+                actual = list(getattr(dm_gz, dataloader)())
+                self.assertEqual(len(actual), len(expected))
+                for a, e in zip(actual, expected):
+                    self.assertTrue(batches_equal(a, e))
@@ -0,0 +1,181 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+import testslide
+import torch
+from torchrecipes.rec.benchmarks.criteo_transform_benchmark import batches_equal
+from torchrecipes.rec.datamodules.criteo_binary import (
+    BinaryCriteoIterDataPipe,
+    load_binary_metadata,
+    MISSING_ID,
+)
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.criteo_preprocess import main, tsv_to_binary
+from torchrecipes.rec.datamodules.tests.utils import (
+    CAT_FEATURE_COUNT,
+    create_dataset_tsv,
+    INT_FEATURE_COUNT,
+)
+
+
+class TestCriteoBinary(testslide.TestCase):
+    def test_tsv_to_binary(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(num_rows=10, dataset_path=dataset_path) as paths:
+            prefix = os.path.join(dataset_path, "day_0")
+            num_rows = tsv_to_binary(paths[0], prefix, [5] * CAT_FEATURE_COUNT)
+            self.assertEqual(num_rows, 10)
+            self.assertEqual(
+                load_binary_metadata(prefix),
+                {
+                    "num_rows": 10,
+                    "hash_sizes": [5] * CAT_FEATURE_COUNT,
+                    "dense_dtype": "int32",
+                },
+            )
+
+            batches = list(BinaryCriteoIterDataPipe([prefix], batch_size=4))
+            self.assertEqual([len(b["labels"]) for b in batches], [4, 4, 2])
+            self.assertEqual(batches[0]["dense"].shape, (4, INT_FEATURE_COUNT))
+            self.assertEqual(batches[0]["sparse"].shape, (4, CAT_FEATURE_COUNT))
+            self.assertTrue(
+                ((batches[0]["sparse"] >= 0) & (batches[0]["sparse"] < 5)).all()
+            )
+
+            batches = list(
+                BinaryCriteoIterDataPipe([prefix], batch_size=4, row_range=(0.5, 1.0))
+            )
+            self.assertEqual([len(b["labels"]) for b in batches], [4, 1])
+
+    def test_tsv_to_binary_slow_path(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        path = os.path.join(dataset_path, "day_0.tsv")
+        # an id of more than 16 hex digits, and an empty one
+        cats = ["1" * 20, ""] + ["a1"] * (CAT_FEATURE_COUNT - 2)
+        with open(path, "w") as f:
+            for label in (0, 1):
+                f.write("\t".join([str(label), *["1"] * INT_FEATURE_COUNT, *cats]))
+                f.write("\n")
+        prefix = os.path.join(dataset_path, "day_0")
+        self.assertEqual(tsv_to_binary(path, prefix, [7] * CAT_FEATURE_COUNT), 2)
+        (batch,) = BinaryCriteoIterDataPipe([prefix], batch_size=2)
+        sparse = batch["sparse"]
+        self.assertTrue((sparse[:, 0] == int("1" * 20, 16) % 7).all())
+        self.assertTrue((sparse[:, 2] == 0xA1 % 7).all())
+        self.assertTrue((sparse[:, 1] == MISSING_ID).all())
+
+    def test_binary_format_matches_tsv(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        binary_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=20, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ):
+            main(
+                [
+                    "--dataset_path",
+                    dataset_path,
+                    "--output_path",
+                    binary_path,
+                    "--num_days",
+                    "2",
+                    "--num_embeddings",
+                    "64",
+                ]
+            )
+            kwargs = {
+                "num_days": 1,
+                "num_days_test": 1,
+                "batch_size": 3,
+                "num_embeddings": 64,
+            }
+            dm_tsv = CriteoDataModule(dataset_path=dataset_path, **kwargs)
+            dm_tsv.setup(stage="test")
+            dm_binary = CriteoDataModule(
+                dataset_path=binary_path, format="binary", **kwargs
+            )
+            dm_binary.setup()
+
+            for expected, actual in zip(
+                dm_tsv.test_dataloader(), dm_binary.test_dataloader()
+            ):
+                self.assertTrue(batches_equal(expected, actual))
+
+            train_batch = next(iter(dm_binary.train_dataloader()))
+            self.assertEqual(train_batch.dense_features.size(), (3, INT_FEATURE_COUNT))
+            kjt = train_batch.sparse_features
+            self.assertEqual(kjt.lengths().size(), (CAT_FEATURE_COUNT * 3,))
+            self.assertEqual(kjt.keys(), dm_binary.keys)
+            self.assertEqual(
+                sum(len(b.labels) for b in dm_binary.train_dataloader())
+                + sum(len(b.labels) for b in dm_binary.val_dataloader()),
+                20,
+            )
+
+    def test_precomputed_dense(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=20, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ):
+            kwargs = {
+                "num_days": 1,
+                "num_days_test": 1,
+                "batch_size": 3,
+                "num_embeddings": 64,
+            }
+            dm_tsv = CriteoDataModule(dataset_path=dataset_path, **kwargs)
+            dm_tsv.setup(stage="test")
+            expected = list(dm_tsv.test_dataloader())
+            for dense_dtype in ("float32", "float16"):
+                binary_path: str = tempfile.mkdtemp()
+                main(
+                    [
+                        "--dataset_path",
+                        dataset_path,
+                        "--output_path",
+                        binary_path,
+                        "--num_days",
+                        "2",
+                        "--num_embeddings",
+                        "64",
+                        "--dense_dtype",
+                        dense_dtype,
+                    ]
+                )
+                dm_binary = CriteoDataModule(
+                    dataset_path=binary_path, format="binary", **kwargs
+                )
+                dm_binary.setup(stage="test")
+                actual = list(dm_binary.test_dataloader())
+                self.assertEqual(len(actual), len(expected))
+                for a, e in zip(actual, expected):
+                    self.assertEqual(a.dense_features.dtype, torch.float32)
+                    if dense_dtype == "float32":
+                        self.assertTrue(batches_equal(a, e))
+                    else:
+                        self.assertTrue(
+                            torch.allclose(
+                                a.dense_features, e.dense_features, rtol=1e-3
+                            )
+                        )
+
+    def test_binary_format_errors(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(num_rows=10, dataset_path=dataset_path) as paths:
+            tsv_to_binary(
+                paths[0], os.path.join(dataset_path, "day_0"), [5] * CAT_FEATURE_COUNT
+            )
+            dm = CriteoDataModule(
+                dataset_path=dataset_path, format="binary", num_embeddings=6
+            )
+            with self.assertRaisesRegex(ValueError, "different hash sizes"):
+                dm.setup(stage="fit")
+            with self.assertRaisesRegex(ValueError, "Unknown format"):
+                CriteoDataModule(dataset_path=dataset_path, format="parquet")
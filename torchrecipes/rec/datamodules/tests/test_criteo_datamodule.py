@@ -7,15 +7,32 @@
 #!/usr/bin/env python3
 
 
+import json
+import os
 import tempfile
+from unittest.mock import patch
 
 import testslide
-from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+import torch
+from torchrec.datasets.criteo import DEFAULT_CAT_NAMES
+from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
+from torchrecipes.rec.benchmarks.criteo_transform_benchmark import (
+    batches_equal,
+    random_collated_batch,
+)
+from torchrecipes.rec.datamodules.commons import WeightedBatch
+from torchrecipes.rec.datamodules.criteo_datamodule import (
+    _categorical_ids,
+    _transform,
+    _transform_rowwise,
+    CriteoDataModule,
+)
 from torchrecipes.rec.datamodules.tests.utils import (
     create_dataset_tsv,
     INT_FEATURE_COUNT,
     CAT_FEATURE_COUNT,
 )
+from torchrecipes.utils.loader_autotune import CACHE_ENV
 
 
 class TestCriteoDataModule(testslide.TestCase):
@@ -99,6 +116,78 @@ class TestCriteoDataModule(testslide.TestCase):
             self.assertEqual(kjt.lengths().size(), (CAT_FEATURE_COUNT * 3,))
             self.assertEqual(kjt.keys(), dm.keys)
 
+    def test_test_stage_undersampling(self) -> None:
+        num_days = 1
+        num_days_test = 1
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=500,
+            num_days=num_days,
+            num_days_test=num_days_test,
+            dataset_path=dataset_path,
+        ) as _:
+            dm = CriteoDataModule(
+                num_days=num_days,
+                batch_size=16,
+                num_days_test=num_days_test,
+                num_workers=0,
+                dataset_path=dataset_path,
+                undersampling_rate=0.5,
+                seed=3,
+            )
+            dm.setup(stage="test")
+            batches = list(dm.test_dataloader())
+            self.assertTrue(all(len(batch.labels) == 16 for batch in batches[:-1]))
+
+            # rows kept by the chunked sampler are the ones sampled row by row
+            expected = [
+                row["label"]
+                for row in dm._undersample_rows(dm._create_datapipe_1t(range(1, 2)))
+            ]
+            self.assertLess(len(expected), 500)
+            self.assertEqual(
+                [label for batch in batches for label in batch.labels.tolist()],
+                expected,
+            )
+
+    def test_undersampling_weights(self) -> None:
+        num_days = 1
+        num_days_test = 1
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=200,
+            num_days=num_days,
+            num_days_test=num_days_test,
+            dataset_path=dataset_path,
+        ) as _:
+            for split_mode in ("random", "hash"):
+                dm = CriteoDataModule(
+                    num_days=num_days,
+                    batch_size=16,
+                    num_days_test=num_days_test,
+                    num_workers=0,
+                    dataset_path=dataset_path,
+                    undersampling_rate=0.25,
+                    undersampling_weights=True,
+                    split_mode=split_mode,
+                    batch_cache_dir=tempfile.mkdtemp(),
+                    seed=0,
+                )
+                dm.setup()
+                for dataloader in (
+                    dm.train_dataloader(),
+                    dm.test_dataloader(),
+                    # read back from the batch cache
+                    dm.test_dataloader(),
+                ):
+                    for batch in dataloader:
+                        self.assertIsInstance(batch, WeightedBatch)
+                        self.assertEqual(batch.weights.dtype, torch.float32)
+                        self.assertEqual(
+                            batch.weights.tolist(),
+                            [1.0 if label else 4.0 for label in batch.labels],
+                        )
+
     def test_dataset_name(self) -> None:
         num_days = 1
         num_days_test = 1
@@ -154,3 +243,182 @@ class TestCriteoDataModule(testslide.TestCase):
             kjt = train_batch.sparse_features
             self.assertEqual(kjt.lengths().size(), (CAT_FEATURE_COUNT * 3,))
             self.assertEqual(kjt.keys(), dm_criteo.keys)
+
+    def test_transform_matches_rowwise(self) -> None:
+        batch = random_collated_batch(batch_size=64, empty_fraction=0.2)
+        self.assertTrue(
+            batches_equal(
+                _transform_rowwise(batch, num_embeddings=1000),
+                _transform(batch, num_embeddings=1000),
+            )
+        )
+        num_embeddings_per_feature = [7 + i for i in range(CAT_FEATURE_COUNT)]
+        self.assertTrue(
+            batches_equal(
+                _transform_rowwise(
+                    batch, num_embeddings_per_feature=num_embeddings_per_feature
+                ),
+                _transform(
+                    batch,
+                    num_embeddings=None,
+                    num_embeddings_per_feature=num_embeddings_per_feature,
+                ),
+            )
+        )
+
+    def test_transform_offsets(self) -> None:
+        batch = random_collated_batch(batch_size=32, empty_fraction=0.2)
+        kjt = _transform(batch, num_embeddings=1000).sparse_features
+        # the precomputed per key lengths and offsets match the synced ones
+        expected = KeyedJaggedTensor.from_lengths_sync(
+            kjt.keys(), kjt.values(), kjt.lengths()
+        )
+        self.assertEqual(kjt.length_per_key(), expected.length_per_key())
+        self.assertEqual(kjt.offset_per_key(), expected.offset_per_key())
+        self.assertTrue(torch.equal(kjt.offsets(), expected.offsets()))
+
+    def test_transform_fallback(self) -> None:
+        batch = random_collated_batch(batch_size=4)
+        # mixed case and ids that do not fit in 64 bits
+        batch[DEFAULT_CAT_NAMES[0]] = ["ABCdef01", "", "f" * 20, "1"]
+        expected = _transform_rowwise(batch, num_embeddings=97)
+        self.assertTrue(batches_equal(expected, _transform(batch, num_embeddings=97)))
+        batch[DEFAULT_CAT_NAMES[0]] = ["ABCdef01", "", "ffffffffffffffff", "1"]
+        expected = _transform_rowwise(batch, num_embeddings=97)
+        self.assertTrue(batches_equal(expected, _transform(batch, num_embeddings=97)))
+
+    def test_transform_multi_hot(self) -> None:
+        batch = random_collated_batch(batch_size=64, empty_fraction=0.2, max_ids=5)
+        # empty ids are skipped
+        batch[DEFAULT_CAT_NAMES[1]][:3] = [",", "1f,,2e,", "3d,"]
+        max_ids_per_feature = [1 + i % 4 for i in range(CAT_FEATURE_COUNT)]
+        for max_ids in (None, max_ids_per_feature):
+            kwargs = {
+                "num_embeddings": 1000,
+                "multi_hot_delimiter": ",",
+                "max_ids_per_feature": max_ids,
+            }
+            expected = _transform_rowwise(batch, **kwargs)
+            self.assertTrue(batches_equal(expected, _transform(batch, **kwargs)))
+        lengths = expected.sparse_features.lengths().view(CAT_FEATURE_COUNT, -1)
+        self.assertEqual(lengths[1, :3].tolist(), [0, 2, 1])
+        self.assertTrue(
+            torch.all(lengths <= torch.tensor(max_ids_per_feature)[:, None])
+        )
+        self.assertGreater(int(lengths.max()), 1)
+
+        # the multi-hot parsing matches the single id one without delimiters
+        single = random_collated_batch(batch_size=16, empty_fraction=0.2)
+        self.assertTrue(
+            batches_equal(
+                _transform(single, num_embeddings=97),
+                _transform(single, num_embeddings=97, multi_hot_delimiter=","),
+            )
+        )
+
+        # slow path: mixed case and ids that do not fit in 64 bits
+        batch[DEFAULT_CAT_NAMES[0]][:2] = ["ABCdef01,1", "f" * 20 + ",,2,3"]
+        kwargs = {
+            "num_embeddings": 97,
+            "multi_hot_delimiter": ",",
+            "max_ids_per_feature": max_ids_per_feature,
+        }
+        self.assertTrue(
+            batches_equal(
+                _transform_rowwise(batch, **kwargs), _transform(batch, **kwargs)
+            )
+        )
+        ids, lengths = _categorical_ids(
+            [["1,2", "", "3"], ["f" * 17 + ",4", "5", ""]], ",", [1, 2]
+        )
+        self.assertEqual(ids.tolist(), [1, 3, (1 << 64) - 1, 4, 5])
+        self.assertEqual(lengths.tolist(), [[1, 0, 1], [2, 1, 0]])
+
+    def test_autotune(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        cache_path = os.path.join(tempfile.mkdtemp(), "autotune.json")
+        with create_dataset_tsv(
+            num_rows=30, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ) as _, patch.dict(os.environ, {CACHE_ENV: cache_path}), patch(
+            "torchrecipes.rec.datamodules.criteo_datamodule.AUTO_READ_CHUNK_SIZES",
+            (64, 4096),
+        ), patch(
+            "torchrecipes.utils.loader_autotune.default_num_workers",
+            return_value=[0, 1],
+        ):
+            kwargs = {
+                "num_days": 1,
+                "num_days_test": 1,
+                "batch_size": 4,
+                "num_workers": "auto",
+                "read_chunk_size": "auto",
+                "dataset_path": dataset_path,
+            }
+            dm = CriteoDataModule(**kwargs)
+            dm.setup(stage="test")
+            self.assertIn(dm._num_workers, (0, 1))
+            self.assertIn(dm._read_chunk_size, (64, 4096))
+            self.assertEqual(len(list(dm.test_dataloader())), 8)
+            with open(cache_path) as f:
+                self.assertEqual(len(json.load(f)), 1)
+
+            # the second run reuses the cached choice
+            dm_cached = CriteoDataModule(**kwargs)
+            dm_cached.setup(stage="test")
+            self.assertEqual(dm_cached._num_workers, dm._num_workers)
+            self.assertEqual(dm_cached._read_chunk_size, dm._read_chunk_size)
+
+        with self.assertRaises(ValueError):
+            CriteoDataModule(dataset_path=dataset_path, num_workers="many")
+
+    def test_multi_hot(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        rows = [
+            ["1", *map(str, range(INT_FEATURE_COUNT))]
+            + [
+                ",".join(["%08x" % (i + j)] * (1 + (i + j) % 3))
+                for j in range(CAT_FEATURE_COUNT)
+            ]
+            for i in range(4)
+        ]
+        with open(os.path.join(dataset_path, "day_1.tsv"), "w") as f:
+            f.writelines("\t".join(row) + "\n" for row in rows)
+        max_ids_per_feature = [2] * CAT_FEATURE_COUNT
+        dm = CriteoDataModule(
+            num_days=1,
+            num_days_test=1,
+            batch_size=4,
+            dataset_path=dataset_path,
+            multi_hot_delimiter=",",
+            max_ids_per_feature=max_ids_per_feature,
+        )
+        dm.setup(stage="test")
+        batch = next(iter(dm.test_dataloader()))
+        kjt = batch.sparse_features
+        self.assertEqual(
+            kjt.lengths().view(CAT_FEATURE_COUNT, 4).T.tolist(),
+            [
+                [min(1 + (i + j) % 3, 2) for j in range(CAT_FEATURE_COUNT)]
+                for i in range(4)
+            ],
+        )
+        self.assertEqual(
+            kjt[DEFAULT_CAT_NAMES[0]].values().tolist(), [0, 1, 1, 2, 2, 3]
+        )
+
+        with self.assertRaises(ValueError):
+            CriteoDataModule(
+                dataset_path=dataset_path, max_ids_per_feature=max_ids_per_feature
+            )
+        with self.assertRaises(ValueError):
+            CriteoDataModule(dataset_path=dataset_path, multi_hot_delimiter="a")
+        with self.assertRaises(ValueError):
+            CriteoDataModule(
+                dataset_path=dataset_path,
+                multi_hot_delimiter=",",
+                max_ids_per_feature=[0] * CAT_FEATURE_COUNT,
+            )
+        with self.assertRaises(ValueError):
+            CriteoDataModule(
+                dataset_path=dataset_path, format="binary", multi_hot_delimiter=","
+            )
@@ -0,0 +1,140 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+import numpy as np
+import testslide
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.criteo_vocab import CriteoVocab
+from torchrecipes.rec.datamodules.criteo_vocab_builder import (
+    build_vocab,
+    count_rows,
+    CountMinSketch,
+    sketch_width_for,
+)
+from torchrecipes.rec.datamodules.tests.utils import (
+    CAT_FEATURE_COUNT,
+    INT_FEATURE_COUNT,
+)
+
+
+def _sparse_value(row: int) -> str:
+    if row % 2 == 0:
+        return "0000000a"
+    if row % 4 == 1:
+        return "0000000b"
+    if row == 3:
+        return ""
+    # seen once
+    return "%08x" % (1000 + row)
+
+
+def _write_day(dataset_path: str, day: int = 0, num_rows: int = 40) -> str:
+    path = os.path.join(dataset_path, f"day_{day}.tsv")
+    with open(path, "w") as f:
+        for row in range(num_rows):
+            values = ["1"] + ["2"] * INT_FEATURE_COUNT
+            values += [_sparse_value(row)] * CAT_FEATURE_COUNT
+            f.write("\t".join(values) + "\n")
+    return path
+
+
+class TestCriteoVocab(testslide.TestCase):
+    def test_remap(self) -> None:
+        vocabs = [np.array([7, 3, 5], dtype=np.uint64)] * (CAT_FEATURE_COUNT - 1)
+        vocab = CriteoVocab(vocabs + [np.zeros(0, dtype=np.uint64)])
+        self.assertEqual(vocab.num_embeddings_per_feature[:2], [4, 4])
+        self.assertEqual(vocab.num_embeddings_per_feature[-1], 1)
+
+        lengths = np.array([4] + [0] * (CAT_FEATURE_COUNT - 2) + [2])
+        ids = np.array([5, 9, 3, 1, 7, 3], dtype=np.uint64)
+        self.assertEqual(vocab.remap(ids, lengths).tolist(), [1, 3, 0, 3, 0, 0])
+
+        path = os.path.join(tempfile.mkdtemp(), "vocab.npz")
+        vocab.save(path)
+        loaded = CriteoVocab.load(path)
+        self.assertEqual(
+            [x.tolist() for x in loaded.ids], [x.tolist() for x in vocab.ids]
+        )
+
+    def test_count_min_sketch(self) -> None:
+        rng = np.random.default_rng(0)
+        ids = rng.integers(0, 1 << 40, size=500).astype(np.uint64)
+        counts = rng.integers(1, 10, size=500)
+        unique_ids, index = np.unique(ids, return_index=True)
+        counts = counts[index]
+        sketch = CountMinSketch(width=64, depth=3)
+        sketch.add(unique_ids, counts)
+        estimates = sketch.estimate(unique_ids)
+        self.assertTrue(np.all(estimates >= counts))
+
+        exact = CountMinSketch(width=1 << 16, depth=4)
+        self.assertEqual(exact.add(unique_ids, counts).tolist(), counts.tolist())
+
+    def test_sketch_width(self) -> None:
+        num_ids = 20000
+        width = sketch_width_for(num_ids, min_count=2)
+        self.assertEqual(width, sketch_width_for(num_ids, 2, 4, 0.01))
+        self.assertGreater(
+            sketch_width_for(num_ids, 2, false_positive_rate=0.001), width
+        )
+        self.assertEqual(sketch_width_for(num_ids, min_count=1), 1)
+        with self.assertRaises(ValueError):
+            sketch_width_for(num_ids, 2, false_positive_rate=0)
+
+        # ids seen once rarely reach min_count=2
+        ids = np.arange(num_ids, dtype=np.uint64) * 7919
+        sketch = CountMinSketch(width=width)
+        estimates = sketch.add(ids, np.ones(num_ids, dtype=np.int64))
+        self.assertLessEqual((sketch.estimate(ids) >= 2).mean(), 0.01)
+        self.assertTrue(np.all(estimates >= 1))
+
+    def test_build_vocab(self) -> None:
+        path = _write_day(tempfile.mkdtemp())
+        self.assertEqual(count_rows([path]), 40)
+        vocab = build_vocab([path], min_count=2, read_chunk_size=16)
+        for ids in vocab.ids:
+            self.assertEqual(ids.tolist(), [0xA, 0xB])
+        # a saturated sketch also keeps the 9 ids seen once
+        vocab = build_vocab([path], min_count=2, sketch_width=1, sketch_depth=1)
+        self.assertEqual(len(vocab.ids[0]), 11)
+        vocab = build_vocab([path], min_count=2, max_vocab_size=1)
+        self.assertEqual(vocab.ids[0].tolist(), [0xA])
+
+    def test_criteo_datamodule_vocab(self) -> None:
+        dataset_path = tempfile.mkdtemp()
+        path = _write_day(dataset_path)
+        _write_day(dataset_path, day=1)
+        vocab_path = os.path.join(dataset_path, "vocab.npz")
+        build_vocab([path], min_count=2).save(vocab_path)
+
+        dm = CriteoDataModule(
+            batch_size=40,
+            num_days_test=1,
+            dataset_path=dataset_path,
+            vocab_path=vocab_path,
+        )
+        self.assertIsNone(dm.num_embeddings)
+        self.assertEqual(dm.num_embeddings_per_feature, [3] * CAT_FEATURE_COUNT)
+        dm.setup(stage="test")
+        batch = next(iter(dm.test_dataloader()))
+        feature = batch.sparse_features["cat_0"]
+        expected = [
+            {"0000000a": 0, "0000000b": 1}.get(_sparse_value(row), 2)
+            for row in range(40)
+            if _sparse_value(row)
+        ]
+        self.assertEqual(feature.values().tolist(), expected)
+        self.assertEqual(feature.lengths().tolist()[:4], [1, 1, 1, 0])
+
+        with self.assertRaisesRegex(ValueError, "binary"):
+            CriteoDataModule(
+                dataset_path=dataset_path, vocab_path=vocab_path, format="binary"
+            )
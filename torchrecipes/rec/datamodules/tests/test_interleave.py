@@ -0,0 +1,95 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import tempfile
+from typing import Iterable, Iterator, TypeVar
+
+import testslide
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.interleave import InterleavedReader
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+
+T = TypeVar("T")
+
+
+class IDP_NoLen(IterDataPipe[T]):
+    def __init__(self, input_dp: Iterable[T]) -> None:
+        super().__init__()
+        self.input_dp = input_dp
+
+    def __iter__(self) -> Iterator[T]:
+        for i in self.input_dp:
+            yield i
+
+
+class IDP_Failing(IterDataPipe[int]):
+    def __iter__(self) -> Iterator[int]:
+        yield 0
+        raise RuntimeError("read failed")
+
+
+class TestInterleavedReader(testslide.TestCase):
+    def test_round_robin(self) -> None:
+        datapipes = [
+            IDP_NoLen(range(0, 5)),
+            IDP_NoLen(range(10, 12)),
+            IDP_NoLen(range(20, 25)),
+        ]
+        reader = InterleavedReader(datapipes, parallelism=2, chunk_size=2)
+        self.assertEqual(list(reader), [0, 1, 10, 11, 2, 3, 20, 21, 4, 22, 23, 24])
+
+    def test_random(self) -> None:
+        datapipes = [IDP_NoLen(range(i * 100, i * 100 + 50)) for i in range(4)]
+        first = list(
+            InterleavedReader(
+                datapipes, parallelism=3, chunk_size=4, mode="random", seed=1
+            )
+        )
+        second = list(
+            InterleavedReader(
+                datapipes, parallelism=3, chunk_size=4, mode="random", seed=1
+            )
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(first), sorted(i for dp in datapipes for i in dp))
+        self.assertNotEqual(first, sorted(first))
+
+    def test_errors(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "read failed"):
+            list(InterleavedReader([IDP_NoLen(range(5)), IDP_Failing()]))
+        with self.assertRaisesRegex(ValueError, "Unknown mode"):
+            InterleavedReader([], mode="bad")
+
+    def test_early_stop(self) -> None:
+        reader = InterleavedReader(
+            [IDP_NoLen(range(10000)), IDP_NoLen(range(10000))],
+            chunk_size=1,
+            prefetch_depth=1,
+        )
+        it = iter(reader)
+        self.assertEqual([next(it) for _ in range(3)], [0, 0, 1])
+        del it
+
+    def test_criteo_datamodule_parallel_files(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=50, num_days=2, num_days_test=2, dataset_path=dataset_path
+        ):
+            dm = CriteoDataModule(
+                num_days=2,
+                num_days_test=2,
+                batch_size=8,
+                dataset_path=dataset_path,
+                num_parallel_files=2,
+                interleave_mode="random",
+                seed=0,
+            )
+            dm.setup(stage="test")
+            batches = list(dm.test_dataloader())
+            self.assertEqual(sum(len(batch.labels) for batch in batches), 100)
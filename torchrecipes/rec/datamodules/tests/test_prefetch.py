@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import unittest
+from typing import Iterator, List
+
+import testslide
+import torch
+from torchrec.sparse.jagged_tensor import KeyedJaggedTensor
+from torchrecipes.rec.datamodules.commons import Batch
+from torchrecipes.rec.datamodules.prefetch import DevicePrefetcher
+from torchrecipes.rec.datamodules.random_rec_datamodule import RandomRecDataModule
+
+
+def _batches(num_batches: int) -> List[Batch]:
+    return [
+        Batch(
+            dense_features=torch.full((2, 3), float(i)),
+            sparse_features=KeyedJaggedTensor.from_lengths_sync(
+                ["f1"], torch.tensor([i, i]), torch.tensor([1, 1], dtype=torch.int32)
+            ),
+            labels=torch.tensor([i, i]),
+        )
+        for i in range(num_batches)
+    ]
+
+
+def _failing_batches() -> Iterator[Batch]:
+    yield from _batches(1)
+    raise RuntimeError("load failed")
+
+
+class TestDevicePrefetcher(testslide.TestCase):
+    def test_cpu(self) -> None:
+        batches = _batches(5)
+        prefetcher = DevicePrefetcher(batches, torch.device("cpu"), depth=2)
+        self.assertEqual(len(prefetcher), 5)
+        for _ in range(2):
+            self.assertEqual(
+                [batch.labels.tolist() for batch in prefetcher],
+                [batch.labels.tolist() for batch in batches],
+            )
+
+    def test_on_prefetch(self) -> None:
+        prefetched = []
+        prefetcher = DevicePrefetcher(
+            _batches(5),
+            torch.device("cpu"),
+            depth=2,
+            on_prefetch=lambda batch: prefetched.append(batch.labels[0].item()),
+        )
+        it = iter(prefetcher)
+        next(it)
+        # the batches read ahead were passed before being consumed
+        self.assertGreaterEqual(len(prefetched), 1)
+        list(it)
+        self.assertEqual(prefetched, list(range(5)))
+
+    def test_errors(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "load failed"):
+            list(DevicePrefetcher(_failing_batches(), torch.device("cpu")))
+        with self.assertRaises(ValueError):
+            DevicePrefetcher([], torch.device("cpu"), depth=0)
+
+    def test_early_stop(self) -> None:
+        it = iter(DevicePrefetcher(_batches(100), torch.device("cpu"), depth=1))
+        self.assertEqual(next(it).labels.tolist(), [0, 0])
+        del it
+
+    @unittest.skipUnless(torch.cuda.is_available(), "requires CUDA")
+    def test_cuda(self) -> None:
+        batches = _batches(5)
+        device = torch.device("cuda", torch.cuda.current_device())
+        prefetched = list(DevicePrefetcher(batches, device, depth=2))
+        for batch, expected in zip(prefetched, batches):
+            self.assertEqual(batch.dense_features.device, device)
+            self.assertTrue(
+                torch.equal(batch.dense_features.cpu(), expected.dense_features)
+            )
+            self.assertTrue(
+                torch.equal(
+                    batch.sparse_features.values().cpu(),
+                    expected.sparse_features.values(),
+                )
+            )
+
+    def test_datamodule(self) -> None:
+        datamodule = RandomRecDataModule(device_prefetch_depth=2)
+        dataloader = datamodule.train_dataloader()
+        self.assertIsInstance(dataloader, DevicePrefetcher)
+        self.assertEqual(next(iter(dataloader)).labels.shape, (3,))
@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import uuid
+from typing import List
+from unittest import mock
+
+import testslide
+import torch.distributed as dist
+from torch.distributed.launcher.api import elastic_launch, LaunchConfig
+from torch.utils.data import DataLoader
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.sharding import (
+    current_shard,
+    EvenBatches,
+    shard_range,
+    ShardedLineReader,
+)
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+
+
+def _even_batches() -> List[List[int]]:
+    dist.init_process_group("gloo")
+    rank = dist.get_rank()
+    # uneven shards, rank 1 runs out first
+    shard = [[rank, i] for i in range(5 - 2 * rank)]
+    batches = EvenBatches(shard)
+    # rank 1 runs out in the middle of the second window
+    windowed = EvenBatches(shard, check_interval=2)
+    epochs = [list(batches), list(batches), list(windowed)]
+    dist.destroy_process_group()
+    return [batch for epoch in epochs for batch in epoch]
+
+
+class TestSharding(testslide.TestCase):
+    def test_shard_range(self) -> None:
+        ranges = [shard_range(3, 13, shard_id, 4) for shard_id in range(4)]
+        self.assertEqual(ranges, [(3, 5), (5, 8), (8, 10), (10, 13)])
+
+    def test_current_shard(self) -> None:
+        self.assertEqual(current_shard(), (0, 1))
+        self.assertEqual(current_shard(rank=1, world_size=2), (1, 2))
+
+    def test_sharded_line_reader(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "data.tsv")
+        lines = [[str(i), "x" * (i % 7)] for i in range(50)]
+        with open(path, "w") as f:
+            # no trailing newline on the last line
+            f.write("\n".join("\t".join(line) for line in lines))
+
+        rows = []
+        for rank in range(3):
+            reader = ShardedLineReader([path], rank=rank, world_size=3)
+            shard_rows = list(reader)
+            self.assertGreater(len(shard_rows), 0)
+            rows += shard_rows
+        self.assertEqual(rows, lines)
+
+        with self.assertRaises(ValueError):
+            ShardedLineReader([path], rank=2, world_size=2)
+
+    def test_even_batches(self) -> None:
+        # passed through without a process group
+        self.assertEqual(list(EvenBatches(range(3))), [0, 1, 2])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lc = LaunchConfig(
+                min_nodes=1,
+                max_nodes=1,
+                nproc_per_node=2,
+                run_id=str(uuid.uuid4()),
+                rdzv_backend="c10d",
+                rdzv_endpoint=os.path.join(tmpdir, "rdzv"),
+                rdzv_configs={"store_type": "file"},
+                start_method="spawn",
+                monitor_interval=1,
+                max_restarts=0,
+            )
+            results = elastic_launch(config=lc, entrypoint=_even_batches)()
+        # both ranks stop after the 3 batches of rank 1, every epoch
+        for rank in range(2):
+            self.assertEqual(results[rank], [[rank, i] for i in range(3)] * 3)
+        with self.assertRaises(ValueError):
+            EvenBatches(range(3), check_interval=0)
+
+    def test_sharded_line_reader_workers(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "data.tsv")
+        with open(path, "w") as f:
+            f.writelines(f"{i}\n" for i in range(100))
+        values = []
+        for rank in range(2):
+            reader = ShardedLineReader([path], rank=rank, world_size=2).map(
+                lambda row: int(row[0])
+            )
+            values += list(DataLoader(reader, batch_size=None, num_workers=2))
+        self.assertEqual(sorted(values), list(range(100)))
+
+    def test_criteo_datamodule_sharding(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(
+            num_rows=100, num_days=1, num_days_test=1, dataset_path=dataset_path
+        ):
+
+            def rows(dm: CriteoDataModule) -> List[List[float]]:
+                return sorted(
+                    row
+                    for batch in dm.test_dataloader()
+                    for row in batch.dense_features.tolist()
+                )
+
+            dm = CriteoDataModule(
+                num_days=1, num_days_test=1, batch_size=8, dataset_path=dataset_path
+            )
+            dm.setup(stage="test")
+            expected = rows(dm)
+            self.assertEqual(len(expected), 100)
+
+            sharded = []
+            for rank in range(2):
+                dm = CriteoDataModule(
+                    num_days=1,
+                    num_days_test=1,
+                    batch_size=8,
+                    num_workers=2,
+                    dataset_path=dataset_path,
+                )
+                with mock.patch(
+                    "torchrecipes.rec.datamodules.criteo_datamodule.get_rank",
+                    return_value=rank,
+                ), mock.patch(
+                    "torchrecipes.rec.datamodules.criteo_datamodule.get_world_size",
+                    return_value=2,
+                ):
+                    dm.setup(stage="test")
+                sharded += rows(dm)
+            self.assertEqual(sorted(sharded), expected)
@@ -0,0 +1,118 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, TypeVar
+
+import numpy as np
+import testslide
+import torch
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.shuffle import ShuffleBuffer
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+
+T = TypeVar("T")
+
+
+class IDP_NoLen(IterDataPipe[T]):
+    def __init__(self, input_dp: Iterable[T]) -> None:
+        super().__init__()
+        self.input_dp = input_dp
+
+    def __iter__(self) -> Iterator[T]:
+        for i in self.input_dp:
+            yield i
+
+
+def _chunks(num_rows: int, chunk_size: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": torch.arange(start, min(start + chunk_size, num_rows)),
+            "name": [f"{i:x}" for i in range(start, min(start + chunk_size, num_rows))],
+            "pair": np.stack(
+                [np.arange(start, min(start + chunk_size, num_rows))] * 2, axis=1
+            ),
+        }
+        for start in range(0, num_rows, chunk_size)
+    ]
+
+
+def _ids(chunks: Iterable[Dict[str, Any]]) -> List[int]:
+    return [i for chunk in chunks for i in chunk["id"].tolist()]
+
+
+class TestShuffleBuffer(testslide.TestCase):
+    def test_shuffle(self) -> None:
+        chunks = _chunks(100, 8)
+        shuffler = ShuffleBuffer(IDP_NoLen(chunks), buffer_size=30, seed=0)
+        output = list(shuffler)
+        self.assertEqual(
+            [len(chunk["id"]) for chunk in output],
+            [len(chunk["id"]) for chunk in chunks],
+        )
+        for chunk in output:
+            # columns of a row stay together and keep their type
+            self.assertIsInstance(chunk["name"], list)
+            self.assertIsInstance(chunk["pair"], np.ndarray)
+            self.assertEqual(chunk["name"], [f"{i:x}" for i in chunk["id"].tolist()])
+            self.assertEqual(chunk["pair"][:, 1].tolist(), chunk["id"].tolist())
+        ids = _ids(output)
+        self.assertEqual(sorted(ids), list(range(100)))
+        self.assertNotEqual(ids, list(range(100)))
+
+    def test_epochs(self) -> None:
+        chunks = _chunks(50, 4)
+        shuffler = ShuffleBuffer(IDP_NoLen(chunks), buffer_size=16, seed=3)
+        first, second = _ids(shuffler), _ids(shuffler)
+        self.assertNotEqual(first, second)
+        self.assertEqual(sorted(first), sorted(second))
+
+        replay = ShuffleBuffer(IDP_NoLen(chunks), buffer_size=16, seed=3)
+        replay.set_epoch(1)
+        self.assertEqual(_ids(replay), second)
+        rank_1 = ShuffleBuffer(
+            IDP_NoLen(chunks), buffer_size=16, seed=3, rank=1, world_size=2
+        )
+        self.assertNotEqual(_ids(rank_1), first)
+
+    def test_small_buffer(self) -> None:
+        output = list(ShuffleBuffer(IDP_NoLen(_chunks(20, 8)), buffer_size=3, seed=0))
+        self.assertEqual(sorted(_ids(output)), list(range(20)))
+        self.assertTrue(all(len(chunk["id"]) <= 8 for chunk in output))
+        with self.assertRaises(ValueError):
+            ShuffleBuffer(IDP_NoLen([]), buffer_size=0)
+
+    def test_criteo_datamodule_shuffle(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(num_rows=100, dataset_path=dataset_path):
+
+            def rows(dm: CriteoDataModule) -> List[List[float]]:
+                dm.setup(stage="fit")
+                return [
+                    row
+                    for batch in dm.train_dataloader()
+                    for row in batch.dense_features.tolist()
+                ]
+
+            expected = rows(
+                CriteoDataModule(
+                    batch_size=8, dataset_path=dataset_path, split_mode="hash"
+                )
+            )
+            shuffled = rows(
+                CriteoDataModule(
+                    batch_size=8,
+                    dataset_path=dataset_path,
+                    split_mode="hash",
+                    shuffle_buffer_size=20,
+                    seed=0,
+                )
+            )
+            self.assertNotEqual(shuffled, expected)
+            self.assertEqual(sorted(shuffled), sorted(expected))
@@ -0,0 +1,169 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import uuid
+from typing import List
+from unittest.mock import patch
+
+import testslide
+import torch.distributed as dist
+from torch.distributed.launcher.api import elastic_launch, LaunchConfig
+from torch.utils.data import DataLoader
+from torchrecipes.rec.datamodules import train_val_split
+from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.tests.utils import create_dataset_tsv
+from torchrecipes.rec.datamodules.train_val_split import (
+    build_val_index,
+    is_train_offset,
+    line_offsets,
+    load_val_index,
+    OffsetLineReader,
+    val_index_path,
+)
+
+
+def _setup_hash_split(dataset_path: str) -> int:
+    dist.init_process_group("gloo")
+    rank = dist.get_rank()
+    # only rank 0 builds the val index, the other rank waits for it
+    with patch.object(
+        train_val_split,
+        "build_val_index",
+        side_effect=AssertionError if rank else train_val_split.build_val_index,
+    ):
+        # one batch per rank, none is dropped to even out the batches
+        dm = CriteoDataModule(
+            batch_size=256, dataset_path=dataset_path, split_mode="hash"
+        )
+        dm.setup(stage="fit")
+        num_rows = sum(len(batch.labels) for batch in dm.val_dataloader())
+    dist.destroy_process_group()
+    return num_rows
+
+
+class TestTrainValSplit(testslide.TestCase):
+    def _write_lines(self, num_lines: int) -> str:
+        path = os.path.join(tempfile.mkdtemp(), "data.tsv")
+        with open(path, "w") as f:
+            f.writelines(f"{i}\t{'x' * (i % 5)}\n" for i in range(num_lines))
+        return path
+
+    def test_val_index(self) -> None:
+        path = self._write_lines(1000)
+        offsets = line_offsets(path)
+        self.assertEqual(len(offsets), 1000)
+        for seed in (0, 7):
+            index = build_val_index(path, 0.8, seed)
+            expected = [
+                o for o in offsets.tolist() if not is_train_offset(o, 0.8, seed)
+            ]
+            self.assertEqual(index.tolist(), expected)
+            self.assertTrue(150 < len(index) < 250)
+
+    def test_load_val_index(self) -> None:
+        path = self._write_lines(100)
+        index = load_val_index(path, 0.5)
+        index_path = val_index_path(path, 0.5)
+        self.assertTrue(os.path.exists(index_path))
+        self.assertEqual(load_val_index(path, 0.5).tolist(), index.tolist())
+
+        # a rewritten file gets a new index, and the stale one is removed
+        with open(path, "a") as f:
+            f.writelines(f"{i}\n" for i in range(100))
+        self.assertNotEqual(val_index_path(path, 0.5), index_path)
+        self.assertEqual(
+            load_val_index(path, 0.5).tolist(), build_val_index(path, 0.5).tolist()
+        )
+        self.assertFalse(os.path.exists(index_path))
+        self.assertTrue(os.path.exists(val_index_path(path, 0.5)))
+
+    def test_offset_line_reader(self) -> None:
+        path = self._write_lines(100)
+        index = build_val_index(path, 0.5)
+        expected = [["%d" % i, "x" * (i % 5)] for i in range(100)]
+        offsets = line_offsets(path).tolist()
+        expected = [
+            line for line, o in zip(expected, offsets) if not is_train_offset(o, 0.5)
+        ]
+        rows = list(OffsetLineReader([path], [index]))
+        self.assertEqual(rows, expected)
+
+        rows = []
+        for rank in range(2):
+            reader = OffsetLineReader([path], [index], rank=rank, world_size=2)
+            rows += list(DataLoader(reader, batch_size=None, num_workers=2))
+        self.assertEqual(sorted(rows), sorted(expected))
+
+    def test_criteo_datamodule_hash_split(self) -> None:
+        dataset_path: str = tempfile.mkdtemp()
+        with create_dataset_tsv(num_rows=200, dataset_path=dataset_path) as paths:
+
+            def rows(dataloader: DataLoader) -> List[List[float]]:
+                return [
+                    row for batch in dataloader for row in batch.dense_features.tolist()
+                ]
+
+            dm = CriteoDataModule(
+                batch_size=8, dataset_path=dataset_path, split_mode="hash"
+            )
+            dm.setup(stage="fit")
+            self.assertTrue(os.path.exists(val_index_path(paths[0], 0.8)))
+            train_rows = rows(dm.train_dataloader())
+            val_rows = rows(dm.val_dataloader())
+            self.assertEqual(len(train_rows) + len(val_rows), 200)
+            self.assertTrue(0 < len(val_rows) < len(train_rows))
+
+            # another split seed uses its own index and splits other rows
+            dm = CriteoDataModule(
+                batch_size=8, dataset_path=dataset_path, split_mode="hash", split_seed=3
+            )
+            dm.setup(stage="fit")
+            self.assertTrue(os.path.exists(val_index_path(paths[0], 0.8, seed=3)))
+            seed_val_rows = rows(dm.val_dataloader())
+            self.assertEqual(len(rows(dm.train_dataloader())) + len(seed_val_rows), 200)
+            self.assertNotEqual(sorted(seed_val_rows), sorted(val_rows))
+
+            # day_1 as test day holds the same rows as day_0
+            shutil.copy(paths[0], os.path.join(dataset_path, "day_1.tsv"))
+            dm = CriteoDataModule(
+                num_days_test=1, batch_size=8, dataset_path=dataset_path
+            )
+            dm.setup(stage="test")
+            self.assertEqual(
+                sorted(train_rows + val_rows), sorted(rows(dm.test_dataloader()))
+            )
+
+            with self.assertRaisesRegex(ValueError, "Unknown split_mode"):
+                CriteoDataModule(dataset_path=dataset_path, split_mode="bad")
+
+    def test_criteo_datamodule_hash_split_ranks(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dataset_path = os.path.join(tmpdir, "data")
+            os.makedirs(dataset_path)
+            with create_dataset_tsv(num_rows=200, dataset_path=dataset_path) as paths:
+                lc = LaunchConfig(
+                    min_nodes=1,
+                    max_nodes=1,
+                    nproc_per_node=2,
+                    run_id=str(uuid.uuid4()),
+                    rdzv_backend="c10d",
+                    rdzv_endpoint=os.path.join(tmpdir, "rdzv"),
+                    rdzv_configs={"store_type": "file"},
+                    start_method="spawn",
+                    monitor_interval=1,
+                    max_restarts=0,
+                )
+                results = elastic_launch(config=lc, entrypoint=_setup_hash_split)(
+                    dataset_path
+                )
+                index = load_val_index(paths[0], 0.8)
+        # the ranks read disjoint parts of the val rows
+        self.assertEqual(results[0] + results[1], len(index))
@@ -0,0 +1,215 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+"""Hash based train/val split of line oriented files.
+
+A line belongs to the train split if a hash of its byte offset in the file is below
+``train_percent``. Membership is thus known before a line is parsed, the train
+reader skips val lines without parsing them and the byte offsets of the val lines
+can be precomputed into an index per file, so the val reader seeks straight to them.
+
+Example:
+    python -m torchrecipes.rec.datamodules.train_val_split \
+        --dataset_path /data/criteo --num_days 24 --train_percent 0.8
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from typing import Iterator, List, Sequence
+
+import numpy as np
+from torch.utils.data import IterDataPipe
+from torchrecipes.rec.datamodules.sharding import current_shard, shard_range
+
+_MASK: int = (1 << 64) - 1
+_GOLDEN: int = 0x9E3779B97F4A7C15
+_MUL1: int = 0xBF58476D1CE4E5B9
+_MUL2: int = 0x94D049BB133111EB
+_SCALE: float = 2.0**-53
+
+
+def _mix(offset: int, seed: int) -> int:
+    # splitmix64 finalizer, must match _mix_array
+    z = (offset + (seed + 1) * _GOLDEN) & _MASK
+    z = ((z ^ (z >> 30)) * _MUL1) & _MASK
+    z = ((z ^ (z >> 27)) * _MUL2) & _MASK
+    return z ^ (z >> 31)
+
+
+def _mix_array(offsets: np.ndarray, seed: int) -> np.ndarray:
+    # uint64 arithmetic wraps around, which is the & _MASK of _mix
+    z = offsets.astype(np.uint64) + np.uint64(((seed + 1) * _GOLDEN) & _MASK)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(_MUL1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(_MUL2)
+    return z ^ (z >> np.uint64(31))
+
+
+def is_train_offset(offset: int, train_percent: float, seed: int = 0) -> bool:
+    """Whether the line starting at byte ``offset`` belongs to the train split."""
+    return (_mix(offset, seed) >> 11) * _SCALE < train_percent
+
+
+def is_val_offset(offset: int, train_percent: float, seed: int = 0) -> bool:
+    """Whether the line starting at byte ``offset`` belongs to the val split."""
+    return not is_train_offset(offset, train_percent, seed)
+
+
+def line_offsets(path: str, block_size: int = 1 << 24) -> np.ndarray:
+    """Returns the byte offsets of the starts of all lines of a file."""
+    starts = [np.zeros(1, dtype=np.int64)]
+    size = 0
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            starts.append(newlines.astype(np.int64) + size + 1)
+            size += len(block)
+    offsets = np.concatenate(starts)
+    # there is no line after the last newline
+    return offsets[offsets < size]
+
+
+def build_val_index(path: str, train_percent: float, seed: int = 0) -> np.ndarray:
+    """Returns the sorted byte offsets of the val lines of a file."""
+    offsets = line_offsets(path)
+    train = (_mix_array(offsets, seed) >> np.uint64(11)) * _SCALE < train_percent
+    return offsets[~train]
+
+
+def _val_index_prefix(path: str, train_percent: float, seed: int) -> str:
+    return f"{path}.val_index_{train_percent}_{seed}_"
+
+
+def val_index_path(path: str, train_percent: float, seed: int = 0) -> str:
+    """Path of the val index of a file, keyed by the size and modification time
+    of the file, so that the index of a file that was rewritten is not used."""
+    stat = os.stat(path)
+    prefix = _val_index_prefix(path, train_percent, seed)
+    return f"{prefix}{stat.st_size}_{stat.st_mtime_ns}.npy"
+
+
+def save_val_index(index_path: str, index: np.ndarray) -> None:
+    # no partially written indexes if interrupted or read concurrently
+    tmp_path = f"{index_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.save(f, index)
+    os.replace(tmp_path, index_path)
+
+
+def load_val_index(path: str, train_percent: float, seed: int = 0) -> np.ndarray:
+    """Loads the val index of a file, building and saving it next to the file if
+    it does not exist yet, or the file changed since it was built."""
+    index_path = val_index_path(path, train_percent, seed)
+    if os.path.exists(index_path):
+        return np.load(index_path)
+    index = build_val_index(path, train_percent, seed)
+    try:
+        # indexes of previous versions of the file
+        prefix = _val_index_prefix(path, train_percent, seed)
+        for stale_path in glob.glob(f"{glob.escape(prefix)}*.npy"):
+            if stale_path != index_path:
+                os.remove(stale_path)
+        save_val_index(index_path, index)
+    except OSError:
+        # the dataset directory may be read-only, use the index from memory then
+        pass
+    return index
+
+
+class OffsetLineReader(IterDataPipe[List[str]]):
+    r""":class:`OffsetLineReader`.
+
+    Iterable datapipe reading the lines starting at given byte offsets of files,
+    split into fields. The offsets of every file are split into contiguous ranges,
+    one per ``(rank, worker_id)`` shard.
+
+    Args:
+        paths: Paths of the files to read.
+        offsets: Sorted line offsets to read, one array per path.
+        rank: Global rank of the current process.
+        world_size: Number of processes reading the files.
+        delimiter: Field delimiter.
+        buffer_size: Size in bytes of the read buffer of each file.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        offsets: Sequence[np.ndarray],
+        rank: int = 0,
+        world_size: int = 1,
+        delimiter: str = "\t",
+        buffer_size: int = -1,
+    ) -> None:
+        if len(paths) != len(offsets):
+            raise ValueError("Expected one offsets array per path.")
+        self.paths: List[str] = list(paths)
+        self.offsets: List[np.ndarray] = list(offsets)
+        self.rank = rank
+        self.world_size = world_size
+        self.delimiter = delimiter
+        self.buffer_size = buffer_size
+
+    def _read_lines(self, path: str, offsets: np.ndarray) -> Iterator[str]:
+        with open(path, "rb", buffering=self.buffer_size) as f:
+            for offset in offsets.tolist():
+                # seeking forward within the read buffer does not hit the disk
+                f.seek(offset)
+                yield f.readline().decode("utf-8")
+
+    def __iter__(self) -> Iterator[List[str]]:
+        shard_id, num_shards = current_shard(self.rank, self.world_size)
+        for path, offsets in zip(self.paths, self.offsets):
+            start, end = shard_range(0, len(offsets), shard_id, num_shards)
+            yield from csv.reader(
+                self._read_lines(path, offsets[start:end]), delimiter=self.delimiter
+            )
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Criteo val index builder")
+    parser.add_argument(
+        "--dataset_path",
+        type=str,
+        required=True,
+        help="the path of the criteo_1t TSV dataset",
+    )
+    parser.add_argument(
+        "--num_days",
+        type=int,
+        default=24,
+        help="number of days to index, starting from day_0",
+    )
+    parser.add_argument(
+        "--train_percent",
+        type=float,
+        default=0.8,
+        help="percent of data to use for training vs validation",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed of the split hash, the split_seed of CriteoDataModule",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    for day in range(args.num_days):
+        path = os.path.join(args.dataset_path, f"day_{day}.tsv")
+        index = build_val_index(path, args.train_percent, args.seed)
+        save_val_index(val_index_path(path, args.train_percent, args.seed), index)
+        print(f"Indexed day_{day}.tsv: {len(index)} val rows")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
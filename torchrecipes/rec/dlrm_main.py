@@ -9,7 +9,7 @@
 import argparse
 import os
 import sys
-from typing import List
+from typing import List, Union
 
 import pytorch_lightning as pl
 import torch
@@ -20,9 +20,19 @@ from torchrec import EmbeddingBagCollection
 from torchrec.datasets.criteo import DEFAULT_CAT_NAMES, DEFAULT_INT_NAMES
 from torchrec.modules.embedding_configs import EmbeddingBagConfig
 from torchrecipes.rec.accelerators.torchrec import TorchrecStrategy
-from torchrecipes.rec.datamodules.criteo_datamodule import CriteoDataModule
+from torchrecipes.rec.datamodules.criteo_datamodule import (
+    CriteoDataModule,
+    DEFAULT_READ_CHUNK_SIZE,
+)
 from torchrecipes.rec.datamodules.random_rec_datamodule import RandomRecDataModule
+from torchrecipes.rec.modules.embedding_precision import TORCHREC_DATA_TYPES
 from torchrecipes.rec.modules.lightning_dlrm import LightningDLRM
+from torchrecipes.rec.modules.sharding_plan import parse_sharding_types
+from torchrecipes.utils.loader_autotune import AUTO
+
+
+def _int_or_auto(value: str) -> Union[int, str]:
+    return value if value == AUTO else int(value)
 
 
 def parse_args(argv: List[str]) -> argparse.Namespace:
@@ -45,10 +55,87 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         help="the path of the dataset",
     )
     parser.add_argument(
-        "--num_workers",
+        "--dataset_format",
+        type=str,
+        default="tsv",
+        help="format of the criteo dataset, tsv or binary (the output of"
+        " torchrecipes.rec.datamodules.criteo_preprocess)",
+    )
+    parser.add_argument(
+        "--split_mode",
+        type=str,
+        default="random",
+        help="how criteo tsv rows are split into train and val, random or hash",
+    )
+    parser.add_argument(
+        "--split_seed",
+        type=int,
+        default=0,
+        help="seed of the hash of the hash split_mode",
+    )
+    parser.add_argument(
+        "--num_parallel_files",
+        type=int,
+        default=1,
+        help="number of criteo day files read at the same time",
+    )
+    parser.add_argument(
+        "--decompress_threads",
+        type=int,
+        default=1,
+        help="number of threads decompressing every seekable zstd criteo day file."
+        " Compressed day files (day_N.gz, day_N.tsv.zst, ...) are read when the"
+        " TSV files do not exist.",
+    )
+    parser.add_argument(
+        "--shuffle_buffer_size",
+        type=int,
+        default=None,
+        help="number of rows of the criteo train shuffle buffer, no shuffling if"
+        " not set",
+    )
+    parser.add_argument(
+        "--vocab_path",
+        type=str,
+        default=None,
+        help="criteo vocabulary file of torchrecipes.rec.datamodules"
+        ".criteo_vocab_builder. Sparse ids are mapped by it instead of being hashed"
+        " and the embedding table sizes are the vocabulary sizes.",
+    )
+    parser.add_argument(
+        "--batch_cache_dir",
+        type=str,
+        default=None,
+        help="directory to cache the transformed criteo batches in, so that later"
+        " epochs and runs do not parse the data again. Requires --seed with"
+        " --undersampling_rate",
+    )
+    parser.add_argument(
+        "--batch_cache_max_bytes",
         type=int,
+        default=None,
+        help="size cap of the batch cache, least recently used shards are deleted"
+        " beyond it",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=_int_or_auto,
         default=2,
-        help="number of dataloader workers",
+        help="number of dataloader workers, or auto to pick it by timing a short"
+        " probe of the Criteo dataloader",
+    )
+    parser.add_argument(
+        "--read_chunk_size",
+        type=_int_or_auto,
+        default=DEFAULT_READ_CHUNK_SIZE,
+        help="size in bytes of the read buffer of each Criteo TSV file, or auto",
+    )
+    parser.add_argument(
+        "--autotune_memory_budget",
+        type=int,
+        default=None,
+        help="maximum peak RSS in bytes of the auto num_workers/read_chunk_size,"
+        " half of the available memory by default",
     )
     parser.add_argument(
         "--limit_train_batches",
@@ -100,6 +187,43 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         default=64,
         help="Size of each embedding.",
     )
+    parser.add_argument(
+        "--embedding_data_type",
+        type=str,
+        default="fp32",
+        choices=["fp32", "fp16", "bf16"],
+        help="data type of the weights of the sharded embedding tables."
+        " Row-wise int8 tables are trained by UnshardedLightningDLRM"
+        " (embedding_data_type=int8).",
+    )
+    parser.add_argument(
+        "--sharding_type",
+        type=str,
+        default=None,
+        choices=["table_wise", "row_wise", "column_wise"],
+        help="sharding type of the embedding tables, chosen per table by the"
+        " planner if not set",
+    )
+    parser.add_argument(
+        "--table_sharding_types",
+        type=str,
+        default=None,
+        help="Comma separated table:sharding_type pairs overriding --sharding_type,"
+        " e.g. t_cat_0:row_wise,t_cat_1:column_wise",
+    )
+    parser.add_argument(
+        "--storage_budget_per_rank",
+        type=int,
+        default=None,
+        help="bytes of device memory per rank the embedding tables may take",
+    )
+    parser.add_argument(
+        "--sharding_plan_path",
+        type=str,
+        default=None,
+        help="file the sharding plan is saved to. Later runs of the same tables,"
+        " world size and sharding options load it instead of planning again.",
+    )
     parser.add_argument(
         "--tensorboard_save_dir",
         type=str,
@@ -172,7 +296,8 @@ def main(argv: List[str]) -> None:
             batch_size=args.batch_size,
             ids_per_feature=1,
             pin_memory=args.pin_memory,
-            num_workers=args.num_workers,
+            # synthetic batches are not worth probing
+            num_workers=0 if args.num_workers == AUTO else args.num_workers,
             num_dense=len(DEFAULT_INT_NAMES),
             manual_seed=args.seed,
         )
@@ -183,13 +308,27 @@ def main(argv: List[str]) -> None:
             batch_size=args.batch_size,
             num_days_test=1,
             num_workers=args.num_workers,
+            read_chunk_size=args.read_chunk_size,
+            autotune_memory_budget=args.autotune_memory_budget,
             undersampling_rate=args.undersampling_rate,
             seed=args.seed,
             num_embeddings=num_embeddings,
             num_embeddings_per_feature=num_embeddings_per_feature,
             pin_memory=args.pin_memory,
             dataset_path=args.dataset_path,
+            format=args.dataset_format,
+            split_mode=args.split_mode,
+            split_seed=args.split_seed,
+            num_parallel_files=args.num_parallel_files,
+            decompress_threads=args.decompress_threads,
+            shuffle_buffer_size=args.shuffle_buffer_size,
+            vocab_path=args.vocab_path,
+            batch_cache_dir=args.batch_cache_dir,
+            batch_cache_max_bytes=args.batch_cache_max_bytes,
         )
+        # the vocabulary sets the embedding table sizes
+        num_embeddings = datamodule.num_embeddings
+        num_embeddings_per_feature = datamodule.num_embeddings_per_feature
     else:
         raise ValueError(
             f"Unknown dataset {args.dataset_name}. "
@@ -206,6 +345,7 @@ def main(argv: List[str]) -> None:
             if num_embeddings is None
             else num_embeddings,
             feature_names=[feature_name],
+            data_type=TORCHREC_DATA_TYPES[args.embedding_data_type],
         )
         for feature_idx, feature_name in enumerate(keys)
     ]
@@ -221,6 +361,12 @@ def main(argv: List[str]) -> None:
         dense_in_features=len(DEFAULT_INT_NAMES),
         dense_arch_layer_sizes=list(map(int, args.dense_arch_layer_sizes.split(","))),
         over_arch_layer_sizes=list(map(int, args.over_arch_layer_sizes.split(","))),
+        sharding_types=None
+        if args.table_sharding_types is None
+        else parse_sharding_types(args.table_sharding_types),
+        default_sharding_type=args.sharding_type,
+        storage_budget=args.storage_budget_per_rank,
+        sharding_plan_path=args.sharding_plan_path,
     )
 
     checkpoint = ModelCheckpoint(dirpath=args.checkpoint_output_path)
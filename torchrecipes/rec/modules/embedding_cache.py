@@ -0,0 +1,457 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchrec import EmbeddingBagCollection
+
+EVICTION_POLICIES = ("lru", "lfu")
+# rows initialized at a time when creating a table file
+_INIT_CHUNK_ROWS = 1 << 16
+
+
+class MmapEmbeddingTable:
+    r""":class:`MmapEmbeddingTable`.
+
+    Float32 embedding table stored in a file and memory-mapped, so that only the
+    pages of the rows read are loaded. The file is created with the rows drawn
+    uniformly from [``init_min``, ``init_max``), or copied from
+    ``initial_weight``, replacing any previous file, so that a new run never
+    starts from the rows trained by another one. Only with ``resume`` is an
+    existing file reopened as it is.
+
+    Args:
+        path: File of the table, ``num_embeddings * embedding_dim`` float32.
+        num_embeddings: Number of rows.
+        embedding_dim: Number of columns.
+        init_min: Lower bound of the random initial rows.
+        init_max: Upper bound of the random initial rows.
+        initial_weight: Initial rows of a created file, instead of random ones.
+        seed: Seed of the random initial rows.
+        resume: If ``True``, the existing file is reopened, e.g. when resuming
+            from a checkpoint of the run that trained it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_embeddings: int,
+        embedding_dim: int,
+        init_min: float = -0.01,
+        init_max: float = 0.01,
+        initial_weight: Optional[torch.Tensor] = None,
+        seed: int = 0,
+        resume: bool = False,
+    ) -> None:
+        self.path = path
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        if resume:
+            nbytes = num_embeddings * embedding_dim * 4
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Cannot resume from missing table {path}")
+            if os.path.getsize(path) != nbytes:
+                raise ValueError(
+                    f"Cannot resume from table {path} of {os.path.getsize(path)} "
+                    f"bytes, expected {nbytes} bytes"
+                )
+        else:
+            self._create(init_min, init_max, initial_weight, seed)
+        self._array: np.ndarray = np.memmap(
+            path, dtype=np.float32, mode="r+", shape=(num_embeddings, embedding_dim)
+        )
+
+    def _create(
+        self,
+        init_min: float,
+        init_max: float,
+        initial_weight: Optional[torch.Tensor],
+        seed: int,
+    ) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        array = np.memmap(
+            tmp_path,
+            dtype=np.float32,
+            mode="w+",
+            shape=(self.num_embeddings, self.embedding_dim),
+        )
+        rng = np.random.default_rng(seed)
+        for start in range(0, self.num_embeddings, _INIT_CHUNK_ROWS):
+            end = min(start + _INIT_CHUNK_ROWS, self.num_embeddings)
+            if initial_weight is not None:
+                array[start:end] = initial_weight[start:end].detach().cpu().numpy()
+            else:
+                array[start:end] = rng.uniform(
+                    init_min, init_max, (end - start, self.embedding_dim)
+                )
+        array.flush()
+        del array
+        os.replace(tmp_path, self.path)
+
+    def read(self, rows: np.ndarray) -> np.ndarray:
+        """Copies the rows of sorted indices ``rows``."""
+        return self._array[rows]
+
+    def write(self, rows: np.ndarray, values: np.ndarray) -> None:
+        self._array[rows] = values
+
+    def flush(self) -> None:
+        # pyre-ignore[16]: np.memmap has flush
+        self._array.flush()
+
+
+class CachedEmbeddingBag(nn.Module):
+    r""":class:`CachedEmbeddingBag`.
+
+    Drop-in replacement of the ``nn.EmbeddingBag`` of an
+    ``EmbeddingBagCollection`` holding only ``cache_rows`` hot rows of a
+    :class:`MmapEmbeddingTable` in memory. The ``weight`` parameter is the
+    cache: a lookup maps the ids to their cache slots, first loading the missing
+    rows into the slots of the least recently (``"lru"``) or least frequently
+    (``"lfu"``) used rows, which are written back to the table if they were
+    trained. :meth:`prefetch` reads the rows of upcoming ids ahead of time, e.g.
+    from the background thread of a ``DevicePrefetcher``, so that lookups hit.
+    The rows read are only installed into the cache at the start of the next
+    lookup, in the thread running the model, so that the background thread
+    never writes the weights or optimizer state while the optimizer steps.
+    Prefetched rows are evicted last until they are looked up.
+
+    The slots looked up since the last :meth:`begin_batch` are never evicted, so
+    that the gradients of a batch, sparse like those of
+    ``nn.EmbeddingBag(sparse=True)``, still refer to the rows they were computed
+    for when the optimizer steps. ``refill_hooks`` are called with the slots
+    loaded with other rows, e.g. to reset their optimizer state. Besides the
+    cache, each table keeps 4 bytes per row mapping the rows to their slots.
+    The state dict holds the cache and the row of every slot, the other rows
+    are held by the table file.
+
+    Args:
+        table: Backing table.
+        cache_rows: Number of rows cached, at least the number of distinct ids
+            of a batch.
+        mode: Pooling mode, "sum" or "mean".
+        policy: Eviction policy. Options: {lru, lfu}.
+    """
+
+    def __init__(
+        self,
+        table: MmapEmbeddingTable,
+        cache_rows: int,
+        mode: str = "sum",
+        policy: str = "lru",
+    ) -> None:
+        super().__init__()
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(
+                f"Unknown policy {policy}. Please choose {{lru, lfu}} for policy"
+            )
+        if cache_rows < 1:
+            raise ValueError(f"cache_rows {cache_rows} must be positive")
+        cache_rows = min(cache_rows, table.num_embeddings)
+        self.table = table
+        self.cache_rows = cache_rows
+        self.mode = mode
+        self.policy = policy
+        self.weight = nn.Parameter(torch.zeros(cache_rows, table.embedding_dim))
+        self.refill_hooks: List[Callable[[torch.Tensor], None]] = []
+        self._lock = threading.Lock()
+        # slot of every row, -1 if not cached
+        self._slot_of: np.ndarray = np.full(table.num_embeddings, -1, dtype=np.int32)
+        # row of every slot, -1 if empty
+        self._slot_rows: np.ndarray = np.full(cache_rows, -1, dtype=np.int64)
+        # last use for lru, number of uses for lfu
+        self._score: np.ndarray = np.zeros(cache_rows, dtype=np.int64)
+        self._pin: np.ndarray = np.full(cache_rows, -1, dtype=np.int64)
+        self._dirty: np.ndarray = np.zeros(cache_rows, dtype=bool)
+        # prefetched and not looked up yet
+        self._fresh: np.ndarray = np.zeros(cache_rows, dtype=bool)
+        # rows read by prefetch() and their values, not installed yet
+        self._staged: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._batch = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.table.embedding_dim
+
+    @property
+    def num_embeddings(self) -> int:
+        return self.table.num_embeddings
+
+    def begin_batch(self) -> None:
+        """Unpins the slots of the previous batch, to be called before the
+        lookups of every batch."""
+        with self._lock:
+            self._batch += 1
+
+    def _install(
+        self,
+        rows: np.ndarray,
+        required: bool,
+        fresh: bool = False,
+        values: Optional[np.ndarray] = None,
+    ) -> int:
+        """Loads the missing sorted rows into evicted slots, all of them if
+        ``required``, else as many as there are unpinned slots. The rows are
+        read from the table unless their ``values`` are given."""
+        candidates = np.flatnonzero(self._pin != self._batch)
+        if len(candidates) < len(rows):
+            if required:
+                raise ValueError(
+                    f"cache_rows {self.cache_rows} cannot hold the"
+                    f" {len(rows) + self.cache_rows - len(candidates)} distinct ids"
+                    " of the batch. Increase cache_rows, or call begin_batch()"
+                    " before every batch"
+                )
+            rows = rows[: len(candidates)]
+            if values is not None:
+                values = values[: len(candidates)]
+        if len(rows) == 0:
+            return 0
+        # empty slots first, prefetched rows waiting for their lookup last
+        score = np.where(
+            self._fresh[candidates],
+            np.iinfo(np.int64).max,
+            self._score[candidates],
+        )
+        score[self._slot_rows[candidates] < 0] = -1
+        if len(rows) < len(candidates):
+            candidates = candidates[np.argpartition(score, len(rows) - 1)[: len(rows)]]
+        slots = candidates
+        occupied = slots[self._slot_rows[slots] >= 0]
+        dirty = occupied[self._dirty[occupied]]
+        weight = self.weight.data
+        if len(dirty):
+            order = np.argsort(self._slot_rows[dirty])
+            dirty = dirty[order]
+            self.table.write(
+                self._slot_rows[dirty],
+                weight[torch.from_numpy(dirty)].float().cpu().numpy(),
+            )
+        self._slot_of[self._slot_rows[occupied]] = -1
+        self.evictions += len(occupied)
+
+        if values is None:
+            values = self.table.read(rows)
+        slots_t = torch.from_numpy(slots).to(weight.device)
+        weight[slots_t] = torch.from_numpy(values).to(
+            device=weight.device, dtype=weight.dtype
+        )
+        self._slot_rows[slots] = rows
+        self._slot_of[rows] = slots
+        self._dirty[slots] = False
+        self._fresh[slots] = fresh
+        self._score[slots] = self._clock if self.policy == "lru" else 0
+        for hook in self.refill_hooks:
+            hook(slots_t)
+        return len(rows)
+
+    def prefetch(self, ids: torch.Tensor) -> None:
+        """Reads the missing rows of ``ids``, which the next lookup loads into
+        the cache as far as unpinned slots allow."""
+        ids = ids.detach().cpu().numpy()
+        with self._lock:
+            missing = ids[self._slot_of[ids] < 0]
+            if len(missing):
+                rows = np.unique(missing)
+                # the values stay current: a row is only written back after
+                # it was cached, and lookups install the staged rows first
+                self._staged.append((rows, self.table.read(rows)))
+
+    def _install_staged(self) -> None:
+        if not self._staged:
+            return
+        rows = np.concatenate([rows for rows, _ in self._staged])
+        values = np.concatenate([values for _, values in self._staged])
+        self._staged = []
+        rows, first = np.unique(rows, return_index=True)
+        missing = self._slot_of[rows] < 0
+        self.prefetched += self._install(
+            rows[missing], required=False, fresh=True, values=values[first[missing]]
+        )
+
+    def flush(self) -> None:
+        """Writes the trained cached rows back to the table file."""
+        with self._lock:
+            dirty = np.flatnonzero(self._dirty)
+            dirty = dirty[np.argsort(self._slot_rows[dirty])]
+            if len(dirty):
+                self.table.write(
+                    self._slot_rows[dirty],
+                    self.weight.data[torch.from_numpy(dirty)].float().cpu().numpy(),
+                )
+                self._dirty[dirty] = False
+            self.table.flush()
+
+    def _save_to_state_dict(
+        self,
+        destination: Dict[str, Any],
+        prefix: str,
+        keep_vars: bool,  # pyre-ignore[2]
+    ) -> None:
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+        with self._lock:
+            destination[prefix + "slot_rows"] = torch.from_numpy(self._slot_rows.copy())
+
+    def _load_from_state_dict(
+        self,
+        state_dict: Dict[str, Any],  # pyre-ignore[2]
+        prefix: str,
+        local_metadata: Dict[str, Any],  # pyre-ignore[2]
+        strict: bool,
+        missing_keys: List[str],
+        unexpected_keys: List[str],
+        error_msgs: List[str],
+    ) -> None:
+        super()._load_from_state_dict(
+            state_dict,
+            prefix,
+            local_metadata,
+            strict,
+            missing_keys,
+            unexpected_keys,
+            error_msgs,
+        )
+        key = prefix + "slot_rows"
+        if key not in state_dict:
+            if strict:
+                missing_keys.append(key)
+            return
+        if key in unexpected_keys:
+            unexpected_keys.remove(key)
+        slot_rows = state_dict[key].cpu().numpy().astype(np.int64)
+        if slot_rows.shape != self._slot_rows.shape:
+            error_msgs.append(
+                f"size mismatch for {key}: copying a param with shape"
+                f" {tuple(slot_rows.shape)}, the shape in current model is"
+                f" {tuple(self._slot_rows.shape)}."
+            )
+            return
+        with self._lock:
+            self._staged = []
+            self._slot_of[:] = -1
+            self._slot_rows[:] = slot_rows
+            occupied = np.flatnonzero(slot_rows >= 0)
+            self._slot_of[slot_rows[occupied]] = occupied
+            # the loaded rows may differ from the table file
+            self._dirty[:] = slot_rows >= 0
+            self._fresh[:] = False
+            self._score[:] = 0
+            self._pin[:] = -1
+
+    def stats(self, reset: bool = False) -> Dict[str, int]:
+        """Lookup hits and misses, evictions and prefetched rows since the last
+        reset."""
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "prefetched": self.prefetched,
+            }
+            if reset:
+                self.hits = self.misses = self.evictions = self.prefetched = 0
+        return stats
+
+    # pyre-ignore[14]: `forward` overrides method defined in `nn.Module`
+    def forward(
+        self,
+        input: torch.Tensor,
+        offsets: torch.Tensor,
+        per_sample_weights: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        ids = input.detach().cpu().numpy()
+        with self._lock:
+            self._install_staged()
+            self._clock += 1
+            slots = self._slot_of[ids]
+            hit = slots >= 0
+            num_hits = int(hit.sum())
+            self.hits += num_hits
+            self.misses += len(ids) - num_hits
+            # the rows already cached must not make room for the missing ones
+            self._pin[slots[hit]] = self._batch
+            if num_hits < len(ids):
+                self._install(np.unique(ids[~hit]), required=True)
+                slots = self._slot_of[ids]
+            self._pin[slots] = self._batch
+            self._fresh[slots] = False
+            if self.policy == "lru":
+                self._score[slots] = self._clock
+            else:
+                np.add.at(self._score, slots, 1)
+            if torch.is_grad_enabled():
+                self._dirty[slots] = True
+        return F.embedding_bag(
+            torch.from_numpy(slots.astype(np.int64)).to(self.weight.device),
+            self.weight,
+            offsets,
+            mode=self.mode,
+            sparse=True,
+            per_sample_weights=per_sample_weights,
+            include_last_offset=True,
+        )
+
+
+def cache_embedding_tables(
+    embedding_bag_collection: EmbeddingBagCollection,
+    cache_dir: str,
+    cache_rows: int,
+    policy: str = "lru",
+    seed: int = 0,
+    resume: bool = False,
+) -> Dict[str, CachedEmbeddingBag]:
+    """Replaces the tables of an ``EmbeddingBagCollection`` by
+    :class:`CachedEmbeddingBag` backed by ``{cache_dir}/{table name}.f32``.
+
+    The table files are created, initialized with the weights of the collection,
+    or randomly like torchrec if it was created on the meta device, which avoids
+    allocating the full tables. With ``resume``, the existing files are
+    reopened instead, see :class:`MmapEmbeddingTable`.
+
+    Returns:
+        The cached tables by name.
+    """
+    cached = {}
+    for config in embedding_bag_collection.embedding_bag_configs():
+        embedding_bag = embedding_bag_collection.embedding_bags[config.name]
+        weight = embedding_bag.weight
+        # torchrec's default initialization
+        bound = math.sqrt(1 / config.num_embeddings)
+        table = MmapEmbeddingTable(
+            os.path.join(cache_dir, f"{config.name}.f32"),
+            config.num_embeddings,
+            config.embedding_dim,
+            init_min=-bound
+            if config.weight_init_min is None
+            else config.weight_init_min,
+            init_max=bound
+            if config.weight_init_max is None
+            else config.weight_init_max,
+            initial_weight=None if weight.is_meta else weight,
+            seed=seed,
+            resume=resume,
+        )
+        cached_bag = CachedEmbeddingBag(
+            table, cache_rows, mode=embedding_bag.mode, policy=policy
+        )
+        embedding_bag_collection.embedding_bags[config.name] = cached_bag
+        cached[config.name] = cached_bag
+    return cached
@@ -0,0 +1,323 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchrec import EmbeddingBagCollection
+from torchrec.modules.embedding_configs import DataType
+
+# storage of the embedding weights, int8 is row-wise quantized
+EMBEDDING_DATA_TYPES: Dict[str, torch.dtype] = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "int8": torch.uint8,
+}
+# EmbeddingBagConfig.data_type of the data types
+TORCHREC_DATA_TYPES: Dict[str, DataType] = {
+    "fp32": DataType.FP32,
+    "fp16": DataType.FP16,
+    "bf16": DataType.BF16,
+    "int8": DataType.INT8,
+}
+# rows quantized at a time when initializing an int8 table
+_INIT_CHUNK_ROWS = 1 << 16
+
+
+def get_embedding_dtype(data_type: str) -> torch.dtype:
+    if data_type not in EMBEDDING_DATA_TYPES:
+        raise ValueError(
+            f"Unknown data_type {data_type}. Please choose {{fp32, fp16, bf16, int8}} for data_type"
+        )
+    return EMBEDDING_DATA_TYPES[data_type]
+
+
+def stochastic_round(
+    x: torch.Tensor, dtype: torch.dtype, generator: Optional[torch.Generator] = None
+) -> torch.Tensor:
+    """Rounds float32 ``x`` to the floating point ``dtype``, up or down with
+    probabilities proportional to the distances to the two neighbouring values,
+    so that the result is ``x`` in expectation. Updates smaller than half the
+    spacing of fp16/bf16 values, which round to nearest drops, thus still add up
+    over steps."""
+    x = x.float()
+    if dtype == torch.float32:
+        return x
+    nearest = x.to(dtype)
+    residual = x - nearest.float()
+    toward = torch.where(residual > 0, math.inf, -math.inf).to(dtype)
+    other = torch.nextafter(nearest, toward)
+    # 0 where x is representable, or the other neighbour is infinite
+    prob = residual / (other.float() - nearest.float())
+    rand = torch.rand(x.shape, generator=generator, device=x.device)
+    return torch.where(rand < prob, other, nearest)
+
+
+def quantize_rows(
+    weight: torch.Tensor, stochastic: bool = False
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Quantizes the rows of a 2D float tensor to uint8 codes with a float32
+    scale and bias per row, the row-wise int8 format of FBGEMM.
+
+    Returns:
+        The codes, and the ``[num_rows, 2]`` scales and biases.
+    """
+    weight = weight.float()
+    bias = weight.min(dim=1).values
+    scale = (weight.max(dim=1).values - bias) / 255
+    # constant rows
+    scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+    codes = (weight - bias.unsqueeze(1)) / scale.unsqueeze(1)
+    if stochastic:
+        codes = torch.floor(codes + torch.rand_like(codes))
+    else:
+        codes = torch.round(codes)
+    return codes.clamp_(0, 255).to(torch.uint8), torch.stack([scale, bias], dim=1)
+
+
+def dequantize_rows(codes: torch.Tensor, scale_bias: torch.Tensor) -> torch.Tensor:
+    return codes.float() * scale_bias[:, :1] + scale_bias[:, 1:]
+
+
+class _DequantizedRows(torch.autograd.Function):
+    """Gathers and dequantizes rows of an :class:`Int8EmbeddingBag`, and passes
+    their gradients to its ``weight`` as a sparse gradient of the rows."""
+
+    @staticmethod
+    # pyre-ignore[14]: `forward` overrides method defined in `Function`
+    def forward(
+        ctx: Any,  # pyre-ignore[2]
+        weight: torch.Tensor,
+        rows: torch.Tensor,
+        codes: torch.Tensor,
+        scale_bias: torch.Tensor,
+    ) -> torch.Tensor:
+        ctx.save_for_backward(rows)
+        ctx.weight_shape = weight.shape
+        return dequantize_rows(codes[rows], scale_bias[rows])
+
+    @staticmethod
+    def backward(
+        ctx: Any, grad: torch.Tensor  # pyre-ignore[2]
+    ) -> Tuple[Optional[torch.Tensor], ...]:
+        (rows,) = ctx.saved_tensors
+        weight_grad = torch.sparse_coo_tensor(rows.unsqueeze(0), grad, ctx.weight_shape)
+        return weight_grad, None, None, None
+
+
+class Int8EmbeddingBag(nn.Module):
+    r""":class:`Int8EmbeddingBag`.
+
+    Drop-in replacement of the ``nn.EmbeddingBag`` of an
+    ``EmbeddingBagCollection`` storing the table as row-wise int8: one uint8
+    code per element and a float32 scale and bias per row, a quarter of the
+    float32 table plus 8 bytes per row. A lookup dequantizes only the distinct
+    rows of its ids.
+
+    ``weight`` is a placeholder of the shape of the table that takes no memory,
+    so that optimizers find the table among the parameters. Its gradients are
+    sparse, like those of ``nn.EmbeddingBag(sparse=True)``, and are applied by
+    :func:`apply_row_update`, which re-quantizes the updated rows with
+    stochastic rounding, e.g. by the row-wise optimizers of
+    ``torchrecipes.rec.modules.sparse_optimizers``. Dense optimizers cannot
+    update the table.
+
+    Args:
+        num_embeddings: Number of rows.
+        embedding_dim: Number of columns.
+        mode: Pooling mode, "sum" or "mean".
+        initial_weight: Rows to quantize, random ones if not set.
+        init_min: Lower bound of the random initial rows.
+        init_max: Upper bound of the random initial rows.
+        device: Device of the table.
+    """
+
+    def __init__(
+        self,
+        num_embeddings: int,
+        embedding_dim: int,
+        mode: str = "sum",
+        initial_weight: Optional[torch.Tensor] = None,
+        init_min: float = -0.01,
+        init_max: float = 0.01,
+        device: Optional[torch.device] = None,
+    ) -> None:
+        super().__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.mode = mode
+        self.register_buffer(
+            "codes",
+            torch.empty(
+                num_embeddings, embedding_dim, dtype=torch.uint8, device=device
+            ),
+        )
+        self.register_buffer(
+            "scale_bias",
+            torch.empty(num_embeddings, 2, dtype=torch.float32, device=device),
+        )
+        self.weight = self._placeholder(torch.zeros((), device=device))
+        # chunks, so that the float32 table is never allocated at once
+        for start in range(0, num_embeddings, _INIT_CHUNK_ROWS):
+            end = min(start + _INIT_CHUNK_ROWS, num_embeddings)
+            if initial_weight is None:
+                rows = torch.empty(end - start, embedding_dim, device=device)
+                rows.uniform_(init_min, init_max)
+            else:
+                rows = initial_weight[start:end].detach().to(device)
+            self.codes[start:end], self.scale_bias[start:end] = quantize_rows(rows)
+
+    def _placeholder(self, value: torch.Tensor) -> nn.Parameter:
+        weight = nn.Parameter(
+            value.reshape(1, 1).expand(self.num_embeddings, self.embedding_dim)
+        )
+        # pyre-ignore[16]: tags the parameter for apply_row_update
+        weight.row_store = self
+        return weight
+
+    def _apply(
+        self,
+        fn: Callable[..., Any],  # pyre-ignore[2]
+        *args: Any,  # pyre-ignore[2]
+    ) -> "Int8EmbeddingBag":
+        # moves the buffers, and the placeholder without materializing it
+        weight = self._parameters.pop("weight")
+        super()._apply(fn, *args)
+        value = fn(weight.detach()[0, 0])
+        if value.device == weight.device and value.dtype == weight.dtype:
+            self.weight = weight
+        else:
+            self.weight = self._placeholder(value)
+        return self
+
+    def _save_to_state_dict(
+        self,
+        destination: Dict[str, Any],
+        prefix: str,
+        keep_vars: bool,  # pyre-ignore[2]
+    ) -> None:
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+        destination.pop(prefix + "weight")
+
+    def _load_from_state_dict(
+        self,
+        state_dict: Dict[str, Any],  # pyre-ignore[2]
+        prefix: str,
+        local_metadata: Dict[str, Any],  # pyre-ignore[2]
+        strict: bool,
+        missing_keys: List[str],
+        unexpected_keys: List[str],
+        error_msgs: List[str],
+    ) -> None:
+        super()._load_from_state_dict(
+            state_dict,
+            prefix,
+            local_metadata,
+            strict,
+            missing_keys,
+            unexpected_keys,
+            error_msgs,
+        )
+        if prefix + "weight" in missing_keys:
+            missing_keys.remove(prefix + "weight")
+
+    def dequantize(self) -> torch.Tensor:
+        """The float32 table."""
+        return dequantize_rows(self.codes, self.scale_bias)
+
+    @torch.no_grad()
+    def add_rows(self, rows: torch.Tensor, update: torch.Tensor) -> None:
+        """Adds ``update`` to the distinct ``rows`` and re-quantizes them."""
+        values = dequantize_rows(self.codes[rows], self.scale_bias[rows]) + update
+        self.codes[rows], self.scale_bias[rows] = quantize_rows(values, stochastic=True)
+
+    # pyre-ignore[14]: `forward` overrides method defined in `nn.Module`
+    def forward(
+        self,
+        input: torch.Tensor,
+        offsets: torch.Tensor,
+        per_sample_weights: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        rows, inverse = torch.unique(input, return_inverse=True)
+        values = _DequantizedRows.apply(self.weight, rows, self.codes, self.scale_bias)
+        return F.embedding_bag(
+            inverse,
+            values,
+            offsets,
+            mode=self.mode,
+            per_sample_weights=per_sample_weights,
+            include_last_offset=True,
+        )
+
+
+@torch.no_grad()
+def apply_row_update(
+    param: torch.Tensor, rows: torch.Tensor, update: torch.Tensor
+) -> None:
+    """Adds the float32 ``update`` to the distinct ``rows`` of an embedding
+    table ``param``: in place for float32 tables, with stochastic rounding for
+    fp16/bf16 ones, and re-quantized for :class:`Int8EmbeddingBag` ones."""
+    row_store = getattr(param, "row_store", None)
+    if row_store is not None:
+        row_store.add_rows(rows, update)
+    elif param.dtype == torch.float32:
+        param.index_add_(0, rows, update)
+    else:
+        param[rows] = stochastic_round(param[rows].float() + update, param.dtype)
+
+
+def set_embedding_precision(
+    embedding_bag_collection: EmbeddingBagCollection, data_type: str
+) -> None:
+    """Stores the tables of an ``EmbeddingBagCollection`` as ``data_type``.
+
+    fp16/bf16 convert the weights of the tables. int8 replaces the tables by
+    :class:`Int8EmbeddingBag`, quantizing the weights of the collection, or
+    random ones drawn like torchrec's if it was created on the meta device,
+    which avoids allocating the float32 tables.
+    """
+    dtype = get_embedding_dtype(data_type)
+    if dtype == torch.float32:
+        return
+    for config in embedding_bag_collection.embedding_bag_configs():
+        embedding_bag = embedding_bag_collection.embedding_bags[config.name]
+        weight = embedding_bag.weight
+        if dtype != torch.uint8:
+            embedding_bag.weight = nn.Parameter(weight.detach().to(dtype))
+            continue
+        # torchrec's default initialization
+        bound = math.sqrt(1 / config.num_embeddings)
+        embedding_bag_collection.embedding_bags[config.name] = Int8EmbeddingBag(
+            config.num_embeddings,
+            config.embedding_dim,
+            mode=embedding_bag.mode,
+            initial_weight=None if weight.is_meta else weight,
+            init_min=-bound
+            if config.weight_init_min is None
+            else config.weight_init_min,
+            init_max=bound
+            if config.weight_init_max is None
+            else config.weight_init_max,
+            device=torch.device("cpu") if weight.is_meta else weight.device,
+        )
+
+
+def embedding_storage_bytes(embedding_bag_collection: EmbeddingBagCollection) -> int:
+    """Bytes of the weights of the tables of an ``EmbeddingBagCollection``."""
+    nbytes = 0
+    for embedding_bag in embedding_bag_collection.embedding_bags.values():
+        if isinstance(embedding_bag, Int8EmbeddingBag):
+            nbytes += embedding_bag.codes.nbytes + embedding_bag.scale_bias.nbytes
+        else:
+            weight = embedding_bag.weight
+            nbytes += weight.numel() * weight.element_size()
+    return nbytes
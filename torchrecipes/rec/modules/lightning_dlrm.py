@@ -8,7 +8,7 @@
 import logging
 import os
 import sys
-from typing import Iterator, Any, List, TypeVar
+from typing import Dict, Iterator, Any, List, Optional, TypeVar
 
 import pytorch_lightning as pl
 import torch
@@ -21,6 +21,7 @@ from torchrec.distributed.model_parallel import DistributedModelParallel
 from torchrec.distributed.train_pipeline import In
 from torchrec.github.examples.dlrm.modules.dlrm_train import DLRMTrain
 from torchrec.optim.keyed import KeyedOptimizerWrapper
+from torchrecipes.rec.modules.sharding_plan import load_or_create_plan
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -30,6 +31,26 @@ M = TypeVar("M", bound=nn.Module)
 
 
 class LightningDLRM(pl.LightningModule):
+    """DLRM with the embedding tables sharded by ``DistributedModelParallel``.
+    Without any sharding option, it plans with its default planner.
+
+    Args:
+        embedding_bag_collection: Embedding tables of the sparse features.
+        batch_size: Batch size per rank.
+        dense_in_features: Number of dense features.
+        dense_arch_layer_sizes: Layer sizes of the dense arch.
+        over_arch_layer_sizes: Layer sizes of the over arch.
+        sharding_types: Sharding type of tables by name. Options: {table_wise,
+            row_wise, column_wise}.
+        default_sharding_type: Sharding type of the tables not in
+            sharding_types, chosen by the planner if not set.
+        storage_budget: Bytes of device memory per rank the tables may take.
+        sharding_plan_path: File the sharding plan is saved to, and loaded from
+            by later runs of the same tables, world size and sharding config,
+            which skips planning, see
+            ``torchrecipes.rec.modules.sharding_plan``.
+    """
+
     def __init__(
         self,
         embedding_bag_collection: EmbeddingBagCollection,
@@ -37,6 +58,10 @@ class LightningDLRM(pl.LightningModule):
         dense_in_features: int,
         dense_arch_layer_sizes: List[int],
         over_arch_layer_sizes: List[int],
+        sharding_types: Optional[Dict[str, str]] = None,
+        default_sharding_type: Optional[str] = None,
+        storage_budget: Optional[int] = None,
+        sharding_plan_path: Optional[str] = None,
     ) -> None:
         super().__init__()
 
@@ -61,9 +86,29 @@ class LightningDLRM(pl.LightningModule):
             dense_device=device,
         )
 
+        plan = None
+        if (
+            sharding_types is not None
+            or default_sharding_type is not None
+            or storage_budget is not None
+            or sharding_plan_path is not None
+        ):
+            plan = load_or_create_plan(
+                model,
+                embedding_bag_collection.embedding_bag_configs(),
+                world_size=dist.get_world_size(),
+                compute_device=device.type,
+                sharding_types=sharding_types,
+                default_sharding_type=default_sharding_type,
+                storage_budget=storage_budget,
+                plan_path=sharding_plan_path,
+                batch_size=batch_size,
+            )
+
         self.model = DistributedModelParallel(
             module=model,
             device=device,
+            plan=plan,
         )
 
         self.train_pipeline: TrainPipelineSparseDist = TrainPipelineSparseDist(
@@ -0,0 +1,101 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+from typing import Dict, Optional
+
+import torch
+import torchmetrics as metrics
+
+
+class BinnedCTRMetrics(metrics.Metric):
+    r""":class:`BinnedCTRMetrics`.
+
+    Fixed memory AUROC, normalized entropy and calibration of binary predictions.
+    Instead of buffering the predictions like ``torchmetrics.AUROC``, every update
+    adds the (weighted) count of the predictions per score bin and label to a
+    histogram with a single ``bincount``, so the state is O(``num_bins``) however
+    many rows are seen. The states are summed across ranks only in
+    :meth:`compute`, e.g. at epoch end.
+
+    The AUROC is exact up to ties within a bin, which count as half correctly
+    ordered. The normalized entropy is the mean log loss divided by the entropy
+    of the positive rate, and the calibration the sum of the predictions divided
+    by the number of positives, 1 for calibrated predictions. Metrics undefined
+    for the rows seen, e.g. the AUROC of rows of a single label, are NaN or
+    infinite.
+
+    Args:
+        num_bins: Number of equal width bins of the scores in [0, 1].
+    """
+
+    def __init__(self, num_bins: int = 10000) -> None:
+        super().__init__()
+        if num_bins < 1:
+            raise ValueError(f"num_bins {num_bins} must be positive")
+        self.num_bins = num_bins
+        # negatives in [0, num_bins), positives in [num_bins, 2 * num_bins)
+        self.add_state(
+            "histogram",
+            default=torch.zeros(2 * num_bins, dtype=torch.float64),
+            dist_reduce_fx="sum",
+        )
+        self.add_state(
+            "log_loss",
+            default=torch.tensor(0.0, dtype=torch.float64),
+            dist_reduce_fx="sum",
+        )
+        self.add_state(
+            "pred_sum",
+            default=torch.tensor(0.0, dtype=torch.float64),
+            dist_reduce_fx="sum",
+        )
+
+    # pyre-ignore[14]: `update` overrides method defined in `metrics.Metric`
+    def update(
+        self,
+        preds: torch.Tensor,
+        labels: torch.Tensor,
+        weights: Optional[torch.Tensor] = None,
+    ) -> None:
+        """Adds a batch of predicted probabilities and their 0/1 labels, with
+        optional row weights."""
+        preds = preds.detach().reshape(-1).to(torch.float64)
+        labels = labels.reshape(-1)
+        if weights is not None:
+            weights = weights.detach().reshape(-1).to(torch.float64)
+        bins = (preds * self.num_bins).long().clamp_(0, self.num_bins - 1)
+        bins += labels.long() * self.num_bins
+        # pyre-ignore[16]: states are attributes
+        self.histogram += torch.bincount(
+            bins, weights=weights, minlength=2 * self.num_bins
+        )
+        log_loss = torch.nn.functional.binary_cross_entropy(
+            preds, labels.to(torch.float64), weight=weights, reduction="sum"
+        )
+        self.log_loss += log_loss
+        self.pred_sum += preds.sum() if weights is None else (preds * weights).sum()
+
+    def compute(self) -> Dict[str, torch.Tensor]:
+        # pyre-ignore[16]: states are attributes
+        negatives, positives = self.histogram.view(2, self.num_bins)
+        num_negatives = negatives.sum()
+        num_positives = positives.sum()
+        total = num_negatives + num_positives
+        # positives outscore the negatives of the lower bins and tie with the
+        # negatives of their bin
+        below = torch.cumsum(negatives, 0) - negatives
+        auroc = (positives * (below + 0.5 * negatives)).sum() / (
+            num_positives * num_negatives
+        )
+        rate = num_positives / total
+        entropy = -(rate * torch.log(rate) + (1 - rate) * torch.log1p(-rate))
+        return {
+            "auroc": auroc.float(),
+            "ne": (self.log_loss / total / entropy).float(),
+            "calibration": (self.pred_sum / num_positives).float(),
+        }
@@ -0,0 +1,262 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from typing import Any, Dict, List, Optional
+
+import torch.distributed as dist
+import torch.nn as nn
+from pyre_extensions import none_throws
+from torchrec.distributed.model_parallel import get_default_sharders
+from torchrec.distributed.planner import (
+    EmbeddingShardingPlanner,
+    ParameterConstraints,
+    Topology,
+)
+from torchrec.distributed.types import ModuleSharder, ShardingPlan, ShardingType
+from torchrec.modules.embedding_configs import EmbeddingBagConfig
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SHARDING_TYPES: Dict[str, str] = {
+    "table_wise": ShardingType.TABLE_WISE.value,
+    "row_wise": ShardingType.ROW_WISE.value,
+    "column_wise": ShardingType.COLUMN_WISE.value,
+}
+# bumped when the plan file format changes
+_PLAN_FILE_VERSION = 1
+
+
+def parse_sharding_types(value: str) -> Dict[str, str]:
+    """Parses comma separated ``table:sharding_type`` pairs, e.g. the
+    ``--table_sharding_types`` of ``dlrm_main``."""
+    sharding_types = {}
+    for item in value.split(","):
+        table, sep, sharding_type = item.partition(":")
+        if not sep:
+            raise ValueError(
+                f"Invalid table sharding type {item}. Expected table:sharding_type"
+            )
+        sharding_types[table.strip()] = sharding_type.strip()
+    return sharding_types
+
+
+def make_constraints(
+    tables: List[EmbeddingBagConfig],
+    sharding_types: Optional[Dict[str, str]] = None,
+    default_sharding_type: Optional[str] = None,
+) -> Dict[str, ParameterConstraints]:
+    """Planner constraints restricting every table to its entry of
+    ``sharding_types``, or to ``default_sharding_type``. Tables without either
+    are left to the planner."""
+    sharding_types = sharding_types or {}
+    names = [table.name for table in tables]
+    for name, sharding_type in sharding_types.items():
+        if name not in names:
+            raise ValueError(
+                f"Unknown table {name}. Please choose {{{', '.join(names)}}} for the table of a sharding type"
+            )
+    constraints = {}
+    for name in names:
+        sharding_type = sharding_types.get(name, default_sharding_type)
+        if sharding_type is None:
+            continue
+        if sharding_type not in SHARDING_TYPES:
+            raise ValueError(
+                f"Unknown sharding_type {sharding_type}. Please choose {{table_wise, row_wise, column_wise}} for sharding_type"
+            )
+        constraints[name] = ParameterConstraints(
+            sharding_types=[SHARDING_TYPES[sharding_type]]
+        )
+    return constraints
+
+
+def plan_key(
+    tables: List[EmbeddingBagConfig],
+    world_size: int,
+    compute_device: str,
+    constraints: Dict[str, ParameterConstraints],
+    storage_budget: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    sharders: Optional[List[ModuleSharder[nn.Module]]] = None,
+) -> str:
+    """Fingerprint of everything a plan depends on, so that a plan file is only
+    reused for the tables, world size, sharding config, batch size and sharders
+    it was made for."""
+    config = {
+        "tables": [
+            [
+                table.name,
+                table.num_embeddings,
+                table.embedding_dim,
+                str(table.data_type),
+                sorted(table.feature_names),
+            ]
+            for table in tables
+        ],
+        "world_size": world_size,
+        "compute_device": compute_device,
+        "sharding_types": {
+            name: constraint.sharding_types
+            for name, constraint in sorted(constraints.items())
+        },
+        "storage_budget": storage_budget,
+        "batch_size": batch_size,
+        "sharders": [
+            [
+                f"{type(sharder).__module__}.{type(sharder).__qualname__}",
+                sorted(sharder.sharding_types(compute_device)),
+            ]
+            for sharder in sharders or []
+        ],
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def load_plan(path: str, key: str) -> Optional[ShardingPlan]:
+    """The plan of the plan file ``path``, None if it is missing or was made for
+    another config."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        # pyre-ignore[33]: the pickled header and plan
+        content: Dict[str, Any] = pickle.load(f)
+    if content.get("version") != _PLAN_FILE_VERSION or content.get("key") != key:
+        logger.warning(
+            f"Sharding plan file {path} was made for another config and is replanned"
+        )
+        return None
+    return content["plan"]
+
+
+def save_plan(path: str, key: str, plan: ShardingPlan) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # no partially written plan files if interrupted
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"version": _PLAN_FILE_VERSION, "key": key, "plan": plan}, f)
+    os.replace(tmp_path, path)
+
+
+def load_or_create_plan(
+    module: nn.Module,
+    tables: List[EmbeddingBagConfig],
+    world_size: int,
+    compute_device: str,
+    sharding_types: Optional[Dict[str, str]] = None,
+    default_sharding_type: Optional[str] = None,
+    storage_budget: Optional[int] = None,
+    plan_path: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    sharders: Optional[List[ModuleSharder[nn.Module]]] = None,
+) -> ShardingPlan:
+    """Sharding plan of the embedding tables of ``module``, to be passed as the
+    ``plan`` of ``DistributedModelParallel``.
+
+    Args:
+        module: Unsharded model, e.g. on the meta device.
+        tables: Configs of the embedding tables of the model.
+        world_size: Number of ranks.
+        compute_device: "cuda" or "cpu".
+        sharding_types: Sharding type of tables by name. Options:
+            {table_wise, row_wise, column_wise}.
+        default_sharding_type: Sharding type of the other tables, chosen by
+            the planner if not set.
+        storage_budget: Bytes of HBM (cuda) or DDR (cpu) per rank the tables
+            may take, the planner's estimate of the device memory if not set.
+        plan_path: Plan file. If it was made for the same tables, world size,
+            sharding config, batch size and sharders, its plan is loaded instead of planning again,
+            which keeps the layout of restarts. Otherwise the plan is made and
+            written to it by rank 0.
+        batch_size: Batch size per rank the planner estimates costs for.
+        sharders: Sharders of the modules, torchrec's defaults if not set.
+
+    Returns:
+        The plan, the same on every rank. If distributed is initialized, rank 0
+        loads or makes it and broadcasts it, so that ranks whose plan file is
+        missing, e.g. on another node, get the same plan.
+    """
+    constraints = make_constraints(tables, sharding_types, default_sharding_type)
+    if sharders is None:
+        sharders = get_default_sharders()
+    if not dist.is_initialized():
+        return _load_or_plan(
+            module,
+            tables,
+            world_size,
+            compute_device,
+            constraints,
+            storage_budget,
+            plan_path,
+            batch_size,
+            sharders,
+        )
+    plans: List[Optional[ShardingPlan]] = [None]
+    if dist.get_rank() == 0:
+        plans[0] = _load_or_plan(
+            module,
+            tables,
+            world_size,
+            compute_device,
+            constraints,
+            storage_budget,
+            plan_path,
+            batch_size,
+            sharders,
+        )
+    dist.broadcast_object_list(plans, src=0)
+    return none_throws(plans[0])
+
+
+def _load_or_plan(
+    module: nn.Module,
+    tables: List[EmbeddingBagConfig],
+    world_size: int,
+    compute_device: str,
+    constraints: Dict[str, ParameterConstraints],
+    storage_budget: Optional[int],
+    plan_path: Optional[str],
+    batch_size: Optional[int],
+    sharders: List[ModuleSharder[nn.Module]],
+) -> ShardingPlan:
+    key = plan_key(
+        tables,
+        world_size,
+        compute_device,
+        constraints,
+        storage_budget,
+        batch_size,
+        sharders,
+    )
+    if plan_path is not None:
+        plan = load_plan(plan_path, key)
+        if plan is not None:
+            logger.info(f"Loaded sharding plan from {plan_path}")
+            return plan
+
+    capacity = {}
+    if storage_budget is not None:
+        capacity["hbm_cap" if compute_device == "cuda" else "ddr_cap"] = storage_budget
+    planner = EmbeddingShardingPlanner(
+        topology=Topology(
+            world_size=world_size, compute_device=compute_device, **capacity
+        ),
+        batch_size=batch_size,
+        constraints=constraints,
+    )
+    plan = planner.plan(module, sharders)
+    if plan_path is not None:
+        save_plan(plan_path, key, plan)
+        logger.info(f"Saved sharding plan to {plan_path}")
+    return plan
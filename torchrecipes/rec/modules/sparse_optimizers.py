@@ -0,0 +1,193 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+import torch
+from torchrec.optim.keyed import CombinedOptimizer
+from torchrecipes.rec.modules.embedding_precision import (
+    apply_row_update,
+    stochastic_round,
+)
+
+
+def _rows(grad: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """The indices and gradients of the rows touched by a (sparse) gradient."""
+    if grad.is_sparse:
+        grad = grad.coalesce()
+        return grad.indices()[0], grad.values()
+    return torch.arange(grad.size(0), device=grad.device), grad
+
+
+class _RowWiseOptimizer(torch.optim.Optimizer):
+    def reset_state(self, param: torch.Tensor, rows: torch.Tensor) -> None:
+        """Zeroes the state of ``rows`` of ``param``, e.g. of cache slots loaded
+        with other embeddings."""
+        for value in self.state.get(param, {}).values():
+            if isinstance(value, torch.Tensor):
+                value[rows.to(value.device)] = 0
+
+
+class RowWiseSparseAdagrad(_RowWiseOptimizer):
+    r""":class:`RowWiseSparseAdagrad`.
+
+    Adagrad for embedding tables with sparse gradients, e.g. of
+    ``nn.EmbeddingBag(sparse=True)``. Every row keeps a single accumulator of the
+    mean squared gradient of its elements, so the state is one float per row,
+    and a step only reads and writes the rows of the gradient.
+
+    Args:
+        params: 2D parameters, one row per embedding.
+        lr: Learning rate.
+        eps: Added to the root of the accumulator.
+        state_dtype: Data type of the accumulator. fp16/bf16 accumulators are
+            updated with stochastic rounding.
+    """
+
+    def __init__(
+        self,
+        params: Iterable[torch.Tensor],
+        lr: float = 0.01,
+        eps: float = 1e-8,
+        state_dtype: torch.dtype = torch.float32,
+    ) -> None:
+        if lr <= 0:
+            raise ValueError(f"lr {lr} must be positive")
+        super().__init__(params, {"lr": lr, "eps": eps})
+        self.state_dtype = state_dtype
+
+    @torch.no_grad()
+    def step(
+        self, closure: Optional[Callable[[], torch.Tensor]] = None
+    ) -> Optional[torch.Tensor]:
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if not state:
+                    state["sum"] = torch.zeros(
+                        param.size(0), dtype=self.state_dtype, device=param.device
+                    )
+                rows, grad = _rows(param.grad)
+                grad = grad.float()
+                state_sum = state["sum"][rows].float().add_(grad.pow(2).mean(dim=1))
+                state["sum"][rows] = stochastic_round(state_sum, self.state_dtype)
+                std = state_sum.sqrt_().add_(group["eps"])
+                update = grad / std.unsqueeze(1) * -group["lr"]
+                apply_row_update(param, rows, update)
+        return loss
+
+
+class RowWiseSparseAdam(_RowWiseOptimizer):
+    r""":class:`RowWiseSparseAdam`.
+
+    Partially row-wise Adam for embedding tables with sparse gradients: the first
+    moment is kept per element, the second one per row as the mean over its
+    elements, which halves the state of Adam. Like ``torch.optim.SparseAdam``,
+    a step only updates the moments and values of the rows of the gradient.
+
+    Args:
+        params: 2D parameters, one row per embedding.
+        lr: Learning rate.
+        betas: Decay rates of the first and second moments.
+        eps: Added to the root of the second moment.
+        state_dtype: Data type of the moments. fp16/bf16 moments are updated
+            with stochastic rounding.
+    """
+
+    def __init__(
+        self,
+        params: Iterable[torch.Tensor],
+        lr: float = 0.001,
+        betas: Tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+        state_dtype: torch.dtype = torch.float32,
+    ) -> None:
+        if lr <= 0:
+            raise ValueError(f"lr {lr} must be positive")
+        if not all(0 <= beta < 1 for beta in betas):
+            raise ValueError(f"betas {betas} must be in [0, 1)")
+        super().__init__(params, {"lr": lr, "betas": betas, "eps": eps})
+        self.state_dtype = state_dtype
+
+    @torch.no_grad()
+    def step(
+        self, closure: Optional[Callable[[], torch.Tensor]] = None
+    ) -> Optional[torch.Tensor]:
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if not state:
+                    state["step"] = 0
+                    # not zeros_like, the placeholder of an int8 table has
+                    # stride 0
+                    state["exp_avg"] = torch.zeros(
+                        param.shape, dtype=self.state_dtype, device=param.device
+                    )
+                    state["exp_avg_sq"] = torch.zeros(
+                        param.size(0), dtype=self.state_dtype, device=param.device
+                    )
+                state["step"] += 1
+                rows, grad = _rows(param.grad)
+                grad = grad.float()
+                exp_avg = (
+                    state["exp_avg"][rows]
+                    .float()
+                    .mul_(beta1)
+                    .add_(grad, alpha=1 - beta1)
+                )
+                exp_avg_sq = (
+                    state["exp_avg_sq"][rows]
+                    .float()
+                    .mul_(beta2)
+                    .add_(grad.pow(2).mean(dim=1), alpha=1 - beta2)
+                )
+                state["exp_avg"][rows] = stochastic_round(exp_avg, self.state_dtype)
+                state["exp_avg_sq"][rows] = stochastic_round(
+                    exp_avg_sq, self.state_dtype
+                )
+                step = state["step"]
+                bias_correction1 = 1 - beta1**step
+                bias_correction2 = 1 - beta2**step
+                denom = (exp_avg_sq / bias_correction2).sqrt_().add_(group["eps"])
+                update = (
+                    exp_avg / denom.unsqueeze(1) * (-group["lr"] / bias_correction1)
+                )
+                apply_row_update(param, rows, update)
+        return loss
+
+
+class SingleClosureCombinedOptimizer(CombinedOptimizer):
+    r""":class:`SingleClosureCombinedOptimizer`.
+
+    ``CombinedOptimizer`` evaluating the closure of a step once, rather than once
+    per combined optimizer, as Lightning's automatic optimization passes the
+    forward and backward pass as the closure.
+    """
+
+    # pyre-ignore[14]: `step` overrides method defined in `CombinedOptimizer`
+    def step(self, closure: Any = None) -> Any:  # pyre-ignore[2, 3]
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for _, optimizer in self.optimizers:
+            optimizer.step()
+        return loss
@@ -0,0 +1,154 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torchrecipes.rec.modules.embedding_cache import (
+    CachedEmbeddingBag,
+    MmapEmbeddingTable,
+)
+
+
+def _batches(num_batches: int, num_embeddings: int):  # pyre-ignore[3]
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(num_batches):
+        # skewed ids, so that some rows stay hot
+        ids = (torch.rand(12, generator=generator).pow(3) * num_embeddings).long()
+        yield ids, torch.tensor([0, 3, 7, 12])
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_mmap_table(self) -> None:
+        path = os.path.join(tempfile.mkdtemp(), "t1.f32")
+        table = MmapEmbeddingTable(path, 10, 4, init_min=-0.5, init_max=0.5)
+        rows = table.read(np.arange(10))
+        self.assertTrue(np.all(np.abs(rows) <= 0.5))
+        table.write(np.array([2]), np.ones((1, 4), dtype=np.float32))
+        table.flush()
+        # reopened rather than recreated
+        reopened = MmapEmbeddingTable(path, 10, 4, resume=True)
+        self.assertTrue(np.array_equal(reopened.read(np.array([2])), np.ones((1, 4))))
+        self.assertTrue(np.array_equal(reopened.read(np.array([0, 1])), rows[[0, 1]]))
+        # a new table never starts from the trained rows
+        recreated = MmapEmbeddingTable(path, 10, 4, init_min=-0.5, init_max=0.5)
+        self.assertTrue(np.array_equal(recreated.read(np.arange(10)), rows))
+        with self.assertRaises(ValueError):
+            MmapEmbeddingTable(path, 20, 4, resume=True)
+        with self.assertRaises(FileNotFoundError):
+            MmapEmbeddingTable(f"{path}.missing", 10, 4, resume=True)
+
+        weight = torch.rand(10, 4)
+        copied = MmapEmbeddingTable(
+            os.path.join(tempfile.mkdtemp(), "t2.f32"), 10, 4, initial_weight=weight
+        )
+        self.assertTrue(np.array_equal(copied.read(np.arange(10)), weight.numpy()))
+
+    def test_matches_embedding_bag(self) -> None:
+        num_embeddings = 50
+        for policy in ("lru", "lfu"):
+            embedding_bag = nn.EmbeddingBag(
+                num_embeddings, 4, mode="sum", sparse=True, include_last_offset=True
+            )
+            table = MmapEmbeddingTable(
+                os.path.join(tempfile.mkdtemp(), "t.f32"),
+                num_embeddings,
+                4,
+                initial_weight=embedding_bag.weight,
+            )
+            cached = CachedEmbeddingBag(table, 16, policy=policy)
+            optimizer = torch.optim.SGD(embedding_bag.parameters(), lr=0.1)
+            cached_optimizer = torch.optim.SGD(cached.parameters(), lr=0.1)
+            for ids, offsets in _batches(20, num_embeddings):
+                cached.begin_batch()
+                expected = embedding_bag(ids, offsets)
+                actual = cached(ids, offsets)
+                self.assertTrue(torch.allclose(actual, expected))
+                for opt, output in ((optimizer, expected), (cached_optimizer, actual)):
+                    opt.zero_grad()
+                    output.pow(2).sum().backward()
+                    opt.step()
+            stats = cached.stats()
+            self.assertEqual(stats["hits"] + stats["misses"], 20 * 12)
+            self.assertGreater(stats["hits"], 0)
+            self.assertGreater(stats["evictions"], 0)
+            # the trained rows are written back
+            cached.flush()
+            self.assertTrue(
+                np.allclose(
+                    table.read(np.arange(num_embeddings)),
+                    embedding_bag.weight.detach().numpy(),
+                    atol=1e-6,
+                )
+            )
+
+    def test_prefetch(self) -> None:
+        table = MmapEmbeddingTable(os.path.join(tempfile.mkdtemp(), "t.f32"), 100, 2)
+        cached = CachedEmbeddingBag(table, 8)
+        refilled = []
+        cached.refill_hooks.append(lambda slots: refilled.extend(slots.tolist()))
+        ids = torch.tensor([5, 7, 5, 90])
+        cached.prefetch(ids)
+        # installed by the next lookup, not by the prefetching thread
+        self.assertEqual(refilled, [])
+        cached.begin_batch()
+        cached(ids, torch.tensor([0, 2, 4]))
+        self.assertEqual(len(refilled), 3)
+        self.assertEqual(
+            cached.stats(reset=True),
+            {"hits": 4, "misses": 0, "evictions": 0, "prefetched": 3},
+        )
+        self.assertEqual(cached.stats()["hits"], 0)
+
+        # the slots of the current batch are not evicted
+        cached.prefetch(torch.arange(10, 20))
+        with self.assertRaises(ValueError):
+            cached(torch.arange(30, 40), torch.tensor([0, 10]))
+        self.assertEqual(cached.stats()["prefetched"], 5)
+
+    def test_state_dict(self) -> None:
+        num_embeddings = 50
+        cache_dir = tempfile.mkdtemp()
+        table = MmapEmbeddingTable(os.path.join(cache_dir, "t.f32"), num_embeddings, 4)
+        # no evictions, the trained rows are only held by the cache
+        cached = CachedEmbeddingBag(table, num_embeddings)
+        optimizer = torch.optim.SGD(cached.parameters(), lr=0.1)
+        for ids, offsets in _batches(5, num_embeddings):
+            cached.begin_batch()
+            optimizer.zero_grad()
+            cached(ids, offsets).pow(2).sum().backward()
+            optimizer.step()
+        state_dict = cached.state_dict()
+        self.assertEqual(sorted(state_dict), ["slot_rows", "weight"])
+        ids, offsets = next(_batches(1, num_embeddings))
+        with torch.no_grad():
+            expected = cached(ids, offsets)
+
+        # a cache restored from the checkpoint maps its slots to the same rows,
+        # over a table file without the trained rows
+        other = MmapEmbeddingTable(
+            os.path.join(cache_dir, "other.f32"), num_embeddings, 4
+        )
+        restored = CachedEmbeddingBag(other, num_embeddings)
+        restored.load_state_dict(state_dict)
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(restored(ids, offsets), expected))
+        restored.flush()
+        rows = state_dict["slot_rows"].numpy()
+        rows = np.sort(rows[rows >= 0])
+        cached.flush()
+        self.assertTrue(np.allclose(other.read(rows), table.read(rows)))
+
+        with self.assertRaises(RuntimeError):
+            CachedEmbeddingBag(other, num_embeddings).load_state_dict(
+                {"weight": state_dict["weight"]}
+            )
@@ -0,0 +1,145 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import unittest
+
+import torch
+import torch.nn as nn
+from torchrec import EmbeddingBagCollection, KeyedJaggedTensor
+from torchrec.modules.embedding_configs import EmbeddingBagConfig
+from torchrecipes.rec.modules.embedding_precision import (
+    apply_row_update,
+    dequantize_rows,
+    embedding_storage_bytes,
+    Int8EmbeddingBag,
+    quantize_rows,
+    set_embedding_precision,
+    stochastic_round,
+)
+from torchrecipes.rec.modules.sparse_optimizers import RowWiseSparseAdam
+
+
+class TestEmbeddingPrecision(unittest.TestCase):
+    def test_stochastic_round(self) -> None:
+        torch.manual_seed(0)
+        x = torch.full((100000,), 1.0001)
+        for dtype in (torch.float16, torch.bfloat16):
+            # round to nearest loses the offset, stochastic rounding keeps it in
+            # expectation
+            self.assertEqual(x.to(dtype).float().mean().item(), 1.0)
+            rounded = stochastic_round(x, dtype)
+            self.assertEqual(rounded.dtype, dtype)
+            self.assertAlmostEqual(rounded.float().mean().item(), 1.0001, places=4)
+        exact = torch.tensor([0.5, -2.0, 0.0])
+        self.assertTrue(
+            torch.equal(stochastic_round(exact, torch.float16).float(), exact)
+        )
+
+    def test_quantize_rows(self) -> None:
+        weight = torch.randn(20, 8)
+        weight[3] = 0.25
+        codes, scale_bias = quantize_rows(weight)
+        self.assertEqual(codes.dtype, torch.uint8)
+        self.assertEqual(scale_bias.shape, (20, 2))
+        error = (dequantize_rows(codes, scale_bias) - weight).abs()
+        # at most half a step of the row
+        self.assertTrue(torch.all(error <= scale_bias[:, :1] / 2 + 1e-6))
+        self.assertTrue(torch.equal(dequantize_rows(codes, scale_bias)[3], weight[3]))
+
+    def test_int8_embedding_bag(self) -> None:
+        torch.manual_seed(0)
+        embedding_bag = nn.EmbeddingBag(
+            10, 4, mode="mean", sparse=True, include_last_offset=True
+        )
+        int8_bag = Int8EmbeddingBag(
+            10, 4, mode="mean", initial_weight=embedding_bag.weight
+        )
+        embedding_bag.weight.data = int8_bag.dequantize()
+        ids, offsets = torch.tensor([1, 3, 3, 7]), torch.tensor([0, 2, 4])
+        outputs = []
+        for bag in (embedding_bag, int8_bag):
+            output = bag(ids, offsets)
+            output.pow(2).sum().backward()
+            outputs.append(output)
+        self.assertTrue(torch.allclose(outputs[0], outputs[1]))
+        self.assertTrue(int8_bag.weight.grad.is_sparse)
+        self.assertTrue(
+            torch.allclose(
+                int8_bag.weight.grad.to_dense(), embedding_bag.weight.grad.to_dense()
+            )
+        )
+        # the placeholder takes no memory, and is not saved
+        self.assertEqual(int8_bag.weight.stride(), (0, 0))
+        state_dict = int8_bag.state_dict()
+        self.assertEqual(set(state_dict), {"codes", "scale_bias"})
+        loaded = Int8EmbeddingBag(10, 4)
+        loaded.load_state_dict(state_dict)
+        self.assertTrue(torch.equal(loaded.dequantize(), int8_bag.dequantize()))
+
+    def test_apply_row_update(self) -> None:
+        torch.manual_seed(0)
+        rows = torch.tensor([0, 2])
+        update = torch.full((2, 64), 1e-4)
+        param = torch.ones(3, 64, dtype=torch.bfloat16)
+        int8_bag = Int8EmbeddingBag(3, 64, init_min=0.5, init_max=1.5)
+        initial = int8_bag.dequantize()
+        for _ in range(100):
+            apply_row_update(param, rows, update)
+            apply_row_update(int8_bag.weight, rows, update)
+        # 100 updates far below the resolution of the rows still add up
+        self.assertAlmostEqual(param[rows].float().mean().item(), 1.01, places=2)
+        self.assertTrue(torch.equal(param[1], torch.ones(64, dtype=torch.bfloat16)))
+        moved = (int8_bag.dequantize() - initial).mean(dim=1)
+        self.assertAlmostEqual(moved[0].item(), 0.01, places=2)
+        self.assertEqual(moved[1].item(), 0.0)
+
+    def test_set_embedding_precision(self) -> None:
+        features = KeyedJaggedTensor.from_lengths_sync(
+            keys=["f1", "f2"],
+            values=torch.tensor([1, 2, 3, 4]),
+            lengths=torch.tensor([2, 1, 0, 1]),
+        )
+        expected_bytes = {
+            "fp32": 100 * 8 * 4,
+            "fp16": 100 * 8 * 2,
+            "bf16": 100 * 8 * 2,
+            "int8": 100 * 8 + 100 * 8,
+        }
+        for data_type, nbytes in expected_bytes.items():
+            ebc = EmbeddingBagCollection(
+                tables=[
+                    EmbeddingBagConfig(
+                        name="t1",
+                        embedding_dim=8,
+                        num_embeddings=100,
+                        feature_names=["f1", "f2"],
+                    )
+                ],
+                device=torch.device("meta"),
+            )
+            set_embedding_precision(ebc, data_type)
+            self.assertEqual(embedding_storage_bytes(ebc), nbytes)
+            if data_type == "int8":
+                embedding_bag = ebc.embedding_bags["t1"]
+                self.assertIsInstance(embedding_bag, Int8EmbeddingBag)
+                # torchrec's default initialization
+                self.assertTrue(torch.all(embedding_bag.dequantize().abs() <= 0.1001))
+                optimizer = RowWiseSparseAdam(
+                    ebc.parameters(), lr=0.1, state_dtype=torch.bfloat16
+                )
+                initial = embedding_bag.dequantize()
+                ebc(features).values().sum().backward()
+                optimizer.step()
+                changed = (embedding_bag.dequantize() != initial).any(dim=1)
+                self.assertEqual(changed.nonzero().flatten().tolist(), [1, 2, 3, 4])
+                self.assertEqual(
+                    optimizer.state[embedding_bag.weight]["exp_avg"].dtype,
+                    torch.bfloat16,
+                )
+        with self.assertRaises(ValueError):
+            set_embedding_precision(ebc, "int4")
@@ -0,0 +1,66 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import math
+import unittest
+
+import torch
+import torch.nn.functional as F
+import torchmetrics as metrics
+from torchrecipes.rec.modules.metrics import BinnedCTRMetrics
+
+
+class TestBinnedCTRMetrics(unittest.TestCase):
+    def test_matches_exact(self) -> None:
+        num_bins = 100
+        generator = torch.Generator().manual_seed(0)
+        # bin centers, so that binning loses nothing
+        preds = (torch.randint(0, num_bins, (1000,), generator=generator) + 0.5) / (
+            num_bins
+        )
+        labels = (torch.rand(1000, generator=generator) < preds).long()
+
+        metric = BinnedCTRMetrics(num_bins)
+        for i in range(0, 1000, 100):
+            metric.update(preds[i : i + 100], labels[i : i + 100])
+        values = metric.compute()
+
+        auroc = metrics.functional.auroc(preds, labels)
+        self.assertAlmostEqual(values["auroc"].item(), auroc.item(), places=5)
+        rate = labels.float().mean().item()
+        entropy = -(rate * math.log(rate) + (1 - rate) * math.log(1 - rate))
+        ne = F.binary_cross_entropy(preds, labels.float()).item() / entropy
+        self.assertAlmostEqual(values["ne"].item(), ne, places=5)
+        self.assertAlmostEqual(
+            values["calibration"].item(),
+            preds.sum().item() / labels.sum().item(),
+            places=5,
+        )
+
+        metric.reset()
+        self.assertEqual(metric.histogram.sum().item(), 0)
+
+    def test_weights(self) -> None:
+        preds = torch.tensor([0.1, 0.4, 0.35, 0.8])
+        labels = torch.tensor([0, 0, 1, 1])
+        weighted = BinnedCTRMetrics(10)
+        weighted.update(preds, labels, torch.tensor([1.0, 2.0, 1.0, 1.0]))
+        # a weight of 2 counts like a repeated row
+        repeated = BinnedCTRMetrics(10)
+        repeated.update(
+            torch.tensor([0.1, 0.4, 0.4, 0.35, 0.8]), torch.tensor([0, 0, 0, 1, 1])
+        )
+        for name, value in repeated.compute().items():
+            self.assertAlmostEqual(
+                weighted.compute()[name].item(), value.item(), places=5
+            )
+
+    def test_single_label(self) -> None:
+        metric = BinnedCTRMetrics(10)
+        metric.update(torch.tensor([0.2, 0.7]), torch.tensor([1, 1]))
+        self.assertTrue(torch.isnan(metric.compute()["auroc"]))
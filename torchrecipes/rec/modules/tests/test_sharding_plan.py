@@ -0,0 +1,206 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+import uuid
+from typing import List
+from unittest.mock import patch
+
+import torch
+import torch.distributed as dist
+from torch.distributed.launcher.api import elastic_launch, LaunchConfig
+from torchrec import EmbeddingBagCollection
+from torchrec.distributed.model_parallel import get_default_sharders
+from torchrec.distributed.planner.types import PlannerError
+from torchrec.models.dlrm import DLRM
+from torchrec.modules.embedding_configs import EmbeddingBagConfig
+from torchrecipes.rec.modules import sharding_plan
+from torchrecipes.rec.modules.sharding_plan import (
+    load_or_create_plan,
+    make_constraints,
+    parse_sharding_types,
+    plan_key,
+)
+
+
+def _tables(num_embeddings: int = 1000) -> List[EmbeddingBagConfig]:
+    return [
+        EmbeddingBagConfig(
+            name=f"t{i}",
+            embedding_dim=8,
+            num_embeddings=num_embeddings,
+            feature_names=[f"f{i}"],
+        )
+        for i in range(3)
+    ]
+
+
+def _model(tables: List[EmbeddingBagConfig]) -> DLRM:
+    return DLRM(
+        embedding_bag_collection=EmbeddingBagCollection(
+            tables=tables, device=torch.device("meta")
+        ),
+        dense_in_features=4,
+        dense_arch_layer_sizes=[8],
+        over_arch_layer_sizes=[2, 1],
+        dense_device=torch.device("meta"),
+    )
+
+
+def _broadcast_plan(plan_path: str) -> str:
+    dist.init_process_group("gloo")
+    rank = dist.get_rank()
+    tables = _tables()
+    # only rank 0 sees the plan file, so the other rank would plan on its own
+    with patch.object(
+        sharding_plan, "EmbeddingShardingPlanner", side_effect=AssertionError
+    ):
+        plan = load_or_create_plan(
+            _model(tables),
+            tables,
+            world_size=2,
+            compute_device="cpu",
+            default_sharding_type="column_wise",
+            plan_path=plan_path if rank == 0 else f"{plan_path}.missing{rank}",
+        )
+    dist.destroy_process_group()
+    return str(plan)
+
+
+class TestShardingPlan(unittest.TestCase):
+    def test_constraints(self) -> None:
+        self.assertEqual(
+            parse_sharding_types("t0:row_wise, t1:column_wise"),
+            {"t0": "row_wise", "t1": "column_wise"},
+        )
+        constraints = make_constraints(_tables(), {"t0": "row_wise"}, "table_wise")
+        self.assertEqual(constraints["t0"].sharding_types, ["row_wise"])
+        self.assertEqual(constraints["t2"].sharding_types, ["table_wise"])
+        self.assertEqual(make_constraints(_tables()), {})
+        with self.assertRaises(ValueError):
+            parse_sharding_types("t0")
+        with self.assertRaises(ValueError):
+            make_constraints(_tables(), {"t9": "row_wise"})
+        with self.assertRaises(ValueError):
+            make_constraints(_tables(), default_sharding_type="grid")
+
+    def test_plan_file(self) -> None:
+        tables = _tables()
+        path = os.path.join(tempfile.mkdtemp(), "plans", "dlrm.plan")
+        kwargs = {
+            "world_size": 2,
+            "compute_device": "cpu",
+            "sharding_types": {"t1": "column_wise"},
+            "default_sharding_type": "table_wise",
+            "plan_path": path,
+        }
+        plan = load_or_create_plan(_model(tables), tables, **kwargs)
+        shardings = plan.get_plan_for_module("sparse_arch.embedding_bag_collection")
+        self.assertEqual(shardings["t0"].sharding_type, "table_wise")
+        self.assertEqual(shardings["t1"].sharding_type, "column_wise")
+        self.assertTrue(os.path.exists(path))
+
+        # loaded without planning
+        with patch.object(
+            sharding_plan, "EmbeddingShardingPlanner", side_effect=AssertionError
+        ):
+            loaded = load_or_create_plan(_model(tables), tables, **kwargs)
+        self.assertEqual(str(loaded), str(plan))
+
+        # another config is planned again and overwrites the file
+        kwargs["sharding_types"] = {}
+        replanned = load_or_create_plan(_model(tables), tables, **kwargs)
+        shardings = replanned.get_plan_for_module(
+            "sparse_arch.embedding_bag_collection"
+        )
+        self.assertEqual(shardings["t1"].sharding_type, "table_wise")
+        self.assertEqual(
+            str(load_or_create_plan(_model(tables), tables, **kwargs)),
+            str(replanned),
+        )
+
+    def test_plan_key(self) -> None:
+        tables = _tables()
+        constraints = make_constraints(tables, default_sharding_type="table_wise")
+        key = plan_key(tables, 2, "cpu", constraints, batch_size=512)
+        self.assertEqual(key, plan_key(tables, 2, "cpu", constraints, batch_size=512))
+        self.assertNotEqual(
+            key, plan_key(tables, 2, "cpu", constraints, batch_size=1024)
+        )
+        self.assertNotEqual(
+            key,
+            plan_key(
+                tables,
+                2,
+                "cpu",
+                constraints,
+                batch_size=512,
+                sharders=get_default_sharders(),
+            ),
+        )
+
+        # a plan file of another batch size is planned again
+        path = os.path.join(tempfile.mkdtemp(), "dlrm.plan")
+        kwargs = {"world_size": 2, "compute_device": "cpu", "plan_path": path}
+        load_or_create_plan(_model(tables), tables, batch_size=512, **kwargs)
+        with patch.object(
+            sharding_plan, "EmbeddingShardingPlanner", side_effect=AssertionError
+        ):
+            load_or_create_plan(_model(tables), tables, batch_size=512, **kwargs)
+            with self.assertRaises(AssertionError):
+                load_or_create_plan(_model(tables), tables, batch_size=1024, **kwargs)
+
+    def test_broadcast_plan(self) -> None:
+        tables = _tables()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dlrm.plan")
+            plan = load_or_create_plan(
+                _model(tables),
+                tables,
+                world_size=2,
+                compute_device="cpu",
+                default_sharding_type="column_wise",
+                plan_path=path,
+            )
+            lc = LaunchConfig(
+                min_nodes=1,
+                max_nodes=1,
+                nproc_per_node=2,
+                run_id=str(uuid.uuid4()),
+                rdzv_backend="c10d",
+                rdzv_endpoint=os.path.join(tmpdir, "rdzv"),
+                rdzv_configs={"store_type": "file"},
+                start_method="spawn",
+                monitor_interval=1,
+                max_restarts=0,
+            )
+            results = elastic_launch(config=lc, entrypoint=_broadcast_plan)(path)
+        # both ranks use the plan file of rank 0
+        self.assertEqual(results[0], str(plan))
+        self.assertEqual(results[1], str(plan))
+
+    def test_storage_budget(self) -> None:
+        tables = _tables(num_embeddings=100_000)
+        # 3.2MB per table
+        load_or_create_plan(
+            _model(tables),
+            tables,
+            world_size=2,
+            compute_device="cpu",
+            storage_budget=64 << 20,
+        )
+        with self.assertRaises(PlannerError):
+            load_or_create_plan(
+                _model(tables),
+                tables,
+                world_size=2,
+                compute_device="cpu",
+                storage_budget=1 << 20,
+            )
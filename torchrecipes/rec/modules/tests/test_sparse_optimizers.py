@@ -0,0 +1,72 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+#!/usr/bin/env python3
+
+import unittest
+
+import torch
+import torch.nn as nn
+from torchrecipes.rec.modules.sparse_optimizers import (
+    RowWiseSparseAdagrad,
+    RowWiseSparseAdam,
+)
+
+
+def _step(
+    optimizer_class: type, sparse: bool, num_steps: int = 3
+) -> torch.Tensor:  # pyre-ignore[2]
+    torch.manual_seed(0)
+    embedding_bag = nn.EmbeddingBag(10, 4, mode="sum", sparse=sparse)
+    optimizer = optimizer_class(embedding_bag.parameters(), lr=0.1)
+    for _ in range(num_steps):
+        optimizer.zero_grad()
+        embedding_bag(torch.tensor([1, 3, 3, 7]), torch.tensor([0, 2])).pow(
+            2
+        ).sum().backward()
+        optimizer.step()
+    return embedding_bag.weight.detach()
+
+
+class TestSparseOptimizers(unittest.TestCase):
+    def test_rowwise_adagrad(self) -> None:
+        torch.manual_seed(0)
+        weight = nn.EmbeddingBag(10, 4, mode="sum").weight.detach().clone()
+        updated = _step(RowWiseSparseAdagrad, sparse=True, num_steps=1)
+        # rows not looked up are untouched
+        untouched = [0, 2, 4, 5, 6, 8, 9]
+        self.assertTrue(torch.equal(updated[untouched], weight[untouched]))
+        # the first step of row-wise Adagrad moves every element of a row by lr
+        # times its gradient over the root of the mean squared gradient
+        grad = torch.zeros_like(weight)
+        bags = weight[[1, 3]].sum(0), weight[[3, 7]].sum(0)
+        grad[1] += 2 * bags[0]
+        grad[3] += 2 * bags[0] + 2 * bags[1]
+        grad[7] += 2 * bags[1]
+        for row in (1, 3, 7):
+            expected = weight[row] - 0.1 * grad[row] / (
+                grad[row].pow(2).mean().sqrt() + 1e-8
+            )
+            self.assertTrue(torch.allclose(updated[row], expected, atol=1e-6))
+
+    def test_sparse_matches_dense(self) -> None:
+        for optimizer_class in (RowWiseSparseAdagrad, RowWiseSparseAdam):
+            self.assertTrue(
+                torch.allclose(
+                    _step(optimizer_class, sparse=True),
+                    _step(optimizer_class, sparse=False),
+                    atol=1e-6,
+                )
+            )
+
+    def test_state_size(self) -> None:
+        embedding_bag = nn.EmbeddingBag(10, 4, sparse=True)
+        optimizer = RowWiseSparseAdam(embedding_bag.parameters())
+        embedding_bag(torch.tensor([1]), torch.tensor([0])).sum().backward()
+        optimizer.step()
+        state = optimizer.state[embedding_bag.weight]
+        self.assertEqual(state["exp_avg"].size(), (10, 4))
+        self.assertEqual(state["exp_avg_sq"].size(), (10,))
@@ -6,11 +6,16 @@
 
 #!/usr/bin/env python3
 
+import os
+import tempfile
 import unittest
 
 import pytorch_lightning as pl
-from torchrec import EmbeddingBagCollection
+import torch
+import torch.nn.functional as F
+from torchrec import EmbeddingBagCollection, KeyedJaggedTensor
 from torchrec.modules.embedding_configs import EmbeddingBagConfig
+from torchrecipes.rec.datamodules.commons import WeightedBatch
 from torchrecipes.rec.datamodules.random_rec_datamodule import RandomRecDataModule
 from torchrecipes.rec.modules.unsharded_lightning_dlrm import UnshardedLightningDLRM
 
@@ -58,4 +63,248 @@ class TestUnshardedLightningDLRM(unittest.TestCase):
             sparse_features=batch.sparse_features,
         )
         trainer.fit(model, datamodule=datamodule)
+        for name in ("train_auroc", "val_ne", "val_calibration"):
+            self.assertIn(name, trainer.callback_metrics)
         trainer.test(model, datamodule=datamodule)
+        self.assertIn("test_auroc", trainer.callback_metrics)
+
+    def test_train_model_device_prefetch(self) -> None:
+        embedding_dim = 10
+        num_dense = 50
+        ebc = EmbeddingBagCollection(
+            tables=[
+                EmbeddingBagConfig(
+                    name="t1",
+                    embedding_dim=embedding_dim,
+                    num_embeddings=100,
+                    feature_names=["f1", "f2", "f3"],
+                )
+            ]
+        )
+        model = UnshardedLightningDLRM(
+            ebc,
+            dense_in_features=num_dense,
+            dense_arch_layer_sizes=[20, embedding_dim],
+            over_arch_layer_sizes=[5, 1],
+        )
+        datamodule = RandomRecDataModule(num_dense=num_dense, device_prefetch_depth=2)
+        trainer = pl.Trainer(
+            max_epochs=1,
+            enable_checkpointing=False,
+            limit_train_batches=10,
+            limit_val_batches=10,
+            logger=False,
+        )
+        trainer.fit(model, datamodule=datamodule)
+
+    def test_embedding_optimizer(self) -> None:
+        # an unlucky initialization passes no gradient to the embeddings
+        torch.manual_seed(0)
+        embedding_dim = 4
+        num_dense = 5
+        ebc = EmbeddingBagCollection(
+            tables=[
+                EmbeddingBagConfig(
+                    name="t1",
+                    embedding_dim=embedding_dim,
+                    num_embeddings=100,
+                    feature_names=["f1", "f2", "f3"],
+                )
+            ]
+        )
+        weight = ebc.embedding_bags["t1"].weight
+        initial = weight.detach().clone()
+        model = UnshardedLightningDLRM(
+            ebc,
+            dense_in_features=num_dense,
+            dense_arch_layer_sizes=[embedding_dim],
+            over_arch_layer_sizes=[2, 1],
+            embedding_optimizer="rowwise_adagrad",
+            embedding_lr=0.1,
+        )
+        datamodule = RandomRecDataModule(
+            num_dense=num_dense,
+            hash_size=100,
+            batch_size=2,
+            ids_per_feature=1,
+            manual_seed=0,
+        )
+        trainer = pl.Trainer(
+            max_epochs=1,
+            enable_checkpointing=False,
+            limit_train_batches=1,
+            limit_val_batches=0,
+            logger=False,
+        )
+        trainer.fit(model, datamodule=datamodule)
+        # one step of at most 6 ids updates at most 6 rows
+        changed = (weight.detach() != initial).any(dim=1).sum().item()
+        self.assertGreater(changed, 0)
+        self.assertLessEqual(changed, 6)
+
+        with self.assertRaises(ValueError):
+            UnshardedLightningDLRM(
+                ebc,
+                dense_in_features=num_dense,
+                dense_arch_layer_sizes=[embedding_dim],
+                over_arch_layer_sizes=[2, 1],
+                embedding_optimizer="sgd",
+            )
+
+    def test_embedding_cache(self) -> None:
+        embedding_dim = 4
+        num_dense = 5
+        ebc = EmbeddingBagCollection(
+            tables=[
+                EmbeddingBagConfig(
+                    name="t1",
+                    embedding_dim=embedding_dim,
+                    num_embeddings=1000,
+                    feature_names=["f1", "f3"],
+                ),
+                EmbeddingBagConfig(
+                    name="t2",
+                    embedding_dim=embedding_dim,
+                    num_embeddings=1000,
+                    feature_names=["f2"],
+                ),
+            ],
+            device=torch.device("meta"),
+        )
+        cache_dir = tempfile.mkdtemp()
+        model = UnshardedLightningDLRM(
+            ebc,
+            dense_in_features=num_dense,
+            dense_arch_layer_sizes=[embedding_dim],
+            over_arch_layer_sizes=[2, 1],
+            embedding_optimizer="rowwise_adam",
+            embedding_cache_dir=cache_dir,
+            embedding_cache_rows=64,
+            embedding_cache_policy="lfu",
+        )
+        datamodule = RandomRecDataModule(
+            num_dense=num_dense,
+            hash_size=1000,
+            batch_size=4,
+            device_prefetch_depth=2,
+        )
+        trainer = pl.Trainer(
+            max_epochs=1,
+            enable_checkpointing=False,
+            limit_train_batches=20,
+            limit_val_batches=5,
+            logger=False,
+        )
+        trainer.fit(model, datamodule=datamodule)
+        self.assertEqual(sorted(os.listdir(cache_dir)), ["t1.f32", "t2.f32"])
+        # lookups hit the rows prefetched in the background
+        self.assertGreater(
+            trainer.callback_metrics["train_embedding_cache_hit_rate"], 0.5
+        )
+        self.assertIn("train_embedding_cache_evictions", trainer.callback_metrics)
+
+        with self.assertRaises(ValueError):
+            UnshardedLightningDLRM(
+                ebc,
+                dense_in_features=num_dense,
+                dense_arch_layer_sizes=[embedding_dim],
+                over_arch_layer_sizes=[2, 1],
+                embedding_cache_dir=cache_dir,
+            )
+
+    def test_embedding_data_type(self) -> None:
+        embedding_dim = 4
+        num_dense = 5
+        for data_type in ("bf16", "int8"):
+            torch.manual_seed(0)
+            ebc = EmbeddingBagCollection(
+                tables=[
+                    EmbeddingBagConfig(
+                        name="t1",
+                        embedding_dim=embedding_dim,
+                        num_embeddings=100,
+                        feature_names=["f1", "f2", "f3"],
+                    )
+                ]
+            )
+            model = UnshardedLightningDLRM(
+                ebc,
+                dense_in_features=num_dense,
+                dense_arch_layer_sizes=[embedding_dim],
+                over_arch_layer_sizes=[2, 1],
+                embedding_optimizer="rowwise_adam",
+                embedding_data_type=data_type,
+                embedding_state_data_type="fp16",
+            )
+            embedding_bag = ebc.embedding_bags["t1"]
+            if data_type == "int8":
+                initial = embedding_bag.dequantize()
+            else:
+                self.assertEqual(embedding_bag.weight.dtype, torch.bfloat16)
+                initial = embedding_bag.weight.detach().clone()
+            datamodule = RandomRecDataModule(
+                num_dense=num_dense, hash_size=100, batch_size=4, manual_seed=0
+            )
+            trainer = pl.Trainer(
+                max_epochs=1,
+                enable_checkpointing=False,
+                limit_train_batches=5,
+                limit_val_batches=2,
+                logger=False,
+            )
+            trainer.fit(model, datamodule=datamodule)
+            trained = (
+                embedding_bag.dequantize()
+                if data_type == "int8"
+                else embedding_bag.weight.detach()
+            )
+            self.assertFalse(torch.equal(trained, initial))
+            self.assertIn("val_auroc", trainer.callback_metrics)
+
+        with self.assertRaises(ValueError):
+            UnshardedLightningDLRM(
+                ebc,
+                dense_in_features=num_dense,
+                dense_arch_layer_sizes=[embedding_dim],
+                over_arch_layer_sizes=[2, 1],
+                embedding_data_type="int8",
+            )
+
+    def test_sample_weights(self) -> None:
+        embedding_dim = 4
+        num_dense = 3
+        ebc = EmbeddingBagCollection(
+            tables=[
+                EmbeddingBagConfig(
+                    name="t1",
+                    embedding_dim=embedding_dim,
+                    num_embeddings=10,
+                    feature_names=["f1"],
+                )
+            ]
+        )
+        model = UnshardedLightningDLRM(
+            ebc,
+            dense_in_features=num_dense,
+            dense_arch_layer_sizes=[embedding_dim],
+            over_arch_layer_sizes=[2, 1],
+            use_sample_weights=True,
+        )
+        batch = WeightedBatch(
+            dense_features=torch.rand(4, num_dense),
+            sparse_features=KeyedJaggedTensor.from_lengths_sync(
+                ["f1"], torch.tensor([1, 2, 3, 4]), torch.ones(4, dtype=torch.int32)
+            ),
+            labels=torch.tensor([0, 1, 0, 1]),
+            weights=torch.tensor([4.0, 1.0, 4.0, 1.0]),
+        )
+        logits = model(batch.dense_features, batch.sparse_features)
+        losses = F.binary_cross_entropy_with_logits(
+            logits, batch.labels.float(), reduction="none"
+        )
+        expected = (losses * batch.weights).sum() / batch.weights.sum()
+        self.assertTrue(torch.allclose(model.training_step(batch, 0), expected))
+
+        # plain batches and disabled weights use the unweighted mean
+        model.use_sample_weights = False
+        self.assertTrue(torch.allclose(model.training_step(batch, 0), losses.mean()))
@@ -6,45 +6,175 @@
 
 #!/usr/bin/env python3
 
+import functools
 import logging
 import sys
 from dataclasses import dataclass
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 
 import pytorch_lightning as pl
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torchmetrics as metrics
 from hydra.core.config_store import ConfigStore
 from torchrec import EmbeddingBagCollection
 from torchrec import KeyedJaggedTensor
 from torchrec.datasets.utils import Batch
 from torchrec.models.dlrm import DLRM
+from torchrec.optim.keyed import KeyedOptimizerWrapper
 from torchrecipes.core.conf import ModuleConf
+from torchrecipes.rec.datamodules.commons import WeightedBatch
+from torchrecipes.rec.modules.embedding_cache import (
+    CachedEmbeddingBag,
+    cache_embedding_tables,
+)
+from torchrecipes.rec.modules.embedding_precision import (
+    embedding_storage_bytes,
+    get_embedding_dtype,
+    set_embedding_precision,
+)
+from torchrecipes.rec.modules.metrics import BinnedCTRMetrics
+from torchrecipes.rec.modules.sparse_optimizers import (
+    RowWiseSparseAdagrad,
+    RowWiseSparseAdam,
+    SingleClosureCombinedOptimizer,
+)
 from torchrecipes.utils.config_utils import get_class_name_str
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logger: logging.Logger = logging.getLogger()
 
+EMBEDDING_OPTIMIZERS = {
+    "rowwise_adagrad": RowWiseSparseAdagrad,
+    "rowwise_adam": RowWiseSparseAdam,
+}
+
 
 class UnshardedLightningDLRM(pl.LightningModule):
+    """DLRM trained on a single device.
+
+    Args:
+        embedding_bag_collection: Embedding tables of the sparse features.
+        dense_in_features: Number of dense features.
+        dense_arch_layer_sizes: Layer sizes of the dense arch.
+        over_arch_layer_sizes: Layer sizes of the over arch.
+        use_sample_weights: If ``True``, the BCE loss of batches carrying row
+            weights, e.g. the ``WeightedBatch`` of an undersampling
+            ``CriteoDataModule``, is the weighted average over the rows, so that
+            undersampling does not bias the predicted CTR. The weights also
+            apply to the AUROC, NE and calibration.
+        num_metric_bins: Number of score bins of the AUROC, NE and calibration,
+            see ``BinnedCTRMetrics``. They are logged once per epoch.
+        embedding_optimizer: If set, the embedding tables produce sparse
+            gradients and are trained with this row-wise sparse optimizer, so
+            that a step only touches the rows looked up by the batch, while the
+            MLPs keep Adam. Options: {rowwise_adagrad, rowwise_adam}. Default:
+            None, Adam over all parameters.
+        embedding_lr: Learning rate of the embedding_optimizer. Default: None,
+            the default of the optimizer.
+        embedding_cache_dir: If set, the embedding tables are stored in
+            memory-mapped files of this directory, and only the
+            embedding_cache_rows hot rows of each table are kept in memory, see
+            ``torchrecipes.rec.modules.embedding_cache``. Create the
+            embedding_bag_collection on the meta device to never allocate the
+            full tables. Requires an embedding_optimizer, whose state of a
+            cache slot is reset when it is loaded with another row. The cache
+            hit rate and evictions are logged, and the rows of the batches read
+            ahead by a ``DevicePrefetcher`` are read in its background thread
+            and installed at their next lookup, see ``prefetch_batch``. The
+            table files are recreated unless embedding_cache_resume is set.
+            Default: None.
+        embedding_cache_resume: If ``True``, the table files of
+            embedding_cache_dir are reopened rather than recreated, to resume
+            from a checkpoint of the run that trained them. Default: False.
+        embedding_cache_rows: Number of rows cached per table.
+        embedding_cache_policy: Eviction policy of the cache. Options: {lru, lfu}.
+        embedding_data_type: Storage of the embedding weights, which are
+            dequantized to float32 on lookup, see
+            ``torchrecipes.rec.modules.embedding_precision``. fp16/bf16 halve
+            the tables, row-wise int8 quarters them. Tables other than fp32
+            require an embedding_optimizer, whose updates are added with
+            stochastic rounding. Options: {fp32, fp16, bf16, int8}.
+        embedding_state_data_type: Storage of the state of the
+            embedding_optimizer. fp16/bf16 states are updated with stochastic
+            rounding. Options: {fp32, fp16, bf16}.
+    """
+
     def __init__(
         self,
         embedding_bag_collection: EmbeddingBagCollection,
         dense_in_features: int,
         dense_arch_layer_sizes: List[int],
         over_arch_layer_sizes: List[int],
+        use_sample_weights: bool = False,
+        num_metric_bins: int = 10000,
+        embedding_optimizer: Optional[str] = None,
+        embedding_lr: Optional[float] = None,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_cache_rows: int = 100000,
+        embedding_cache_policy: str = "lru",
+        embedding_data_type: str = "fp32",
+        embedding_state_data_type: str = "fp32",
+        embedding_cache_resume: bool = False,
     ) -> None:
         super().__init__()
+        if (
+            embedding_optimizer is not None
+            and embedding_optimizer not in EMBEDDING_OPTIMIZERS
+        ):
+            raise ValueError(
+                f"Unknown embedding_optimizer {embedding_optimizer}. Please choose {{{', '.join(EMBEDDING_OPTIMIZERS)}}} for embedding_optimizer"
+            )
+        if embedding_cache_dir is not None and embedding_optimizer is None:
+            raise ValueError("embedding_cache_dir requires an embedding_optimizer.")
+        if embedding_data_type != "fp32":
+            get_embedding_dtype(embedding_data_type)
+            if embedding_optimizer is None:
+                raise ValueError(
+                    f"embedding_data_type {embedding_data_type} requires an embedding_optimizer."
+                )
+            if embedding_cache_dir is not None:
+                raise ValueError(
+                    "embedding_cache_dir requires the fp32 embedding_data_type."
+                )
+        if embedding_state_data_type not in ("fp32", "fp16", "bf16"):
+            raise ValueError(
+                f"Unknown embedding_state_data_type {embedding_state_data_type}. Please choose {{fp32, fp16, bf16}} for embedding_state_data_type"
+            )
+        set_embedding_precision(embedding_bag_collection, embedding_data_type)
+        logger.info(
+            f"Embedding tables of {embedding_data_type}: {embedding_storage_bytes(embedding_bag_collection)} bytes"
+        )
+        self.cached_tables: Dict[str, CachedEmbeddingBag] = (
+            {}
+            if embedding_cache_dir is None
+            else cache_embedding_tables(
+                embedding_bag_collection,
+                embedding_cache_dir,
+                embedding_cache_rows,
+                embedding_cache_policy,
+                resume=embedding_cache_resume,
+            )
+        )
         self.model: DLRM = DLRM(
             embedding_bag_collection=embedding_bag_collection,
             dense_in_features=dense_in_features,
             dense_arch_layer_sizes=dense_arch_layer_sizes,
             over_arch_layer_sizes=over_arch_layer_sizes,
         )
+        self.embedding_optimizer = embedding_optimizer
+        self.embedding_lr = embedding_lr
+        self.embedding_state_data_type = embedding_state_data_type
+        if embedding_optimizer is not None:
+            for embedding_bag in embedding_bag_collection.embedding_bags.values():
+                embedding_bag.sparse = True
         self.loss_fn: nn.Module = nn.BCEWithLogitsLoss()
+        self.use_sample_weights = use_sample_weights
         self.accuracy: metrics.Metric = metrics.Accuracy()
-        self.auroc: metrics.Metric = metrics.AUROC()
+        self.train_ctr_metrics = BinnedCTRMetrics(num_metric_bins)
+        self.val_ctr_metrics = BinnedCTRMetrics(num_metric_bins)
+        self.test_ctr_metrics = BinnedCTRMetrics(num_metric_bins)
 
     # pyre-ignore[14] - `forward` overrides method defined in `pl.core.lightning.LightningModule`
     def forward(
@@ -56,7 +186,92 @@ class UnshardedLightningDLRM(pl.LightningModule):
         return output.squeeze()
 
     def configure_optimizers(self) -> torch.optim.Optimizer:
-        return torch.optim.Adam(self.model.parameters())
+        embedding_optimizer = self.embedding_optimizer
+        if embedding_optimizer is None:
+            return torch.optim.Adam(self.model.parameters())
+        embedding_params = {
+            id(param)
+            for param in self.model.sparse_arch.embedding_bag_collection.parameters()
+        }
+        params = dict(self.model.named_parameters())
+        kwargs: Dict[str, Any] = {
+            "state_dtype": get_embedding_dtype(self.embedding_state_data_type)
+        }
+        if self.embedding_lr is not None:
+            kwargs["lr"] = self.embedding_lr
+        embedding_optimizers = []
+
+        def make_embedding_optimizer(
+            params: List[torch.Tensor],
+        ) -> torch.optim.Optimizer:
+            optimizer = EMBEDDING_OPTIMIZERS[embedding_optimizer](params, **kwargs)
+            embedding_optimizers.append(optimizer)
+            return optimizer
+
+        optimizer = SingleClosureCombinedOptimizer(
+            [
+                (
+                    "dense",
+                    KeyedOptimizerWrapper(
+                        {
+                            name: param
+                            for name, param in params.items()
+                            if id(param) not in embedding_params
+                        },
+                        torch.optim.Adam,
+                    ),
+                ),
+                (
+                    "embedding",
+                    KeyedOptimizerWrapper(
+                        {
+                            name: param
+                            for name, param in params.items()
+                            if id(param) in embedding_params
+                        },
+                        make_embedding_optimizer,
+                    ),
+                ),
+            ]
+        )
+        for cached_table in self.cached_tables.values():
+            cached_table.refill_hooks = [
+                functools.partial(
+                    embedding_optimizers[0].reset_state, cached_table.weight
+                )
+            ]
+        return optimizer
+
+    def prefetch_batch(self, batch: Batch) -> None:
+        """Reads the embedding cache rows of a batch ahead of its lookup."""
+        if not self.cached_tables:
+            return
+        features = batch.sparse_features.to_dict()
+        ebc = self.model.sparse_arch.embedding_bag_collection
+        for config in ebc.embedding_bag_configs():
+            self.cached_tables[config.name].prefetch(
+                torch.cat([features[name].values() for name in config.feature_names])
+            )
+
+    def _log_cache_stats(self, step_phase: str) -> None:
+        hits = misses = evictions = 0
+        for cached_table in self.cached_tables.values():
+            stats = cached_table.stats(reset=True)
+            hits += stats["hits"]
+            misses += stats["misses"]
+            evictions += stats["evictions"]
+        lookups = hits + misses
+        self.log(
+            f"{step_phase}_embedding_cache_hit_rate",
+            hits / lookups if lookups else 1.0,
+            on_epoch=True,
+        )
+        self.log(
+            f"{step_phase}_embedding_cache_evictions",
+            float(evictions),
+            on_epoch=True,
+            reduce_fx="sum",
+        )
 
     def _step(
         self,
@@ -64,26 +279,44 @@ class UnshardedLightningDLRM(pl.LightningModule):
         batch_idx: int,
         step_phase: str,
     ) -> torch.Tensor:
+        for cached_table in self.cached_tables.values():
+            cached_table.begin_batch()
         logits = self.forward(
             dense_features=batch.dense_features,
             sparse_features=batch.sparse_features,
         )
-        loss = self.loss_fn(logits, batch.labels.float())
+        weights: Optional[torch.Tensor] = None
+        if self.use_sample_weights and isinstance(batch, WeightedBatch):
+            weights = batch.weights.to(logits.dtype)
+            loss = (
+                F.binary_cross_entropy_with_logits(
+                    logits, batch.labels.float(), weight=weights, reduction="sum"
+                )
+                / weights.sum()
+            )
+        else:
+            loss = self.loss_fn(logits, batch.labels.float())
         preds = torch.sigmoid(logits)
         accuracy = self.accuracy(preds, batch.labels)
 
         self.log(f"{step_phase}_accuracy", accuracy)
         self.log(f"{step_phase}_loss", loss)
+        getattr(self, f"{step_phase}_ctr_metrics").update(preds, batch.labels, weights)
+        if self.cached_tables:
+            self._log_cache_stats(step_phase)
 
-        if 1 in batch.labels and 0 in batch.labels:
-            auroc = self.auroc(preds, batch.labels)
-            self.log(f"{step_phase}_auroc", auroc)
-        else:
+        return loss
+
+    def _log_ctr_metrics(self, step_phase: str) -> None:
+        ctr_metrics = getattr(self, f"{step_phase}_ctr_metrics")
+        # sums the histograms across ranks
+        values = ctr_metrics.compute()
+        ctr_metrics.reset()
+        if torch.isnan(values["auroc"]):
             logger.warning(
-                f"{step_phase}:Could not compute AUROC. The labels were missing either a positive or negative sample."
+                f"{step_phase}:Could not compute AUROC. The labels of the epoch were missing either a positive or negative sample."
             )
-
-        return loss
+        self.log_dict({f"{step_phase}_{name}": v for name, v in values.items()})
 
     def training_step(
         self,
@@ -112,10 +345,29 @@ class UnshardedLightningDLRM(pl.LightningModule):
     ) -> torch.Tensor:
         return self._step(batch, batch_idx, "test")
 
+    def on_train_epoch_end(self) -> None:
+        self._log_ctr_metrics("train")
+        for cached_table in self.cached_tables.values():
+            cached_table.flush()
+
+    def on_save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        # the table files hold the embeddings, the checkpoint only the cache
+        # and the rows of its slots
+        for cached_table in self.cached_tables.values():
+            cached_table.flush()
+
+    def on_validation_epoch_end(self) -> None:
+        self._log_ctr_metrics("val")
+
+    def on_test_epoch_end(self) -> None:
+        self._log_ctr_metrics("test")
+
 
 @dataclass
 class UnshardedLightningDLRMModuleConf(ModuleConf):
     _target_: str = get_class_name_str(UnshardedLightningDLRM)
+    embedding_data_type: str = "fp32"
+    embedding_state_data_type: str = "fp32"
 
 
 cs: ConfigStore = ConfigStore.instance()
@@ -4,7 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 from dataclasses import dataclass, field
-from typing import List, Optional, Tuple
+from typing import Any, List, Optional, Tuple, Union
 
 import hydra
 import pytorch_lightning as pl
@@ -23,6 +23,7 @@ from torchrecipes.utils.config_utils import (
     config_entry,
     get_class_config_method,
 )
+from torchrecipes.utils.loader_autotune import resolve_num_workers
 from torchtext.functional import to_tensor
 
 
@@ -37,9 +38,10 @@ class DocClassificationDataModule(pl.LightningDataModule):
         columns: List[str],
         label_column: str,
         batch_size: int,
-        num_workers: int = 0,
+        num_workers: Union[int, str] = 0,
         drop_last: bool = False,
         pin_memory: bool = False,
+        autotune_memory_budget: Optional[int] = None,
     ) -> None:
         super().__init__()
         self.train_dataset = train_dataset
@@ -56,6 +58,7 @@ class DocClassificationDataModule(pl.LightningDataModule):
         self.num_workers = num_workers
         self.drop_last = drop_last
         self.pin_memory = pin_memory
+        self.autotune_memory_budget = autotune_memory_budget
 
     @config_entry
     @staticmethod
@@ -65,9 +68,10 @@ class DocClassificationDataModule(pl.LightningDataModule):
         columns: List[str],
         label_column: str,
         batch_size: int,
-        num_workers: int = 0,
+        num_workers: Union[int, str] = 0,
         drop_last: bool = False,
         pin_memory: bool = False,
+        autotune_memory_budget: Optional[int] = None,
     ) -> "DocClassificationDataModule":
         train_dataset, val_dataset, test_dataset = hydra.utils.call(dataset)
         text_transform = hydra.utils.instantiate(transform.transform, _recursive_=False)
@@ -93,9 +97,14 @@ class DocClassificationDataModule(pl.LightningDataModule):
             num_workers=num_workers,
             drop_last=drop_last,
             pin_memory=pin_memory,
+            autotune_memory_budget=autotune_memory_budget,
         )
 
-    def _get_data_loader(self, dataset: IterDataPipe[Tuple[str, str]]) -> DataLoader:
+    def _get_data_loader(
+        self,
+        dataset: IterDataPipe[Tuple[str, str]],
+        num_workers: Optional[int] = None,
+    ) -> DataLoader:
         dataset = dataset.batch(self.batch_size).rows2columnar(self.columns)
         dataset = dataset.map(self.transform)
         if self.label_transform:
@@ -118,12 +127,29 @@ class DocClassificationDataModule(pl.LightningDataModule):
             dataset,
             batch_size=None,
             shuffle=False,
-            num_workers=self.num_workers,
+            num_workers=self._num_workers() if num_workers is None else num_workers,
             drop_last=self.drop_last,
             pin_memory=self.pin_memory,
             worker_init_fn=worker_init_fn,
         )
 
+    def _num_workers(self) -> int:
+        # "auto" is resolved by probing the train dataloader the first time a
+        # dataloader is built, as there is no setup() to probe in
+        self.num_workers = resolve_num_workers(
+            self.num_workers,
+            lambda num_workers: self._get_data_loader(
+                self.train_dataset, num_workers=num_workers
+            ),
+            {
+                "datamodule": type(self).__name__,
+                "batch_size": self.batch_size,
+                "columns": self.columns,
+            },
+            self.autotune_memory_budget,
+        )
+        return self.num_workers
+
     def train_dataloader(self) -> DataLoader:
         return self._get_data_loader(self.train_dataset)
 
@@ -142,9 +168,10 @@ class DocClassificationDataModuleConf(DataModuleConf):
     columns: List[str] = field(default_factory=lambda: ["text", "label"])
     label_column: str = "label"
     batch_size: int = 16
-    num_workers: int = 0
+    num_workers: Any = 0  # pyre-ignore[4]: Union[int, str]
     drop_last: bool = False
     pin_memory: bool = False
+    autotune_memory_budget: Optional[int] = None
 
 
 cs: ConfigStore = ConfigStore.instance()
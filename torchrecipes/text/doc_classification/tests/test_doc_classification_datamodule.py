@@ -8,6 +8,9 @@
 
 # pyre-strict
 
+import os
+import tempfile
+from typing import Union
 from unittest.mock import patch
 
 import hydra
@@ -27,6 +30,7 @@ from torchrecipes.text.doc_classification.tests.common.assets import get_asset_p
 from torchrecipes.text.doc_classification.transform.doc_classification_text_transform import (
     DocClassificationTextTransformConf,
 )
+from torchrecipes.utils.loader_autotune import CACHE_ENV
 
 
 class TestDocClassificationDataModule(testslide.TestCase):
@@ -42,7 +46,9 @@ class TestDocClassificationDataModule(testslide.TestCase):
         self.patcher.stop()
         super().tearDown()
 
-    def get_datamodule(self) -> DocClassificationDataModule:
+    def get_datamodule(
+        self, num_workers: Union[int, str] = 0
+    ) -> DocClassificationDataModule:
         doc_transform_conf = DocClassificationTextTransformConf(
             vocab_path=get_asset_path("vocab_example.pt"),
             spm_model_path=get_asset_path("spm_example.model"),
@@ -59,6 +65,7 @@ class TestDocClassificationDataModule(testslide.TestCase):
             columns=["text", "label"],
             label_column="label",
             batch_size=8,
+            num_workers=num_workers,
         )
         return hydra.utils.instantiate(
             datamodule_conf,
@@ -77,3 +84,12 @@ class TestDocClassificationDataModule(testslide.TestCase):
 
         self.assertEqual(batch["label_ids"].size(), torch.Size([8]))
         self.assertEqual(batch["token_ids"].size(), torch.Size([8, 35]))
+
+    def test_doc_classification_datamodule_auto_num_workers(self) -> None:
+        cache_path = os.path.join(tempfile.mkdtemp(), "autotune.json")
+        with patch.dict(os.environ, {CACHE_ENV: cache_path}):
+            datamodule = self.get_datamodule(num_workers="auto")
+            batch = next(iter(datamodule.train_dataloader()))
+            self.assertIsInstance(datamodule.num_workers, int)
+            self.assertTrue(os.path.exists(cache_path))
+        self.assertEqual(batch["label_ids"].size(), torch.Size([8]))
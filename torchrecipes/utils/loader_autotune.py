@@ -0,0 +1,282 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+"""Picks the number of dataloader workers, and optionally a read chunk size, by
+timing a short probe of the loader with every candidate setting.
+
+Every candidate loader is iterated for at most ``max_batches`` batches or
+``max_seconds`` seconds. The throughput is measured after the first batch, so
+that worker startup is not counted, and the memory is the peak resident set
+size of the process and its workers sampled after every batch. The fastest
+setting within the memory budget wins, and the cheapest setting within
+``tolerance`` of it is preferred so that timing noise does not buy extra
+workers. The choice is logged and cached in a JSON file per host and loader
+config, so later runs skip the probe.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+from dataclasses import asdict, dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import psutil
+import torch
+from torchrecipes.utils.distributed_utils import get_rank
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+# environment variable overriding the default cache file
+CACHE_ENV = "TORCHRECIPES_AUTOTUNE_CACHE"
+
+
+@dataclass
+class LoaderSetting:
+    num_workers: int
+    chunk_size: Optional[int] = None
+    batches_per_sec: float = 0.0
+    peak_bytes: int = 0
+
+
+def default_cache_path() -> str:
+    return os.environ.get(
+        CACHE_ENV,
+        os.path.join(
+            os.path.expanduser("~"), ".cache", "torchrecipes", "loader_autotune.json"
+        ),
+    )
+
+
+def default_num_workers() -> List[int]:
+    """0 and the powers of 2 up to the number of CPUs."""
+    cpus = os.cpu_count() or 1
+    candidates = [0]
+    n = 1
+    while n <= cpus:
+        candidates.append(n)
+        n *= 2
+    return candidates
+
+
+def _rss(process: psutil.Process) -> int:
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            # the worker exited meanwhile
+            pass
+    return total
+
+
+def probe(
+    loader: Iterable[Any],  # pyre-ignore[2]
+    max_batches: int = 20,
+    max_seconds: float = 5.0,
+) -> LoaderSetting:
+    """Times the first batches of ``loader``.
+
+    Returns:
+        A setting holding the batches/s after the first batch and the peak RSS of
+        the process and its children, with num_workers left to 0.
+    """
+    process = psutil.Process()
+    peak = _rss(process)
+    iterator = iter(loader)
+    num_batches = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    for _ in iterator:
+        peak = max(peak, _rss(process))
+        if num_batches == 0:
+            # worker startup and the first batch are not counted
+            start = time.perf_counter()
+        num_batches += 1
+        elapsed = time.perf_counter() - start
+        if num_batches > max_batches or elapsed > max_seconds:
+            break
+    # shuts the workers down
+    del iterator
+    rate = (num_batches - 1) / elapsed if num_batches > 1 and elapsed > 0 else 0.0
+    return LoaderSetting(num_workers=0, batches_per_sec=rate, peak_bytes=peak)
+
+
+def _cache_key(config: Mapping[str, Any]) -> str:
+    host = {"host": socket.gethostname(), "cpus": os.cpu_count()}
+    payload = json.dumps({**host, **config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _load_cache(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: str, key: str, setting: LoaderSetting) -> None:
+    cache = _load_cache(path)
+    cache[key] = asdict(setting)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write the loader autotune cache {path}: {e}")
+
+
+def _select(
+    results: List[LoaderSetting], memory_budget: int, tolerance: float
+) -> LoaderSetting:
+    within = [r for r in results if r.peak_bytes <= memory_budget]
+    if not within:
+        lightest = min(results, key=lambda r: r.peak_bytes)
+        logger.warning(
+            f"No loader setting stays under the memory budget of {memory_budget}"
+            f" bytes, using the lightest one: {lightest}"
+        )
+        return lightest
+    best = max(r.batches_per_sec for r in within)
+    # results are ordered from the cheapest setting on
+    return next(r for r in within if r.batches_per_sec >= best * (1 - tolerance))
+
+
+def _tune(
+    make_loader: Callable[[int, Optional[int]], Iterable[Any]],
+    num_workers: Sequence[int],
+    chunk_sizes: Sequence[Optional[int]],
+    memory_budget: Optional[int],
+    max_batches: int,
+    max_seconds: float,
+    tolerance: float,
+) -> LoaderSetting:
+    if memory_budget is None:
+        memory_budget = psutil.virtual_memory().available // 2
+    results = []
+    for workers in sorted(num_workers):
+        for chunk_size in chunk_sizes:
+            result = probe(make_loader(workers, chunk_size), max_batches, max_seconds)
+            result.num_workers = workers
+            result.chunk_size = chunk_size
+            logger.debug(f"Loader probe: {result}")
+            results.append(result)
+    return _select(results, memory_budget, tolerance)
+
+
+def autotune_loader(
+    make_loader: Callable[[int, Optional[int]], Iterable[Any]],
+    config: Mapping[str, Any],
+    num_workers: Optional[Sequence[int]] = None,
+    chunk_sizes: Sequence[Optional[int]] = (None,),
+    memory_budget: Optional[int] = None,
+    max_batches: int = 20,
+    max_seconds: float = 5.0,
+    tolerance: float = 0.05,
+    cache_path: Optional[str] = None,
+) -> LoaderSetting:
+    """Picks the fastest loader setting within a memory budget.
+
+    In distributed runs, rank 0 probes and broadcasts its choice, so that all
+    ranks shard the data over the same number of workers.
+
+    Args:
+        make_loader: Builds the loader to probe from a number of workers and a
+            chunk size.
+        config: JSON serializable description of the loader, e.g. the class
+            and arguments of the data module. Together with the host name and
+            the candidates, it keys the cache.
+        num_workers: Candidate numbers of workers. Default:
+            :func:`default_num_workers`.
+        chunk_sizes: Candidate chunk sizes passed to ``make_loader``.
+        memory_budget: Maximum peak RSS in bytes of the process and its
+            workers while probing. Default: half of the available memory.
+        max_batches: Maximum number of batches timed per candidate.
+        max_seconds: Maximum number of seconds timed per candidate.
+        tolerance: The cheapest setting at most this fraction slower than the
+            fastest one is picked.
+        cache_path: JSON file caching the choices. Default:
+            :func:`default_cache_path`.
+    """
+    num_workers = default_num_workers() if num_workers is None else num_workers
+    if not num_workers or not chunk_sizes:
+        raise ValueError("num_workers and chunk_sizes must not be empty.")
+    cache_path = default_cache_path() if cache_path is None else cache_path
+    key = _cache_key(
+        {
+            **config,
+            "num_workers": sorted(num_workers),
+            "chunk_sizes": list(chunk_sizes),
+            "memory_budget": memory_budget,
+        }
+    )
+
+    setting: Optional[LoaderSetting] = None
+    if get_rank() == 0:
+        cached = _load_cache(cache_path).get(key)
+        if cached is not None:
+            setting = LoaderSetting(**cached)
+            logger.info(f"Using the cached loader setting of {cache_path}: {setting}")
+        else:
+            setting = _tune(
+                make_loader,
+                num_workers,
+                chunk_sizes,
+                memory_budget,
+                max_batches,
+                max_seconds,
+                tolerance,
+            )
+            logger.info(f"Autotuned loader setting: {setting}")
+            _save_cache(cache_path, key, setting)
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        objects = [setting]
+        torch.distributed.broadcast_object_list(objects, src=0)
+        setting = objects[0]
+    assert setting is not None
+    return setting
+
+
+def resolve_num_workers(
+    num_workers: Union[int, str],
+    make_loader: Callable[[int], Iterable[Any]],
+    config: Mapping[str, Any],
+    memory_budget: Optional[int] = None,
+) -> int:
+    """Returns ``num_workers``, autotuned with :func:`autotune_loader` if it is
+    ``"auto"``.
+
+    Args:
+        num_workers: Number of workers, or ``"auto"``.
+        make_loader: Builds the loader to probe from a number of workers.
+        config: JSON serializable description of the loader.
+        memory_budget: See :func:`autotune_loader`.
+    """
+    if not isinstance(num_workers, str):
+        return num_workers
+    if num_workers != AUTO:
+        raise ValueError(
+            f"Unknown num_workers {num_workers}. Please choose an int or {AUTO} for num_workers"
+        )
+    return autotune_loader(
+        lambda workers, _: make_loader(workers), config, memory_budget=memory_budget
+    ).num_workers
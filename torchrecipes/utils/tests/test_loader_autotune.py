@@ -0,0 +1,73 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import json
+import os
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import testslide
+from torchrecipes.utils.loader_autotune import (
+    _select,
+    autotune_loader,
+    LoaderSetting,
+    probe,
+)
+
+
+class TestLoaderAutotune(testslide.TestCase):
+    def test_probe(self) -> None:
+        result = probe(range(100), max_batches=10)
+        self.assertGreater(result.batches_per_sec, 0)
+        self.assertGreater(result.peak_bytes, 0)
+        # a single batch has no throughput
+        self.assertEqual(probe(range(1)).batches_per_sec, 0.0)
+
+    def test_select(self) -> None:
+        results = [
+            LoaderSetting(0, batches_per_sec=10.0, peak_bytes=100),
+            LoaderSetting(1, batches_per_sec=98.0, peak_bytes=200),
+            LoaderSetting(2, batches_per_sec=100.0, peak_bytes=300),
+            LoaderSetting(4, batches_per_sec=400.0, peak_bytes=1000),
+        ]
+        # the cheapest setting within 5% of the fastest one under the budget
+        self.assertEqual(_select(results, 500, 0.05).num_workers, 1)
+        self.assertEqual(_select(results, 500, 0.0).num_workers, 2)
+        self.assertEqual(_select(results, 1000, 0.05).num_workers, 4)
+        # nothing fits, the lightest wins
+        self.assertEqual(_select(results, 10, 0.05).num_workers, 0)
+
+    def test_autotune_loader_cache(self) -> None:
+        cache_path = os.path.join(tempfile.mkdtemp(), "cache.json")
+        calls: List[Tuple[int, Optional[int]]] = []
+
+        def make_loader(num_workers: int, chunk_size: Optional[int]) -> Iterator[int]:
+            calls.append((num_workers, chunk_size))
+            return iter(range(5))
+
+        kwargs = {
+            "num_workers": [2, 0],
+            "chunk_sizes": [8, 16],
+            "cache_path": cache_path,
+            "max_batches": 3,
+        }
+        setting = autotune_loader(make_loader, {"name": "test"}, **kwargs)
+        self.assertEqual(calls, [(0, 8), (0, 16), (2, 8), (2, 16)])
+        self.assertIn((setting.num_workers, setting.chunk_size), calls)
+        with open(cache_path) as f:
+            self.assertEqual(len(json.load(f)), 1)
+
+        # cached per config
+        calls.clear()
+        self.assertEqual(
+            autotune_loader(make_loader, {"name": "test"}, **kwargs), setting
+        )
+        self.assertEqual(calls, [])
+        autotune_loader(make_loader, {"name": "other"}, **kwargs)
+        self.assertEqual(len(calls), 4)
+
+        with self.assertRaises(ValueError):
+            autotune_loader(make_loader, {}, num_workers=[], cache_path=cache_path)
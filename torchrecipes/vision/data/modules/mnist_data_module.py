@@ -16,6 +16,7 @@ from pytorch_lightning import LightningDataModule
 from pytorch_lightning.utilities.exceptions import MisconfigurationException
 from torch.utils.data import DataLoader, Dataset, random_split
 from torchrecipes.utils.config_utils import get_class_name_str
+from torchrecipes.utils.loader_autotune import resolve_num_workers
 from torchvision import transforms as transform_lib
 from torchvision.datasets import MNIST
 
@@ -26,7 +27,8 @@ class MNISTDataModule(LightningDataModule):
     Args:
         data_dir: Where to save/load the data
         val_split: Percent (float) or number (int) of samples to use for the validation split
-        num_workers: How many workers to use for loading data
+        num_workers: How many workers to use for loading data, or "auto" to pick it
+            in setup() by timing a short probe of the dataloader
         normalize: If true applies image normalize
         batch_size: How many samples per batch to load
         seed: Random seed to be used for train/val/test splits
@@ -37,13 +39,15 @@ class MNISTDataModule(LightningDataModule):
         tran_transforms: transforms for train dataset
         val_transforms: transforms for validation dataset
         test_transforms: transforms for test dataset
+        autotune_memory_budget: Maximum peak RSS in bytes of the "auto" num_workers,
+            half of the available memory if None
     """
 
     def __init__(
         self,
         data_dir: Optional[str] = None,
         val_split: Union[int, float] = 0.2,
-        num_workers: int = 16,
+        num_workers: Union[int, str] = 16,
         normalize: bool = False,
         batch_size: int = 32,
         seed: int = 42,
@@ -53,6 +57,7 @@ class MNISTDataModule(LightningDataModule):
         train_transforms: Optional[Callable] = None,  # pyre-ignore[24]
         val_transforms: Optional[Callable] = None,  # pyre-ignore[24]
         test_transforms: Optional[Callable] = None,  # pyre-ignore[24]
+        autotune_memory_budget: Optional[int] = None,
     ) -> None:
         super().__init__(
             train_transforms=train_transforms,
@@ -69,6 +74,7 @@ class MNISTDataModule(LightningDataModule):
         self.shuffle = shuffle
         self.pin_memory = pin_memory
         self.drop_last = drop_last
+        self.autotune_memory_budget = autotune_memory_budget
         # pyre-ignore[24]
         self.train_transforms: Callable = (
             train_transforms if train_transforms else self.default_transforms()
@@ -143,12 +149,34 @@ class MNISTDataModule(LightningDataModule):
                 self.data_dir, train=False, transform=self.test_transforms
             )
 
-    def _data_loader(self, dataset: Dataset, shuffle: bool = False) -> DataLoader:
+        phase = "test" if stage == "test" else "train"
+        if phase in self.datasets:
+            self.num_workers = resolve_num_workers(
+                self.num_workers,
+                lambda num_workers: self._data_loader(
+                    self.datasets[phase], num_workers=num_workers
+                ),
+                {
+                    "datamodule": type(self).__name__,
+                    "phase": phase,
+                    "data_dir": self.data_dir,
+                    "batch_size": self.batch_size,
+                    "normalize": self.normalize,
+                },
+                self.autotune_memory_budget,
+            )
+
+    def _data_loader(
+        self,
+        dataset: Dataset,
+        shuffle: bool = False,
+        num_workers: Optional[int] = None,
+    ) -> DataLoader:
         return DataLoader(
             dataset,
             batch_size=self.batch_size,
             shuffle=shuffle,
-            num_workers=self.num_workers,
+            num_workers=self.num_workers if num_workers is None else num_workers,
             drop_last=self.drop_last,
             pin_memory=self.pin_memory,
         )
@@ -185,13 +213,14 @@ class MNISTDataModuleConf:
     _target_: str = get_class_name_str(MNISTDataModule)
     data_dir: Optional[str] = None
     val_split: Any = 0.2  # pyre-ignore[4]: Union[int, float]
-    num_workers: int = 16
+    num_workers: Any = 16  # pyre-ignore[4]: Union[int, str]
     normalize: bool = False
     batch_size: int = 32
     seed: int = 42
     shuffle: bool = False
     pin_memory: bool = False
     drop_last: bool = False
+    autotune_memory_budget: Optional[int] = None
 
 
 cs = ConfigStore()
@@ -6,8 +6,10 @@
 
 #!/usr/bin/env python3
 
+import os
 import unittest
 from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
 import torch
 from hydra.core.config_store import ConfigStore
@@ -15,6 +17,7 @@ from hydra.experimental import compose, initialize
 from hydra.utils import instantiate
 from pytorch_lightning.utilities.exceptions import MisconfigurationException
 from torchrecipes.core.test_utils.conf_utils import conf_asdict
+from torchrecipes.utils.loader_autotune import CACHE_ENV, resolve_num_workers
 from torchrecipes.vision.data.modules.mnist_data_module import (
     MNISTDataModule,
     MNISTDataModuleConf,
@@ -62,6 +65,34 @@ class TestMNISTDataModule(unittest.TestCase):
         # pyre-fixme[6]: For 1st param expected `Sized` but got `Dataset[typing.Any]`.
         self.assertEqual(len(module.datasets["val"]), 100)
 
+    def test_auto_num_workers(self) -> None:
+        """Tests autotuning num_workers with the dataloader of the module."""
+        cache_path = os.path.join(self.data_path, "autotune.json")
+        with patch.dict(os.environ, {CACHE_ENV: cache_path}):
+            module = MNISTDataModule(
+                data_dir=self.data_path, batch_size=32, num_workers=0
+            )
+            module.prepare_data()
+            module.setup()
+            num_workers = resolve_num_workers(
+                "auto",
+                lambda n: module._data_loader(module.datasets["train"], num_workers=n),
+                {"datamodule": "MNISTDataModule", "batch_size": 32},
+            )
+            self.assertGreaterEqual(num_workers, 0)
+            self.assertTrue(os.path.exists(cache_path))
+
+            # setup() resolves "auto" the same way
+            module = MNISTDataModule(
+                data_dir=self.data_path, batch_size=32, num_workers="auto"
+            )
+            module.prepare_data()
+            module.setup()
+            self.assertIsInstance(module.num_workers, int)
+
+        with self.assertRaises(ValueError):
+            resolve_num_workers("many", lambda n: [], {})
+
     def test_transforms(self) -> None:
         """Tests images being transformed correctly."""
         transform_config = [
@@ -24,6 +24,7 @@ from torch.utils.data import (
 )
 from torchrecipes.core.conf import DataModuleConf
 from torchrecipes.utils.config_utils import get_class_name_str
+from torchrecipes.utils.loader_autotune import resolve_num_workers
 from torchvision.datasets.vision import VisionDataset
 
 
@@ -37,11 +38,14 @@ class TorchVisionDataModule(LightningDataModule):
         batch_size: How many samples per batch to load.
         drop_last: If true drops the last incomplete batch.
         normalize: If true applies image normalize.
-        num_workers: How many workers to use for loading data.
+        num_workers: How many workers to use for loading data, or "auto" to pick it
+            in setup() by timing a short probe of the dataloader.
         pin_memory: If true, the data loader will copy Tensors into CUDA pinned memory before
                     returning them.
         seed: Random seed to be used for train/val/test splits.
         val_split: Percent (float) or number (int) of samples to use for the validation split.
+        autotune_memory_budget: Maximum peak RSS in bytes of the "auto" num_workers,
+            half of the available memory if None.
     """
 
     def __init__(
@@ -50,10 +54,11 @@ class TorchVisionDataModule(LightningDataModule):
         batch_size: int = 32,
         drop_last: bool = False,
         normalize: bool = False,
-        num_workers: int = 16,
+        num_workers: Union[int, str] = 16,
         pin_memory: bool = False,
         seed: int = 42,
         val_split: Optional[Union[int, float]] = None,
+        autotune_memory_budget: Optional[int] = None,
     ) -> None:
         super().__init__()
         self.datasets = datasets
@@ -65,6 +70,7 @@ class TorchVisionDataModule(LightningDataModule):
         self.pin_memory = pin_memory
         self.seed = seed
         self.val_split = val_split
+        self.autotune_memory_budget = autotune_memory_budget
 
     def setup(self, stage: Optional[str] = None) -> None:
         """Creates train, val and test dataset."""
@@ -80,6 +86,23 @@ class TorchVisionDataModule(LightningDataModule):
                 self.datasets["val"] = dataset_val
                 logging.info("We have split part of the train set into val set!")
 
+        phase = "test" if stage == "test" else "train"
+        dataset = self.datasets.get(phase)
+        if dataset is not None:
+            self.num_workers = resolve_num_workers(
+                self.num_workers,
+                lambda num_workers: self._get_data_loader(
+                    dataset, phase, num_workers=num_workers
+                ),
+                {
+                    "datamodule": type(self).__name__,
+                    "dataset": type(dataset).__name__,
+                    "phase": phase,
+                    "batch_size": self.batch_size,
+                },
+                self.autotune_memory_budget,
+            )
+
     def _get_splits(self, dataset_len: int) -> List[int]:
         """Computes split lengths for train and validation set."""
         if isinstance(self.val_split, int):
@@ -103,7 +126,10 @@ class TorchVisionDataModule(LightningDataModule):
         return dataset_train, dataset_val
 
     def _get_data_loader(
-        self, dataset: Union[Subset[VisionDataset], VisionDataset], phase: str
+        self,
+        dataset: Union[Subset[VisionDataset], VisionDataset],
+        phase: str,
+        num_workers: Optional[int] = None,
     ) -> DataLoader:
         if phase == "train":
             sampler = RandomSampler(dataset)
@@ -113,7 +139,7 @@ class TorchVisionDataModule(LightningDataModule):
             dataset,
             sampler=sampler,
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
+            num_workers=self.num_workers if num_workers is None else num_workers,
             drop_last=self.drop_last,
             pin_memory=self.pin_memory,
         )
@@ -155,10 +181,11 @@ class TorchVisionDataModuleConf(DataModuleConf):
     batch_size: int = 32
     drop_last: bool = False
     normalize: bool = False
-    num_workers: int = 16
+    num_workers: Any = 16  # pyre-ignore[4]: Union[int, str]
     pin_memory: bool = False
     seed: int = 42
     val_split: Any = None  # pyre-ignore[4]: Union[int, float] # Omegaconf doesn't support Union types, although there are plans https://github.com/omry/omegaconf/issues/144
+    autotune_memory_budget: Optional[int] = None
 
 
 cs = ConfigStore()